@@ -24,10 +24,31 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 from netl2api.l2api.exceptions import *
 from netl2api.l2api.autocache import L2APIAutoCache
-from netl2api.l2api.transport import SysSSHTransport #, TransportManager
+from netl2api.l2api.snapshot import DeviceSnapshot
+from netl2api.l2api.transport import SysSSHTransport, TransportManager
 
 
-__all__ = ["L2API"]
+__all__ = ["L2API", "VLANS_PATCH_ON", "LAGS_PATCH_ON"]
+
+
+# write-through patchers (see L2APIAutoCache) of the show_vlans()/show_lags() responses:
+# vendors whose responses use the mutator arguments as keys (see L2API._cache_*_key())
+# opt in by adding these to the 'patch_on' of their cache_config
+VLANS_PATCH_ON = { "destroy_vlan":            "_patch_vlans_destroy_vlan",
+                   "enable_vlan":             "_patch_vlans_enable_vlan",
+                   "disable_vlan":            "_patch_vlans_disable_vlan",
+                   "change_vlan_description": "_patch_vlans_change_vlan_description",
+                   "interface_attach_vlan":   "_patch_vlans_interface_attach_vlan",
+                   "interface_detach_vlan":   "_patch_vlans_interface_detach_vlan",
+                   "lag_attach_vlan":         "_patch_vlans_lag_attach_vlan",
+                   "lag_detach_vlan":         "_patch_vlans_lag_detach_vlan" }
+
+LAGS_PATCH_ON  = { "destroy_lag":             "_patch_lags_destroy_lag",
+                   "enable_lag":              "_patch_lags_enable_lag",
+                   "disable_lag":             "_patch_lags_disable_lag",
+                   "change_lag_description":  "_patch_lags_change_lag_description",
+                   "lag_attach_interface":    "_patch_lags_lag_attach_interface",
+                   "lag_detach_interface":    "_patch_lags_lag_detach_interface" }
 
 
 class L2API(L2APIAutoCache):
@@ -36,6 +57,8 @@ class L2API(L2APIAutoCache):
     Vendor-specific classes should extend this, declare 'self.__VENDOR__' (vendor str),
     'self.__HWTYPE__' (hardware type str), 'self.prompt_mark', 'self.error_mark' and
     'self.config_term_cmd' (see transport classes for understand these three last parameters).
+    If 'max_connections' > 1, the transport is a TransportManager.TransportPool holding up to
+    'max_connections' CLI sessions, so the instance can be shared by concurrent threads.
 
     Ex.:
     class ExampleVendorAPI(L2API):
@@ -54,9 +77,14 @@ class L2API(L2APIAutoCache):
 
         def show_interfaces(self):
             ....
+
+    Mutations are validated against a DeviceSnapshot (see netl2api.l2api.snapshot);
+    'device_snapshot_class' is the vendor one.
     """
 
-    def __init__(self, host=None, port=None, username=None, passwd=None, transport=None):
+    device_snapshot_class = DeviceSnapshot
+
+    def __init__(self, host=None, port=None, username=None, passwd=None, transport=None, max_connections=None):
         super(L2API, self).__init__()
 
         if not hasattr(self, "__VENDOR__"):
@@ -79,6 +107,8 @@ class L2API(L2APIAutoCache):
             self.config_term_cmd = None
         if not transport:
             transport = SysSSHTransport.SysSSH
+        if type(max_connections) not in (type(None), int) or (max_connections is not None and max_connections < 1):
+            raise InvalidParameter("'max_connections' parameter is invalid")
 
         self.use_cache    = True
         self.cache_config = {
@@ -111,15 +141,24 @@ class L2API(L2APIAutoCache):
         }
 
 
-        #self.transport = TransportManager.TransportPool(transport=transport, max_connections=2, host=host, port=port,
-        #                                                username=username, passwd=passwd, prompt_mark=self.prompt_mark,
-        #                                                error_mark=self.error_mark, config_term_cmd=self.config_term_cmd)
-        self.transport = transport(host=host, port=port, username=username, passwd=passwd, prompt_mark=self.prompt_mark,
-                                        error_mark=self.error_mark, config_term_cmd=self.config_term_cmd)
+        if max_connections is not None and max_connections > 1:
+            self.transport = TransportManager.TransportPool(transport=transport, max_connections=max_connections, host=host, port=port,
+                                                            username=username, passwd=passwd, prompt_mark=self.prompt_mark,
+                                                            error_mark=self.error_mark, config_term_cmd=self.config_term_cmd)
+        else:
+            self.transport = transport(host=host, port=port, username=username, passwd=passwd, prompt_mark=self.prompt_mark,
+                                            error_mark=self.error_mark, config_term_cmd=self.config_term_cmd)
 
     def dump_config(self):
         raise NotImplementedError("Not implemented")
 
+    def stream_config(self):
+        """
+        Running-config, line by line (iterator) -- vendors able to stream the switch output
+        (see L2Transport.execute_stream()) override it; dump_config() is "\\r\\n".join(stream_config())
+        """
+        return iter(self.dump_config().splitlines())
+
     def save_config(self):
         raise NotImplementedError("Not implemented")
 
@@ -207,6 +246,81 @@ class L2API(L2APIAutoCache):
     def lag_detach_interface(self, lag_id=None, interface_id=None):
         raise NotImplementedError("Not implemented")
 
+    @staticmethod
+    def _cache_vlan_key(vlan_id):
+        return int(vlan_id)
+
+    @staticmethod
+    def _cache_lag_key(lag_id):
+        return int(lag_id)
+
+    def _cache_interface_key(self, interface_id):
+        """
+        Interface id as used by the show_vlans()/show_lags() responses (vendors accepting aliases
+        normalize it like their mutators do)
+        """
+        return interface_id
+
+    def _patch_vlans_destroy_vlan(self, vlans, vlan_id=None):
+        del(vlans[self._cache_vlan_key(vlan_id)])
+        return vlans
+
+    def _patch_vlans_enable_vlan(self, vlans, vlan_id=None):
+        vlans[self._cache_vlan_key(vlan_id)]["enabled"] = True
+        return vlans
+
+    def _patch_vlans_disable_vlan(self, vlans, vlan_id=None):
+        vlans[self._cache_vlan_key(vlan_id)]["enabled"] = False
+        return vlans
+
+    def _patch_vlans_change_vlan_description(self, vlans, vlan_id=None, vlan_description=None):
+        vlans[self._cache_vlan_key(vlan_id)]["description"] = vlan_description or None
+        return vlans
+
+    def _patch_vlans_interface_attach_vlan(self, vlans, interface_id=None, vlan_id=None, tagged=True):
+        vlans[self._cache_vlan_key(vlan_id)]["attached_interfaces"][self._cache_interface_key(interface_id)] = \
+            "tagged" if bool(tagged) is True else "untagged"
+        return vlans
+
+    def _patch_vlans_interface_detach_vlan(self, vlans, interface_id=None, vlan_id=None, tagged=True):
+        del(vlans[self._cache_vlan_key(vlan_id)]["attached_interfaces"][self._cache_interface_key(interface_id)])
+        return vlans
+
+    def _patch_vlans_lag_attach_vlan(self, vlans, lag_id=None, vlan_id=None, tagged=True):
+        vlans[self._cache_vlan_key(vlan_id)]["attached_lags"][self._cache_lag_key(lag_id)] = \
+            "tagged" if bool(tagged) is True else "untagged"
+        return vlans
+
+    def _patch_vlans_lag_detach_vlan(self, vlans, lag_id=None, vlan_id=None, tagged=True):
+        del(vlans[self._cache_vlan_key(vlan_id)]["attached_lags"][self._cache_lag_key(lag_id)])
+        return vlans
+
+    def _patch_lags_destroy_lag(self, lags, lag_id=None):
+        del(lags[self._cache_lag_key(lag_id)])
+        return lags
+
+    def _patch_lags_enable_lag(self, lags, lag_id=None):
+        lags[self._cache_lag_key(lag_id)]["enabled"] = True
+        return lags
+
+    def _patch_lags_disable_lag(self, lags, lag_id=None):
+        lags[self._cache_lag_key(lag_id)]["enabled"] = False
+        return lags
+
+    def _patch_lags_change_lag_description(self, lags, lag_id=None, lag_description=None):
+        lags[self._cache_lag_key(lag_id)]["description"] = lag_description or None
+        return lags
+
+    def _patch_lags_lag_attach_interface(self, lags, lag_id=None, interface_id=None):
+        attached = lags[self._cache_lag_key(lag_id)]["attached_interfaces"]
+        if self._cache_interface_key(interface_id) not in attached:
+            attached.append(self._cache_interface_key(interface_id))
+        return lags
+
+    def _patch_lags_lag_detach_interface(self, lags, lag_id=None, interface_id=None):
+        lags[self._cache_lag_key(lag_id)]["attached_interfaces"].remove(self._cache_interface_key(interface_id))
+        return lags
+
     # def __del__(self):
     #     if self.transport is not None:
     #         try:
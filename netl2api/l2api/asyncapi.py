@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+from netl2api.l2api.exceptions import *
+from netl2api.l2api.transport.IOLoop import Future, FutureTimeout, coroutine, gather, Return
+from netl2api.l2api.transport.TransportManager import TransportPool
+
+
+__all__ = ["AsyncL2API", "wait_all", "coroutine", "gather", "Return", "FutureTimeout"]
+
+
+_worker_pool      = None
+_worker_pool_lock = threading.Lock()
+
+
+def _get_worker_pool(workers):
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = ThreadPool(processes=workers)
+    return _worker_pool
+
+
+class AsyncL2API(object):
+    """
+        Non-blocking facade over a vendor L2API instance: every public method
+        (show_*, create_*, etc) returns an IOLoop.Future instead of the result.
+
+        Ex.:
+        sw = AsyncL2API(Force10(host="10.0.0.1", username="l2apiusername", passwd="p4zz",
+                                transport=AsyncSysSSHTransport.AsyncSysSSH))
+        f  = sw.show_interfaces()
+        ...
+        interfaces = f.result()
+
+        With the AsyncSysSSH transport (recommended), the switch I/O of every session runs on the
+        IOLoop thread. The vendor methods are blocking code (they sequence execute() calls and
+        parse the outputs): each in-flight vendor call holds one thread of a process-wide worker
+        pool ('workers' vendor calls run at once, the others wait in its queue). Calls on the same
+        instance are serialized, unless its transport is a TransportManager.TransportPool
+        (max_connections > 1).
+
+        execute_async() (raw commands) doesn't use the worker pool: with AsyncSysSSH, command
+        sequences written as IOLoop coroutines (see coroutine()) drive any number of devices
+        without a thread per device. Each session is still one ssh process (see AsyncSysSSH).
+
+        :swinst: Vendor L2API instance.
+            - type: L2API.
+            - ex: Force10(...)
+
+        :workers: Size of the process-wide worker pool (only used by the first instance).
+            - type: int.
+            - ex: 32
+    """
+
+    def __init__(self, swinst=None, workers=32):
+        if swinst is None:
+            raise InvalidParameter("'swinst' parameter is not defined or invalid")
+        if type(workers) is not int or workers < 1:
+            raise InvalidParameter("'workers' parameter is invalid")
+        self.swinst  = swinst
+        self._pool   = _get_worker_pool(workers)
+        self._lock   = None if isinstance(swinst.transport, TransportPool) else threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.swinst, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        def async_call(*args, **kwargs):
+            return self._submit(name, args, kwargs)
+        async_call.__name__ = name
+        async_call.__doc__  = attr.__doc__
+        return async_call
+
+    def _submit(self, name, args, kwargs):
+        future = Future()
+        self._pool.apply_async(self._run, (future, getattr(self.swinst, name), args, kwargs))
+        return future
+
+    def _run(self, future, method, args, kwargs):
+        try:
+            if self._lock is not None:
+                with self._lock:
+                    r = method(*args, **kwargs)
+            else:
+                r = method(*args, **kwargs)
+        except Exception, e:
+            future.set_exception(e)
+        else:
+            future.set_result(r)
+
+    def execute_async(self, cmd=None, interactions=None):
+        """
+        Raw command (see L2Transport.execute()). Sent by the IOLoop (no worker thread) if the
+        transport supports it (AsyncSysSSH) -- not serialized with the vendor method calls
+        """
+        execute_async = getattr(self.swinst.transport, "execute_async", None)
+        if execute_async is not None:
+            return execute_async(cmd=cmd, interactions=interactions)
+        future = Future()
+        self._pool.apply_async(self._run, (future, self.swinst.transport.execute, (),
+                                           {"cmd": cmd, "interactions": interactions}))
+        return future
+
+
+def wait_all(futures=None, timeout=None):
+    """
+    Wait for a list of futures. Returns a list of (result, exception) tuples (same order).
+    'timeout': seconds to wait for all of them (FutureTimeout if any is still running)
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    results  = []
+    for future in futures:
+        remaining = max(deadline - time.time(), 0) if deadline is not None else None
+        e = future.exception(timeout=remaining)
+        results.append((None, e) if e is not None else (future.result(), None))
+    return results
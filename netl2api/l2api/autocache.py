@@ -22,11 +22,418 @@
 __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
+import logging
+import threading
+from copy import deepcopy
 from time import time
+from types import FunctionType
+from inspect import getcallargs
+from functools import wraps
 from netl2api.l2api.exceptions import *
+from netl2api.lib.utils import LRUCache
+from netl2api.l2api.transport.TransportMetrics import transport_metrics
 
+try:
+    from cPickle import dumps, loads, HIGHEST_PROTOCOL
+except ImportError:
+    from pickle import dumps, loads, HIGHEST_PROTOCOL
 
-__all__ = ["L2APIAutoCache"]
+try:
+    from redis.exceptions import WatchError
+except ImportError:
+    class WatchError(Exception):
+        pass
+
+
+__all__ = ["L2APIAutoCache", "InstanceCacheBackend", "LocalCacheBackend", "RedisCacheBackend",
+           "TieredCacheBackend", "set_autocache_backend", "get_autocache_backend",
+           "configure_autocache_backend", "configure_autocache_write_through",
+           "configure_autocache_stale_if_error", "stale_served", "clear_local_autocache", "has_local_autocache"]
+
+
+CACHE_NOARG_KEY = "__full_resp__"
+
+_write_through_cfg = {"enabled": False, "reconcile_interval": 60}
+_stale_if_error    = 0
+# per thread: age (seconds) of the oldest stale response served by the current request (see stale_served())
+_stale_served      = threading.local()
+
+
+class InstanceCacheBackend(object):
+    """
+        Per-instance store (default): entries are kept as is (no copies) and die with the instance.
+
+        Backend interface (all keyed by device -- "host:port" of the instance transport):
+            get(device, method, fields) => ([entry or None, ...], generation); entry = (time, value)
+            set(device, method, field, entry, ttl, reset=False, generation=None)
+                reset: drop the other fields of 'method'.
+                generation: as returned by get() before calling the method -- the entry is not stored
+                if 'method' was cleared meanwhile (a result read before a change must not outlive it).
+            clear(device, methods)
+        'field' is the repr() of the normalized call arguments (see L2APIAutoCache._cache_arg_key()).
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, device, method, fields):
+        entries = self._entries.get(method) or {}
+        return [entries.get(field) for field in fields], None
+
+    def set(self, device, method, field, entry, ttl, reset=False, generation=None):
+        if reset is True or not self._entries.has_key(method):
+            self._entries[method] = {}
+        self._entries[method][field] = entry
+
+    def clear(self, device, methods):
+        for method in methods:
+            self._entries.pop(method, None)
+
+
+class LocalCacheBackend(object):
+    """
+        Process-wide LRU store shared by every L2API instance (and request) of this process.
+        Entries are pickled: callers never share (and can't corrupt) a cached object.
+
+        :max_entries: Max (device, method) entries.
+            - type: int.
+            - ex: 4096
+
+        :max_ttl: Upper bound (seconds) of the entries lifetime (None: cache_config ttl).
+            - type: int/float.
+    """
+
+    shared = True
+
+    def __init__(self, max_entries=4096, max_ttl=None):
+        self.max_ttl  = max_ttl
+        self._entries = LRUCache(max_entries=max_entries)
+        self._lock    = threading.Lock()
+        # clear() counter per (device, method) and clear_device() counters; never decrease
+        # (see InstanceCacheBackend)
+        self._generations        = {}
+        self._device_generations = {}
+        self._epoch              = 0
+
+    def _generation(self, device, method):
+        return (self._epoch, self._device_generations.get(device, 0), self._generations.get((device, method), 0))
+
+    def get(self, device, method, fields):
+        generation = self._generation(device, method)
+        cached     = self._entries.get((device, method))
+        if cached is None:
+            return [None] * len(fields), generation
+        entries = cached[0]
+        return [loads(entries[f]) if entries.has_key(f) else None for f in fields], generation
+
+    def set(self, device, method, field, entry, ttl, reset=False, generation=None):
+        if self.max_ttl is not None:
+            ttl = min(ttl, self.max_ttl)
+        entry = dumps(entry, HIGHEST_PROTOCOL)
+        with self._lock:
+            if generation is not None and generation != self._generation(device, method):
+                return
+            cached  = self._entries.get((device, method))
+            entries = dict(cached[0]) if cached is not None and reset is False else {}
+            entries[field] = entry
+            self._entries.set((device, method), entries, ttl)
+
+    def clear(self, device, methods):
+        with self._lock:
+            for method in methods:
+                self._generations[(device, method)] = self._generations.get((device, method), 0) + 1
+                self._entries.delete((device, method))
+
+    def clear_device(self, device=None):
+        """
+        Drop every entry of 'device' (None: of all devices) -- eg. changed through another process
+        """
+        with self._lock:
+            if device is None:
+                self._epoch += 1
+                self._entries.clear()
+                return
+            self._device_generations[device] = self._device_generations.get(device, 0) + 1
+            self._entries.delete_matching(lambda key: key[0] == device)
+
+
+class RedisCacheBackend(object):
+    """
+        Redis store shared by every netl2server process/host: one hash per (device, method)
+        ("l2api-cache:<device>:<method>", field => pickled entry), so a lookup (field + full
+        response) is a single HMGET and an invalidation a single DEL (+INCR of the
+        "l2api-cache-gen:<device>:<method>" generation, WATCHed by set()).
+        Redis errors are logged and handled as cache misses.
+
+        :redis_client: Object with a get_connection() method (see netl2api.lib.config.RedisClient).
+    """
+
+    shared = True
+
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_client
+        self._logger      = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def _rkey(device, method):
+        return "l2api-cache:%s:%s" % (device, method)
+
+    @staticmethod
+    def _genkey(device, method):
+        return "l2api-cache-gen:%s:%s" % (device, method)
+
+    def get(self, device, method, fields):
+        try:
+            pipe = self.redis_client.get_connection().pipeline(transaction=False)
+            pipe.hmget(self._rkey(device, method), fields)
+            pipe.get(self._genkey(device, method))
+            cached, generation = pipe.execute()
+            generation = generation or "0"
+        except Exception, e:
+            self._logger.error("Autocache (redis) lookup failed: %s" % e)
+            # no generation: the result of this call is not stored
+            return [None] * len(fields), False
+        return [loads(entry) if entry is not None else None for entry in cached], generation
+
+    def set(self, device, method, field, entry, ttl, reset=False, generation=None):
+        if generation is False:
+            return
+        rkey   = self._rkey(device, method)
+        genkey = self._genkey(device, method)
+        try:
+            pipe = self.redis_client.get_connection().pipeline(transaction=True)
+            try:
+                if generation is not None:
+                    pipe.watch(genkey)
+                    if (pipe.get(genkey) or "0") != generation:
+                        return
+                    pipe.multi()
+                if reset is True:
+                    pipe.delete(rkey)
+                pipe.hset(rkey, field, dumps(entry, HIGHEST_PROTOCOL))
+                pipe.expire(rkey, int(ttl) + 1)
+                pipe.execute()
+            finally:
+                pipe.reset()
+        except WatchError:
+            # cleared meanwhile
+            pass
+        except Exception, e:
+            self._logger.error("Autocache (redis) store failed: %s" % e)
+
+    def clear(self, device, methods):
+        if not methods:
+            return
+        try:
+            pipe = self.redis_client.get_connection().pipeline(transaction=True)
+            for method in methods:
+                pipe.incr(self._genkey(device, method))
+            pipe.delete(*[self._rkey(device, m) for m in methods])
+            pipe.execute()
+        except Exception, e:
+            # entries written before this error can only be dropped by their TTL
+            self._logger.error("Autocache (redis) invalidation failed: %s" % e)
+
+
+class TieredCacheBackend(object):
+    """
+        LocalCacheBackend in front of RedisCacheBackend. Local entries live at most
+        'local.max_ttl' seconds: the bound for seeing changes made through other processes/hosts
+        (changes made through this process clear both tiers).
+    """
+
+    shared = True
+
+    def __init__(self, local=None, remote=None):
+        self.local  = local
+        self.remote = remote
+
+    def get(self, device, method, fields):
+        entries, local_generation = self.local.get(device, method, fields)
+        missing = [f for f, entry in zip(fields, entries) if entry is None]
+        if not missing:
+            return entries, (local_generation, None)
+        remote_entries, remote_generation = self.remote.get(device, method, missing)
+        remote = dict(zip(missing, remote_entries))
+        return [entry if entry is not None else remote[f] for f, entry in zip(fields, entries)], \
+                   (local_generation, remote_generation)
+
+    def set(self, device, method, field, entry, ttl, reset=False, generation=None):
+        local_generation, remote_generation = generation or (None, None)
+        self.remote.set(device, method, field, entry, ttl, reset=reset, generation=remote_generation)
+        self.local.set(device, method, field, entry, ttl, reset=reset, generation=local_generation)
+
+    def clear(self, device, methods):
+        self.remote.clear(device, methods)
+        self.local.clear(device, methods)
+
+
+_autocache_backend = None
+def set_autocache_backend(backend=None):
+    """
+    Process-wide backend of the L2API instances created from now on (None: InstanceCacheBackend)
+    """
+    global _autocache_backend
+    _autocache_backend = backend
+
+
+def get_autocache_backend():
+    return _autocache_backend
+
+
+def clear_local_autocache(device=None):
+    """
+    Drop the entries of 'device' ("host:port"; None: all devices) kept in this process by the
+    "local" backend or the local tier of "local+redis": called when another process changed it
+    (see netl2api.server.http_cache.CacheInvalidationListener)
+    """
+    backend = _autocache_backend
+    if isinstance(backend, TieredCacheBackend):
+        backend = backend.local
+    if isinstance(backend, LocalCacheBackend):
+        backend.clear_device(device)
+
+
+def has_local_autocache():
+    return isinstance(_autocache_backend, (LocalCacheBackend, TieredCacheBackend))
+
+
+def configure_autocache_backend(backend="instance", local_max_entries=4096, local_ttl=5, redis_client=None):
+    """
+    set_autocache_backend() by name.
+
+        :backend: "instance" (per L2API instance), "local" (process-wide LRU),
+                  "redis" (shared by every process) or "local+redis".
+            - type: str.
+
+        :local_max_entries: Max (device, method) entries of the local store.
+            - type: int.
+
+        :local_ttl: "local+redis" only: max seconds an entry is served by the local tier.
+            - type: int/float.
+
+        :redis_client: see RedisCacheBackend.
+    """
+    if backend == "instance":
+        set_autocache_backend(None)
+    elif backend == "local":
+        set_autocache_backend(LocalCacheBackend(max_entries=local_max_entries))
+    elif backend == "redis":
+        set_autocache_backend(RedisCacheBackend(redis_client=redis_client))
+    elif backend == "local+redis":
+        set_autocache_backend(TieredCacheBackend(local=LocalCacheBackend(max_entries=local_max_entries, max_ttl=local_ttl),
+                                                 remote=RedisCacheBackend(redis_client=redis_client)))
+    else:
+        raise InvalidParameter("'backend' parameter is invalid (instance, local, redis or local+redis)")
+
+
+def configure_autocache_write_through(enabled=False, reconcile_interval=60):
+    """
+    Write-through mode: mutators listed in the 'patch_on' of a cached method apply their change
+    to its cached full response instead of dropping it (see L2APIAutoCache).
+
+        :enabled: Write-through on/off (off: 'patch_on' mutators clear the cache, as 'clear_on').
+            - type: bool.
+
+        :reconcile_interval: Max seconds a patched response is served before it is read
+                             again from the device (and compared with the patched one).
+            - type: int/float.
+            - ex: 60
+    """
+    _write_through_cfg.update({"enabled": enabled, "reconcile_interval": reconcile_interval})
+
+
+def configure_autocache_stale_if_error(stale_if_error=0):
+    """
+    Stale-if-error: when the device is unavailable (connection failures, open circuit breaker),
+    a cached response expired for up to 'stale_if_error' seconds is returned instead of the error.
+    Entries are kept for 'ttl' + 'stale_if_error' seconds. 0 disables it.
+
+        :stale_if_error: Seconds.
+            - type: int/float.
+            - ex: 600
+    """
+    global _stale_if_error
+    _stale_if_error = stale_if_error
+
+
+def stale_served(reset=False):
+    """
+    Age (seconds past its ttl) of the oldest stale (stale-if-error) response returned to this
+    thread since the last reset, None if none. Callers caching L2API results themselves
+    (eg. the HTTP cache) use it to not store them as fresh.
+    """
+    age = getattr(_stale_served, "age", None)
+    if reset is True:
+        _stale_served.age = None
+    return age
+
+
+class _AutoCacheDispatch(object):
+    """
+        Compiled 'cache_config': names of the cached methods and the reverse indexes
+        mutator => cache keys cleared by it and mutator => ((cache key, patcher), ...)
+        (shared by every instance with the same config)
+    """
+
+    def __init__(self, cache_config=None):
+        cache_config  = cache_config or {}
+        self.cached   = frozenset(cache_config.keys())
+        self.clear_on = {}
+        self.patch_on = {}
+        for cache_key, cache_opts in cache_config.iteritems():
+            patch_on = cache_opts.get("patch_on") or {}
+            for mutator in set(cache_opts.get("clear_on") or []).union(patch_on.keys()):
+                # a cached method is never a mutator (previous __getattribute__ behavior)
+                if mutator in self.cached:
+                    continue
+                self.clear_on.setdefault(mutator, []).append(cache_key)
+                if patch_on.has_key(mutator):
+                    self.patch_on.setdefault(mutator, []).append((cache_key, patch_on[mutator]))
+        self.clear_on = dict([(m, tuple(k)) for m, k in self.clear_on.iteritems()])
+        self.patch_on = dict([(m, tuple(p)) for m, p in self.patch_on.iteritems()])
+
+    @staticmethod
+    def signature(cache_config):
+        return frozenset([(k, tuple(v.get("clear_on") or []), tuple(sorted((v.get("patch_on") or {}).items()))) \
+                              for k, v in cache_config.iteritems()])
+
+
+def _autocache_method(name, f):
+    """
+    Wrapper (generated once per class and method) of a cached or 'clear_on' method
+    """
+    @wraps(f)
+    def autocache_method(self, *args, **kwargs):
+        autocache = self._autocache
+        if name in autocache.cached:
+            return self._cache_opt(f.__get__(self, self.__class__), *args, **kwargs)
+        r = f(self, *args, **kwargs)
+        clear_keys = autocache.clear_on.get(name)
+        if clear_keys:
+            patches = autocache.patch_on.get(name)
+            if patches and _write_through_cfg["enabled"] is True:
+                self._cache_patch_keys(patches, clear_keys, f, args, kwargs)
+            else:
+                self._cache_clear_keys(clear_keys)
+        return r
+    autocache_method._autocache_wrapped = f
+    return autocache_method
+
+
+class _AutoCacheMeta(type):
+    """
+        Compiles the instance 'cache_config' once the instance is fully built (vendor
+        __init__() may still update it after L2APIAutoCache.__init__()). Wrappers are
+        installed once per class (see L2APIAutoCache._install_autocache()).
+    """
+
+    def __call__(cls, *args, **kwargs):
+        obj = super(_AutoCacheMeta, cls).__call__(*args, **kwargs)
+        obj.reload_cache_config()
+        return obj
 
 
 class L2APIAutoCache(object):
@@ -35,6 +442,17 @@ class L2APIAutoCache(object):
         L2API base classes should extend this, declare 'self.use_cache' (bool) and
         'self.cache_config' (dict with cache ttl/clear configuration).
 
+        'cache_config' is compiled when the instance is created: the cached and the 'clear_on'
+        methods get wrappers generated once per class (no per-attribute-access hook). Call
+        reload_cache_config() after changing the 'cache_config' keys/'clear_on' lists of a
+        live instance ('ttl' changes are seen right away).
+
+        Write-through (see configure_autocache_write_through()): 'patch_on' maps a mutator to
+        the name of a method applying its change to the cached full response,
+        patcher(response, **mutator_args) => patched response. The patched response is served
+        until its 'ttl' (counted from the device read) or the reconcile interval expires;
+        a patcher error (eg. KeyError: entity not in the response) clears the entry instead.
+
         Ex.:
         class ExampleL2API(L2APIAutoCache):
             def __init__(self):
@@ -43,7 +461,8 @@ class L2APIAutoCache(object):
                      "show_version":    { "ttl":      300,
                                           "clear_on": [] },
                      "show_interfaces": { "ttl":      60,
-                                          "clear_on": ["change_interface", "remove_interface"] }
+                                          "clear_on": ["change_interface", "remove_interface"],
+                                          "patch_on": {"change_interface": "_patch_change_interface"} }
                 }
 
                 super(ExampleL2API, self).__init__()
@@ -54,27 +473,83 @@ class L2APIAutoCache(object):
                 ...
     """
 
+    __metaclass__ = _AutoCacheMeta
+
+    # nothing is cached/cleared until the instance is built (see _AutoCacheMeta)
+    _autocache = _AutoCacheDispatch()
+
     def __init__(self):
-        self._cached_attrs = {}
+        # see set_autocache_backend()
+        self._cache_backend = _autocache_backend or InstanceCacheBackend()
         if not hasattr(self, "use_cache"):
             self.use_cache = False
 
-    def __getattribute__(self, name):
-        attr = super(L2APIAutoCache, self).__getattribute__(name)
-        if not callable(attr):
-            return attr
-        if name in self.cache_config.keys():
-            def _cache_opt(*args, **kwargs):
-                return self._cache_opt(attr, *args, **kwargs)
-            return _cache_opt
-        else:
-            clear_keys = [k for k,v in self.cache_config.iteritems() \
-                                if name in v.get("clear_on")]
-            if len(clear_keys) == 0:
-                return attr
-            def _cache_clear_keys(*args, **kwargs):
-                return self._cache_clear_keys(clear_keys, attr, *args, **kwargs)
-            return _cache_clear_keys
+    @property
+    def shared_cache(self):
+        """
+        Cached entries are shared with other instances (see set_autocache_backend())
+        """
+        return self._cache_backend.shared
+
+    @property
+    def _cache_device(self):
+        transport = getattr(self, "transport", None)
+        if transport is None:
+            # not an L2API (no device): nothing to share
+            return "%s@%x" % (self.__class__.__name__, id(self))
+        return "%s:%s" % (transport.host, transport.port)
+
+    @staticmethod
+    def _cache_arg_key(f, args, kwargs):
+        """
+        Normalized call arguments: show_vlans("10") and show_vlans(vlan_id="10") share an entry.
+        CACHE_NOARG_KEY if no argument is set (full response), the argument value if only one is set
+        (looked up in the cached full response too), a tuple of sorted (name, value) otherwise
+        """
+        if not args and not kwargs:
+            return CACHE_NOARG_KEY
+        callargs = getcallargs(f, *args, **kwargs)
+        items    = sorted([(k, v) for k, v in callargs.iteritems() \
+                               if v is not None and v != () and v != {} and v is not f.im_self])
+        if not items:
+            return CACHE_NOARG_KEY
+        if len(items) == 1:
+            return items[0][1]
+        return tuple(items)
+
+    def reload_cache_config(self):
+        """
+        (Re)compile 'self.cache_config' (see class docstring)
+        """
+        self._autocache = self.__class__._install_autocache(getattr(self, "cache_config", None) or {})
+
+    @classmethod
+    def _install_autocache(cls, cache_config):
+        signature = _AutoCacheDispatch.signature(cache_config)
+        compiled  = cls.__dict__.get("_autocache_compiled")
+        if compiled is None:
+            compiled = {}
+            setattr(cls, "_autocache_compiled", compiled)
+        try:
+            return compiled[signature]
+        except KeyError:
+            pass
+        dispatch = _AutoCacheDispatch(cache_config)
+        for name in dispatch.cached.union(dispatch.clear_on.keys()):
+            cls._wrap_method(name)
+        compiled[signature] = dispatch
+        return dispatch
+
+    @classmethod
+    def _wrap_method(cls, name):
+        for klass in cls.__mro__:
+            if not klass.__dict__.has_key(name):
+                continue
+            f = klass.__dict__[name]
+            # plain methods only; an inherited wrapper is reused as is
+            if type(f) is FunctionType and not hasattr(f, "_autocache_wrapped"):
+                setattr(cls, name, _autocache_method(name, f))
+            return
 
     def _cache_opt(self, f, *args, **kwargs):
         use_cache = kwargs.get("use_cache") if hasattr(self, "cache_config") else False
@@ -91,44 +566,125 @@ class L2APIAutoCache(object):
         return f(*args, **kwargs)
 
     def _use_cache(self, f, *args, **kwargs):
-        func_name       = f.__name__
-        cache_noarg_key = "__full_resp__"
-        cache_f_key     = func_name
-        cache_arg_key   = cache_noarg_key
-        now             = time()
-        cache_is_valid  = lambda k: (now - k["time"]) <= self.cache_config[func_name]["ttl"]
-        if args:
-            cache_arg_key = args[0]
-        elif kwargs:
-            cache_arg_key = kwargs.values()[0]
-        if not self._cached_attrs.has_key(cache_f_key):
-            self._cached_attrs[cache_f_key] = {}
-        if self._cached_attrs[cache_f_key].has_key(cache_arg_key) and \
-                cache_is_valid(self._cached_attrs[cache_f_key][cache_arg_key]):
-            return self._cached_attrs[cache_f_key][cache_arg_key]["value"]
-        if cache_arg_key is not cache_noarg_key and \
-                self._cached_attrs[cache_f_key].has_key(cache_noarg_key) and \
-                type(self._cached_attrs[cache_f_key][cache_noarg_key]["value"]) is dict and \
-                self._cached_attrs[cache_f_key][cache_noarg_key]["value"].has_key(cache_arg_key) and \
-                cache_is_valid(self._cached_attrs[cache_f_key][cache_noarg_key]):
-            return { cache_arg_key: self._cached_attrs[cache_f_key][cache_noarg_key]["value"][cache_arg_key] }
-        r = f(*args, **kwargs)
-        if cache_arg_key is cache_noarg_key:
-            self._cached_attrs[cache_f_key] = {}
-        elif self._cached_attrs[cache_f_key].has_key(cache_noarg_key) and \
-                not cache_is_valid(self._cached_attrs[cache_f_key][cache_noarg_key]):
-            del(self._cached_attrs[cache_f_key][cache_noarg_key])
-        self._cached_attrs[cache_f_key][cache_arg_key] = { "time": now, "value": r }
+        func_name      = f.__name__
+        ttl            = self.cache_config[func_name]["ttl"]
+        now            = time()
+        reconcile      = _write_through_cfg["reconcile_interval"]
+        # entry: (device read time, response[, first patch time])
+        cache_is_valid = lambda e: e is not None and (now - e[0]) <= ttl and \
+                                       (len(e) < 3 or (now - e[2]) <= reconcile)
+        try:
+            cache_arg_key = self._cache_arg_key(f, args, kwargs)
+        except TypeError:
+            # invalid arguments: let the method itself raise
+            return f(*args, **kwargs)
+        backend = self._cache_backend
+        device  = self._cache_device
+        field   = repr(cache_arg_key)
+        if cache_arg_key is CACHE_NOARG_KEY:
+            (entry,), generation = backend.get(device, func_name, [field])
+            if cache_is_valid(entry):
+                return entry[1]
+            full_entry = None
+        else:
+            (entry, full_entry), generation = backend.get(device, func_name, [field, repr(CACHE_NOARG_KEY)])
+            if cache_is_valid(entry):
+                return entry[1]
+            try:
+                if cache_is_valid(full_entry) and type(full_entry[1]) is dict and \
+                        full_entry[1].has_key(cache_arg_key):
+                    return { cache_arg_key: full_entry[1][cache_arg_key] }
+            except TypeError:
+                # unhashable argument
+                pass
+        try:
+            r = f(*args, **kwargs)
+        except Exception, e:
+            stale = self._cache_stale_if_error(e, ttl, now, entry, full_entry if cache_arg_key is not CACHE_NOARG_KEY else None,
+                                               cache_arg_key)
+            if stale is None:
+                raise
+            logging.getLogger(self.__class__.__name__).warning("Autocache: device '%s' unavailable, %s() served stale (%ds past ttl): %s(%s)" \
+                                                                   % (device, func_name, stale[0], e.__class__.__name__, e))
+            return stale[1]
+        if cache_arg_key is CACHE_NOARG_KEY and entry is not None and len(entry) > 2 and \
+                (now - entry[0]) <= ttl and entry[1] != r:
+            # reconciliation of a patched response: a patcher missed something (or the device
+            # was changed by someone else)
+            transport_metrics.inc("netl2api_autocache_patch_drift_total", (("method", func_name),))
+            logging.getLogger(self.__class__.__name__).warning("Autocache: patched %s() response of '%s' differs from the device" \
+                                                                   % (func_name, device))
+        try:
+            # a new full response supersedes the per-argument entries
+            backend.set(device, func_name, field, (now, r), ttl + _stale_if_error, reset=cache_arg_key is CACHE_NOARG_KEY,
+                        generation=generation)
+        except Exception, e:
+            logging.getLogger(self.__class__.__name__).error("Autocache store of %s() failed: %s" % (func_name, e))
         return r
 
-    def _cache_clear_keys(self, clear_keys, f, *args, **kwargs):
-        r = f(*args, **kwargs)
-        for cachekey in clear_keys:
+    def _cache_stale_if_error(self, exc, ttl, now, entry, full_entry, cache_arg_key):
+        """
+        (age past ttl, response) of the freshest usable stale entry if 'exc' is a device failure
+        """
+        if _stale_if_error <= 0 or not isinstance(exc, (TransportCircuitOpen,) + \
+                getattr(getattr(self, "transport", None), "device_failures", ())):
+            return
+        candidates = []
+        if entry is not None:
+            candidates.append((entry, entry[1]))
+        if full_entry is not None and type(full_entry[1]) is dict:
             try:
-                del(self._cached_attrs[cachekey])
-            except KeyError:
+                if full_entry[1].has_key(cache_arg_key):
+                    candidates.append((full_entry, { cache_arg_key: full_entry[1][cache_arg_key] }))
+            except TypeError:
                 pass
-        return r
+        for cached, value in sorted(candidates, key=lambda c: -c[0][0]):
+            age = now - cached[0] - ttl
+            if age <= _stale_if_error:
+                age = max(age, 0)
+                _stale_served.age = max(age, getattr(_stale_served, "age", None) or 0)
+                return age, value
+
+    def _cache_clear_keys(self, clear_keys):
+        self._cache_backend.clear(self._cache_device, clear_keys)
+
+    def _cache_patch_keys(self, patches, clear_keys, f, args, kwargs):
+        backend    = self._cache_backend
+        device     = self._cache_device
+        field      = repr(CACHE_NOARG_KEY)
+        patched    = set()
+        try:
+            # decorated mutators (eg. with_device_snapshot()) keep the original in __wrapped__
+            callargs = getcallargs(getattr(f, "__wrapped__", f), self, *args, **kwargs)
+        except TypeError:
+            callargs = None
+        if callargs is not None:
+            callargs = dict([(k, v) for k, v in callargs.iteritems() if v is not self])
+            now      = time()
+            for cache_key, patcher in patches:
+                (entry,), generation = backend.get(device, cache_key, [field])
+                if entry is None or (now - entry[0]) > self.cache_config[cache_key]["ttl"]:
+                    continue
+                try:
+                    value = entry[1] if backend.shared is True else deepcopy(entry[1])
+                    value = getattr(self, patcher)(value, **callargs)
+                except Exception, e:
+                    logging.getLogger(self.__class__.__name__).debug("Autocache: %s() can't patch %s(): %s(%s)" \
+                                                                         % (f.__name__, cache_key, e.__class__.__name__, e))
+                    continue
+                # new generation: a read that started before the change can't overwrite the patch;
+                # the per-argument entries go away with it (served from the patched response)
+                backend.clear(device, [cache_key])
+                (_,), generation = backend.get(device, cache_key, [field])
+                backend.set(device, cache_key, field, (entry[0], value, entry[2] if len(entry) > 2 else now),
+                            self.cache_config[cache_key]["ttl"] + _stale_if_error, reset=True, generation=generation)
+                patched.add(cache_key)
+        clear_keys = [k for k in clear_keys if k not in patched]
+        if clear_keys:
+            self._cache_clear_keys(clear_keys)
 
     def clear_cache(self):
-        self._cached_attrs = {}
+        """
+        Drop the cached entries of this device (every instance of it with a shared backend)
+        """
+        self._cache_backend.clear(self._cache_device, list(self._autocache.cached))
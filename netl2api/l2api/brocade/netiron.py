@@ -24,6 +24,7 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 import re
 from netl2api.l2api import L2API
+from netl2api.l2api.snapshot import DeviceSnapshot, with_device_snapshot, get_device_snapshot
 from netl2api.l2api.utils import *
 from netl2api.l2api.brocade.netironres import *
 from netl2api.l2api.brocade.netironutils import *
@@ -31,10 +32,31 @@ from netl2api.l2api.brocade.netironchecks import *
 from netl2api.l2api.brocade.netironexceptions import *
 
 
-__all__ = ["NetIron"]
+__all__ = ["NetIron", "NetIronSnapshot"]
+
+
+class NetIronSnapshot(DeviceSnapshot):
+    """
+        vlans and lags views read (fresh, no autocache) from 'show running-config vlan' and
+        'show running-config lag', pipelined in one round trip when both are needed
+    """
+
+    def fetch_vlans(self):
+        if self._views.has_key("lags"):
+            raw_vlans = self.l2api.transport.execute("show running-config vlan")
+        else:
+            raw_vlans, raw_lags = self.l2api.transport.execute_many(["show running-config vlan",
+                                                                     "show running-config lag"])
+            self._views["lags"] = self.l2api._lags_from_runcfg(cisco_like_runcfg_parser(raw_lags))
+        return self.l2api._vlans_from_runcfg(cisco_like_runcfg_parser(raw_vlans), self._views["lags"])
+
+    def fetch_lags(self):
+        return self.l2api._lags_from_runcfg(cisco_like_runcfg_parser(self.l2api.transport.execute("show running-config lag")))
 
 
 class NetIron(L2API):
+    device_snapshot_class = NetIronSnapshot
+
     def __init__(self, *args, **kwargs):
         self.__VENDOR__      = "BROCADE"
         self.__HWTYPE__      = "stackable_switch"
@@ -48,7 +70,10 @@ class NetIron(L2API):
         self._RE_NETIRON_LAG_VLAN_DESC = re.compile(r"(\d+)\sname\s(.+)$")
 
     def dump_config(self):
-        return self.transport.execute("show running-config")
+        return "\r\n".join(self.stream_config())
+
+    def stream_config(self):
+        return self.transport.execute_stream("show running-config")
 
     def save_config(self):
         self.transport.execute("write memory")
@@ -97,8 +122,12 @@ class NetIron(L2API):
                         intf_id = m.group(1).strip()
                         interfaces_info[intf_id] = m.groupdict()
         else:
-            for module in self._show_port_modules().iterkeys():
-                for intf_st_l in self.transport.execute("show interfaces brief wide slot %s" % module).splitlines():
+            modules = self._show_port_modules().keys()
+            if not modules:
+                return interfaces_info
+            # all slots in one round trip
+            for raw_slot in self.transport.execute_many(["show interfaces brief wide slot %s" % module for module in modules]):
+                for intf_st_l in raw_slot.splitlines():
                     m = RE_SH_INTERFACE_STATUS_WIDE.search(intf_st_l)
                     if m:
                         intf_id = m.group(1).strip()
@@ -184,8 +213,12 @@ class NetIron(L2API):
         if interface_id is not None:
             interface_id = parse_interface_id(self.transport, interface_id)
             show_arp_cmd = "show mac-address interface %s" % interface_id
-        m = self.transport.execute(show_arp_cmd).splitlines()[6:]
-        for mm in m:
+        # interface => lag (read before the session is busy streaming the MAC table)
+        interfaces_lag = {}
+        for lg_id, lag_attrs in self.show_lags().iteritems():
+            for lag_intf in lag_attrs["attached_interfaces"]:
+                interfaces_lag.setdefault(lag_intf, lg_id)
+        for mm in skip_lines(self.transport.execute_stream(show_arp_cmd), head=6):
             spl = re.split("\s\s+", mm)
             if spl[0] in ("", "MAC Address"):
                 continue
@@ -204,7 +237,7 @@ class NetIron(L2API):
                 arp_info[mac] = { "vlan":      None,
                                   "lag":       None,
                                   "interface": None }
-            intf_lag  = self._find_interface_lag(intf_id)
+            intf_lag  = interfaces_lag.get(intf_id)
             intf_name = intf_lag or intf_id
             int_key   = "lag" if intf_lag is not None else "interface"
             #arp_info[mac]["interface"] = intf_id
@@ -227,12 +260,19 @@ class NetIron(L2API):
         return uplinks_info
 
     def show_vlans(self, vlan_id=None):
-        vlan_info      = {}
         show_vlans_cmd = "show running-config vlan"
         if vlan_id is not None:
             vlan_id = int(vlan_id)
             check_vlan_exists(self.transport, vlan_id)
-        for vln_id, vln_attrs in cisco_like_runcfg_parser(self.transport.execute(show_vlans_cmd)).iteritems():
+        lags = self.show_lags()
+        return self._vlans_from_runcfg(cisco_like_runcfg_parser(self.transport.execute_stream(show_vlans_cmd)),
+                                       lags, vlan_id=vlan_id)
+
+    def _vlans_from_runcfg(self, runcfg, lags, vlan_id=None):
+        vlan_info = {}
+        # LAG members are reported as the LAG (see _show_vlan_handle_interfaces())
+        intf_lags = dict([(intf, lg_id) for lg_id, lg_attrs in lags.iteritems() for intf in lg_attrs["attached_interfaces"]])
+        for vln_id, vln_attrs in runcfg.iteritems():
             m = self._RE_NETIRON_LAG_VLAN_DESC.search(vln_id)
             if not m:
                 continue
@@ -247,27 +287,29 @@ class NetIron(L2API):
             }
             vlan_tagged_ifs   = expand_brocade_interface_ids(" ".join(vln_attrs.get("vlan_tagged_ifs", "")))
             vlan_untagged_ifs = expand_brocade_interface_ids(" ".join(vln_attrs.get("vlan_untagged_ifs", "")))
-            self._show_vlan_handle_interfaces(vlan_info, vln_id, vlan_tagged_ifs, "tagged")
-            self._show_vlan_handle_interfaces(vlan_info, vln_id, vlan_untagged_ifs, "untagged")
-            if vlan_id is not None and vln_id != vlan_id:
-                break
+            self._show_vlan_handle_interfaces(vlan_info, vln_id, vlan_tagged_ifs, "tagged", intf_lags)
+            self._show_vlan_handle_interfaces(vlan_info, vln_id, vlan_untagged_ifs, "untagged", intf_lags)
         return vlan_info
 
-    def _show_vlan_handle_interfaces(self, vlan_info, vlan_id, interfaces, tagstr):
+    @staticmethod
+    def _show_vlan_handle_interfaces(vlan_info, vlan_id, interfaces, tagstr, intf_lags):
         for vlan_intf in interfaces:
-            intf_lag     = self._find_interface_lag(vlan_intf)
+            intf_lag     = intf_lags.get(vlan_intf)
             intf_name    = intf_lag or vlan_intf
             attached_key = "attached_lags" if intf_lag is not None else "attached_interfaces"
             vlan_info[vlan_id][attached_key][intf_name] = tagstr
 
     def show_lags(self, lag_id=None):
-        lag_info      = {}
         show_lags_cmd = "show running-config lag"
         if lag_id is not None:
             check_lag_exists(self.transport, lag_id)
             show_lags_cmd = "show running-config lag %s" % lag_id
             lag_id = int(lag_id)
-        for intf_id, intf_attrs in cisco_like_runcfg_parser(self.transport.execute(show_lags_cmd)).iteritems():
+        return self._lags_from_runcfg(cisco_like_runcfg_parser(self.transport.execute_stream(show_lags_cmd)), lag_id=lag_id)
+
+    def _lags_from_runcfg(self, runcfg, lag_id=None):
+        lag_info = {}
+        for intf_id, intf_attrs in runcfg.iteritems():
             m = self._RE_NETIRON_LAG_NAME_DESC.search(intf_id)
             if not m:
                 continue
@@ -283,12 +325,13 @@ class NetIron(L2API):
         return lag_info
 
     def _find_interface_lag(self, interface_id):
-        for lag_id, lag_attrs in self.show_lags().iteritems():
+        for lag_id, lag_attrs in get_device_snapshot(self).lags.iteritems():
             if interface_id in lag_attrs["attached_interfaces"]:
                 return lag_id
 
+    # exec 'check_snapshot_lag_exists' before
     def _show_lag_primary_if(self, lag_id):
-        return self.show_lags(lag_id)[int(lag_id)]["primary_interface"]
+        return get_device_snapshot(self).lags[int(lag_id)]["primary_interface"]
 
     def create_vlan(self, vlan_id=None, vlan_description=None):
         check_vlan_doesnt_exists(self.transport, vlan_id)
@@ -324,8 +367,9 @@ class NetIron(L2API):
     #def enable_vlan(self, vlan_id=None):
     #    raise NotImplementedError("Not implemented")
 
+    @with_device_snapshot
     def enable_lag(self, lag_id=None):
-        check_lag_exists(self.transport, lag_id)
+        check_snapshot_lag_exists(self, lag_id)
         lag_primary_if = self._show_lag_primary_if(lag_id)
         if lag_primary_if is None:
             return
@@ -349,8 +393,9 @@ class NetIron(L2API):
     #def disable_vlan(self, vlan_id=None):
     #    raise NotImplementedError("Not implemented")
 
+    @with_device_snapshot
     def disable_lag(self, lag_id=None):
-        check_lag_exists(self.transport, lag_id)
+        check_snapshot_lag_exists(self, lag_id)
         lag_primary_if = self._show_lag_primary_if(lag_id)
         if lag_primary_if is None:
             return
@@ -381,6 +426,7 @@ class NetIron(L2API):
     #def change_lag_description(self, lag_id=None, lag_description=None):
     #    raise NotImplementedError("Not implemented")
 
+    @with_device_snapshot
     def destroy_vlan(self, vlan_id=None):
         check_vlan_hasnt_members(self, vlan_id)
         interactions = [
@@ -388,6 +434,7 @@ class NetIron(L2API):
             (r"\(config\)#", "end")]
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def destroy_lag(self, lag_id=None):
         check_lag_hasnt_members(self, lag_id)
         interactions = [
@@ -395,9 +442,10 @@ class NetIron(L2API):
             (r"\(config\)#", "end")]
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def interface_attach_vlan(self, interface_id=None, vlan_id=None, tagged=True):
         interface_id = parse_interface_id(self.transport, interface_id)
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         check_interface_is_lag_primary(self, interface_id)
         tagged   = bool(tagged)
         vlan_tag = "tagged" if tagged is True else "untagged"
@@ -407,9 +455,10 @@ class NetIron(L2API):
             (r"\(config-vlan-\d+\)#",  "end")]
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def interface_detach_vlan(self, interface_id=None, vlan_id=None, tagged=True):
         interface_id = parse_interface_id(self.transport, interface_id)
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         check_interface_is_lag_primary(self, interface_id)
         check_interface_in_use_by_vlanid(self, interface_id, vlan_id)
         tagged   = bool(tagged)
@@ -420,36 +469,44 @@ class NetIron(L2API):
             (r"\(config-vlan-\d+\)#", "end")]
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def lag_attach_vlan(self, lag_id=None, vlan_id=None, tagged=True):
-        check_lag_exists(self.transport, lag_id)
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_lag_exists(self, lag_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         return self.interface_attach_vlan(interface_id=self._show_lag_primary_if(lag_id), vlan_id=vlan_id, tagged=tagged)
 
+    @with_device_snapshot
     def lag_detach_vlan(self, lag_id=None, vlan_id=None, tagged=True):
-        check_lag_exists(self.transport, lag_id)
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_lag_exists(self, lag_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         return self.interface_detach_vlan(interface_id=self._show_lag_primary_if(lag_id), vlan_id=vlan_id, tagged=tagged)
 
+    @with_device_snapshot
     def lag_attach_interface(self, lag_id=None, interface_id=None):
         interface_id = parse_interface_id(self.transport, interface_id)
-        check_lag_exists(self.transport, lag_id)
+        check_snapshot_lag_exists(self, lag_id)
         check_interface_isnt_in_use_by_lag(self, interface_id)
         interactions = [
             (r"\(config\)#",         "lag \"%s\" dynamic id %s" % (lag_id, lag_id)),
             (r"\(config-lag-\d+\)#", "ports ethernet %s" % interface_id)]
         if self._show_lag_primary_if(lag_id) is None:
-            interactions.append(
+            interactions.extend([
                 (r"\(config-lag-\d+\)#", "primary-port %s" % interface_id),
-                (r"\(config-lag-\d+\)#", "deploy"))
+                (r"\(config-lag-\d+\)#", "deploy")])
         interactions.append((r"\(config-lag-\d+\)#", "end"))
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def lag_detach_interface(self, lag_id=None, interface_id=None):
         interface_id = parse_interface_id(self.transport, interface_id)
-        check_lag_exists(self.transport, lag_id)
+        check_snapshot_lag_exists(self, lag_id)
         check_interface_in_use_by_lagid(self, interface_id, lag_id)
         interactions = [
             (r"\(config\)#",         "lag \"%s\" dynamic id %s" % (lag_id, lag_id)),
             (r"\(config-lag-\d+\)#", "no ports ethernet %s forced" % interface_id),
             (r"\(config-lag-\d+\)#", "end")]
         self.transport.execute("configure terminal", interactions=interactions)
+
+    def _cache_interface_key(self, interface_id):
+        # mutators accept interface aliases (see parse_interface_id())
+        return parse_interface_id(self.transport, interface_id)
@@ -24,6 +24,7 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 from netl2api.l2api.exceptions import *
 from netl2api.l2api.brocade.netironexceptions import *
+from netl2api.l2api.snapshot import get_device_snapshot
 
 
 __all__ = ["check_stackunit_id", "check_port_id", "check_lag_id", "check_lag_exists",
@@ -32,7 +33,8 @@ __all__ = ["check_stackunit_id", "check_port_id", "check_lag_id", "check_lag_exi
            "check_interface_in_use_by_lagid", "check_interface_isnt_in_use_by_lag",
            "check_interface_in_use_by_vlanid", "check_interface_isnt_in_use_by_vlan",
            "check_interface_isnt_in_use_by_vlan_or_lag", "check_vlan_in_use_by_lagid",
-           "check_vlan_isnt_in_use_by_lagid", "check_interface_is_lag_primary"]
+           "check_vlan_isnt_in_use_by_lagid", "check_interface_is_lag_primary", "check_snapshot_lag_exists",
+           "check_snapshot_vlan_exists"]
 
 
 def check_stackunit_id(stack_unit):
@@ -78,10 +80,16 @@ def check_lag_doesnt_exists(transport, lag_id):
         raise NetIronInvalidParam("LAG already exists => '%s'" % lag_id)
 
 
+def check_snapshot_lag_exists(self, lag_id):
+    check_lag_id(lag_id)
+    if not get_device_snapshot(self).lags.has_key(int(lag_id)):
+        raise NetIronInvalidParam("No such LAG => '%s'" % lag_id)
+
+
 def check_lag_hasnt_members(self, lag_id):
-    check_lag_exists(self.transport, lag_id)
+    check_snapshot_lag_exists(self, lag_id)
     lag_id = int(lag_id)
-    if self.show_lags()[lag_id]["attached_interfaces"]:
+    if get_device_snapshot(self).lags[lag_id]["attached_interfaces"]:
         raise NetIronInvalidParam("LAG have members => '%s'" % lag_id)
 
 
@@ -113,36 +121,43 @@ def check_vlan_doesnt_exists(transport, vlan_id):
     else:
         raise NetIronInvalidParam("VLAN already exists => '%s'" % vlan_id)
 
+def check_snapshot_vlan_exists(self, vlan_id):
+    check_vlan_id(vlan_id)
+    if not get_device_snapshot(self).vlans.has_key(int(vlan_id)):
+        raise NetIronInvalidParam("No such VLAN => '%s'" % vlan_id)
+
+
 def check_vlan_hasnt_members(self, vlan_id):
-    check_vlan_exists(self.transport, vlan_id)
+    check_snapshot_vlan_exists(self, vlan_id)
     vlan_id = int(vlan_id)
-    if len(self.show_vlans()[vlan_id]["attached_interfaces"]) >= 1 or \
-            len(self.show_vlans()[vlan_id]["attached_lags"]) >= 1:
+    vlans   = get_device_snapshot(self).vlans
+    if len(vlans[vlan_id]["attached_interfaces"]) >= 1 or \
+            len(vlans[vlan_id]["attached_lags"]) >= 1:
         raise NetIronInvalidParam("VLAN have members => '%s'" % vlan_id)
 
 
-# exec 'check_stackunit_id', 'check_port_id', 'check_lag_exists' before
+# exec 'check_stackunit_id', 'check_port_id', 'check_snapshot_lag_exists' before
 def check_interface_in_use_by_lagid(self, interface_id, lag_id):
-    if interface_id not in self.show_lags()[int(lag_id)]["attached_interfaces"]:
+    if interface_id not in get_device_snapshot(self).lags[int(lag_id)]["attached_interfaces"]:
         raise NetIronInvalidParam("The given interface ('%s') is not member of the LAG => '%s'" % (interface_id, lag_id))
 
 
-# exec 'check_stackunit_id', 'check_port_id', 'check_lag_exists' before
+# exec 'check_stackunit_id', 'check_port_id', 'check_snapshot_lag_exists' before
 def check_interface_isnt_in_use_by_lag(self, interface_id):
-    lags = [str(k) for k,v in self.show_lags().iteritems() if interface_id in v["attached_interfaces"]]
+    lags = [str(k) for k,v in get_device_snapshot(self).lags.iteritems() if interface_id in v["attached_interfaces"]]
     if len(lags) >= 1:
         raise NetIronInvalidParam("The given interface ('%s') already is member of the LAG(s) => '%s'" % (interface_id, ", ".join(lags)))
 
 
-# exec 'check_stackunit_id', 'check_port_id', 'check_vlan_exists' before
+# exec 'check_stackunit_id', 'check_port_id', 'check_snapshot_vlan_exists' before
 def check_interface_in_use_by_vlanid(self, interface_id, vlan_id):
-    if interface_id not in self.show_vlans()[int(vlan_id)]["attached_interfaces"]:
+    if interface_id not in get_device_snapshot(self).vlans[int(vlan_id)]["attached_interfaces"]:
         raise NetIronInvalidParam("The given interface ('%s') is not member of the VLAN => '%s'" % (interface_id, vlan_id))
 
 
-# exec 'check_stackunit_id', 'check_port_id', 'check_vlan_exists' before
+# exec 'check_stackunit_id', 'check_port_id', 'check_snapshot_vlan_exists' before
 def check_interface_isnt_in_use_by_vlan(self, interface_id):
-    vlans = [str(k) for k,v in self.show_vlans().iteritems() if interface_id in v["attached_interfaces"]]
+    vlans = [str(k) for k,v in get_device_snapshot(self).vlans.iteritems() if interface_id in v["attached_interfaces"]]
     if len(vlans) >= 1:
         raise NetIronInvalidParam("The given interface ('%s') already is member of the VLAN(s) => '%s'" % (interface_id, ", ".join(vlans)))
 
@@ -152,13 +167,13 @@ def check_interface_isnt_in_use_by_vlan_or_lag(self, interface_id):
     check_interface_isnt_in_use_by_vlan(self, interface_id)
 
 
-# exec 'check_lag_exists', 'check_vlan_exists' before
+# exec 'check_snapshot_lag_exists', 'check_snapshot_vlan_exists' before
 def check_vlan_in_use_by_lagid(self, vlan_id, lag_id):
-    if int(lag_id) not in self.show_vlans()[int(vlan_id)]["attached_lags"]:
+    if int(lag_id) not in get_device_snapshot(self).vlans[int(vlan_id)]["attached_lags"]:
         raise NetIronInvalidParam("The given LAG ('%s') is not member of the VLAN => '%s'" % (lag_id, vlan_id))
 
 
-# exec 'check_lag_exists', 'check_vlan_exists' before
+# exec 'check_snapshot_lag_exists', 'check_snapshot_vlan_exists' before
 def check_vlan_isnt_in_use_by_lagid(self, vlan_id, lag_id):
     try:
         check_vlan_in_use_by_lagid(self, vlan_id, lag_id)
@@ -22,27 +22,53 @@
 __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
+import re
 from netl2api.l2api.utils import *
 from netl2api.l2api.brocade.netironchecks import *
 from netl2api.l2api.brocade.netironexceptions import *
+from netl2api.l2api.inventory import lookup_interface
 
 
-__all__ = ["parse_interface_id", "get_interface_name", "get_short_ifname", "expand_brocade_interface_ids"]
+__all__ = ["parse_interface_id", "list_interfaces", "get_interface_name", "get_short_ifname",
+           "expand_brocade_interface_ids"]
+
+
+RE_INTERFACE_ID    = re.compile(r"^\d+/\d+$")
+# "<stack>/<port>", optionally prefixed by "ethernet", "ethe", "eth" or "e"
+RE_INTERFACE_ALIAS = re.compile(r"^(?:e(?:th(?:e(?:rnet)?)?)?\s*)?(\d+)/(\d+)$", re.IGNORECASE)
 
 
 def parse_interface_id(transport, interface_id):
+    """
+    Interface id ("1/1") of an interface alias: "1/1", "ethernet 1/1", "ethe 1/1", "eth 1/1" or "e 1/1"
+    (see netl2api.l2api.inventory). Malformed ids are rejected before the lookup (no device command).
+    """
+    _check_interface_id_format(interface_id)
+    switch_interface_id = lookup_interface(transport, interface_id, list_interfaces)
+    if switch_interface_id is None:
+        raise NetIronInvalidParam("No such interface => '%s'" % interface_id)
+    return switch_interface_id
+
+
+def _check_interface_id_format(interface_id):
     try:
-        stack, port = interface_id.split("/")
-        port  = int(port)
-        stack = int(stack)
-    except (AttributeError, IndexError, ValueError, TypeError):
+        stack, port = RE_INTERFACE_ALIAS.match(interface_id.strip()).groups()
+    except (AttributeError, TypeError):
         raise NetIronInvalidParam("Invalid interface => '%s'" % interface_id)
     check_stackunit_id(stack)
     check_port_id(port)
-    switch_interface_id = get_interface_name(transport, stack, port)
-    if interface_id != switch_interface_id:
-        raise NetIronInvalidParam("No such interface => '%s'" % interface_id)
-    return switch_interface_id
+
+
+def list_interfaces(transport):
+    """
+    (interface id, aliases) of the switch ports ("show interfaces brief")
+    """
+    for intf_ln in transport.execute("show interfaces brief").splitlines():
+        intf_ln = intf_ln.split()
+        if not intf_ln or not RE_INTERFACE_ID.match(intf_ln[0]):
+            continue
+        interface_id = intf_ln[0]
+        yield interface_id, ["%s %s" % (prefix, interface_id) for prefix in ("ethernet", "ethe", "eth", "e")]
 
 
 def get_interface_name(transport, stack, port):
@@ -24,6 +24,7 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 import re
 from netl2api.l2api import L2API
+from netl2api.l2api.snapshot import DeviceSnapshot, with_device_snapshot
 from netl2api.l2api.utils import *
 from netl2api.l2api.brocade.vdx67xxres import *
 from netl2api.l2api.brocade.vdx67xxutils import *
@@ -31,10 +32,35 @@ from netl2api.l2api.brocade.vdx67xxchecks import *
 from netl2api.l2api.brocade.vdx67xxexceptions import *
 
 
-__all__ = ["VDX"]
+__all__ = ["VDX", "VDXSnapshot"]
+
+
+class VDXSnapshot(DeviceSnapshot):
+    """
+        vlans and lags views read (fresh, no autocache) in one round trip: a pipelined
+        'show running-config interface' + 'show interface switchport'
+    """
+
+    def _fetch_running_config(self, view):
+        raw_runcfg, raw_swports = self.l2api.transport.execute_many(["show running-config interface",
+                                                                     "show interface switchport"])
+        runcfg = cisco_like_runcfg_parser(raw_runcfg)
+        self._views.update({
+            "vlans": self.l2api._vlans_from_runcfg(runcfg, self.l2api._parse_interfaces_switchport(raw_swports)),
+            "lags":  self.l2api._lags_from_runcfg(runcfg),
+        })
+        return self._views[view]
+
+    def fetch_vlans(self):
+        return self._fetch_running_config("vlans")
+
+    def fetch_lags(self):
+        return self._fetch_running_config("lags")
 
 
 class VDX(L2API):
+    device_snapshot_class = VDXSnapshot
+
     def __init__(self, *args, **kwargs):
         self.__VENDOR__      = "BROCADE"
         self.__HWTYPE__      = "stackable_switch"
@@ -52,7 +78,10 @@ class VDX(L2API):
         self._RE_VDX_LIST_REC_FMT = re.compile(r"^([A-Z][^:=]+)\s*[:=]\s+(.+)$")
 
     def dump_config(self):
-        return self.transport.execute("show running-config")
+        return "\r\n".join(self.stream_config())
+
+    def stream_config(self):
+        return self.transport.execute_stream("show running-config")
 
     def save_config(self):
         self.transport.execute("copy running-config startup-config",
@@ -66,23 +95,26 @@ class VDX(L2API):
 
     def show_version(self):
         version_info = {}
-        m = RE_SH_VERSION_firmware.findall(self.transport.execute("show version").replace("\r",""))
+        raw_version, raw_system = self.transport.execute_many(["show version", "show system"])
+        m = RE_SH_VERSION_firmware.findall(raw_version.replace("\r",""))
         if m:
             for item in m:
                 if "network operating system version" in item.strip().lower():
                     version_info["nos_version"] = item.split(": ")[1:][0].strip()
                 elif "firmware name" in item.strip().lower():
                     version_info["firmware"] = item.split(": ")[1:][0].strip()
-        m = RE_SH_VERSION_uptime.findall(self.transport.execute("show system").replace("\r",""))
+        m = RE_SH_VERSION_uptime.findall(raw_system.replace("\r",""))
         if m:
             for item in m:
                 if "up time" in item.strip().lower():
                     version_info["uptime"] = item.split(": ")[1:][0].strip()
         return version_info
 
-    def _show_interfaces_status(self):
+    def _show_interfaces_status(self, cmdout=None):
         interfaces_info = {}
-        for intf_st_l in self.transport.execute("show ip interface brief").splitlines():
+        if cmdout is None:
+            cmdout = self.transport.execute("show ip interface brief")
+        for intf_st_l in cmdout.splitlines():
             m = RE_SH_INTERFACE_STATUS.search(intf_st_l)
             if m:
                 intf_id = m.group(1).strip()
@@ -95,9 +127,10 @@ class VDX(L2API):
         if interface_id is not None:
             interface_id = parse_interface_id(self.transport, interface_id)
             show_interfaces_cmd = "show running-config interface %s" % interface_id
+        raw_interfaces, raw_status = self.transport.execute_many([show_interfaces_cmd, "show ip interface brief"])
         configured_interfaces  = dict([(get_short_ifname(k), v) \
-                                        for k,v in cisco_like_runcfg_parser(self.transport.execute(show_interfaces_cmd)).iteritems()])
-        for intf_id, intf_attrs in self._show_interfaces_status().iteritems():
+                                        for k,v in cisco_like_runcfg_parser(raw_interfaces).iteritems()])
+        for intf_id, intf_attrs in self._show_interfaces_status(cmdout=raw_status).iteritems():
             intf_id = get_short_ifname(intf_id)
             if interface_id is not None and intf_id != interface_id:
                 continue
@@ -167,8 +200,7 @@ class VDX(L2API):
         if interface_id is not None:
             interface_id = parse_interface_id(self.transport, interface_id)
             show_arp_cmd = "show mac-address-table interface %s" % interface_id
-        m = self.transport.execute(show_arp_cmd).splitlines()[1:-1]
-        for mm in m:
+        for mm in skip_lines(self.transport.execute_stream(show_arp_cmd), head=1, tail=1):
             spl     = re.split(r"\s\s+", mm)
             intf_id = spl[4].strip()
             mac     = spl[1].strip().replace(".", "")
@@ -195,9 +227,13 @@ class VDX(L2API):
         return uplinks_info
 
     def _show_interfaces_switchport(self):
+        return self._parse_interfaces_switchport(self.transport.execute("show interface switchport"))
+
+    @staticmethod
+    def _parse_interfaces_switchport(cmdout):
         interface_id = None
         interfaces_swport_info = {}
-        for swport_l in self.transport.execute("show interface switchport").splitlines():
+        for swport_l in cmdout.splitlines():
             if not swport_l.strip():
                 continue
             swport_l_key, swport_l_val = swport_l.split(" : ")
@@ -217,13 +253,19 @@ class VDX(L2API):
         return interfaces_swport_info
 
     def show_vlans(self, vlan_id=None):
-        vlan_info      = {}
         show_vlans_cmd = "show running-config interface vlan"
         if vlan_id is not None:
             vlan_id = int(vlan_id)
             check_vlan_exists(self.transport, vlan_id)
             show_vlans_cmd = "show running-config interface vlan %s" % vlan_id
-        for vln_id, vln_attrs in cisco_like_runcfg_parser(self.transport.execute(show_vlans_cmd)).iteritems():
+        runcfg = cisco_like_runcfg_parser(self.transport.execute_stream(show_vlans_cmd))
+        return self._vlans_from_runcfg(runcfg, self._show_interfaces_switchport())
+
+    def _vlans_from_runcfg(self, runcfg, swports):
+        vlan_info = {}
+        for vln_id, vln_attrs in runcfg.iteritems():
+            if not vln_id.lower().startswith("vlan"):
+                continue
             vln_id = int(vln_id.lower().replace("vlan", "").strip())
             vlan_info[vln_id] = {
                 "description": vln_attrs.get("description"),
@@ -231,16 +273,19 @@ class VDX(L2API):
                 "attached_interfaces": {},
                 "attached_lags":       {}
             }
-        self._show_vlan_handle_interfaces(vlan_info)
+        self._show_vlan_handle_interfaces(vlan_info, swports)
         return vlan_info
 
-    def _show_vlan_handle_interfaces(self, vlan_info):
-        for intf_id, intf_attrs in self._show_interfaces_switchport().iteritems():
+    @staticmethod
+    def _show_vlan_handle_interfaces(vlan_info, swports):
+        for intf_id, intf_attrs in swports.iteritems():
             intf_id      = get_short_ifname(intf_id)
             attached_key = "attached_lags" if intf_id.startswith("po") else "attached_interfaces"
             tagstr       = "tagged" if intf_attrs.get("frame_types") == "vlan-tagged only" else "untagged"
             for vln_id in intf_attrs.get("vlans", []):
-                vlan_info[vln_id][attached_key][intf_id] = tagstr
+                # vlans not listed (eg. show_vlans(vlan_id))
+                if vlan_info.has_key(vln_id):
+                    vlan_info[vln_id][attached_key][intf_id] = tagstr
 
     @staticmethod
     def _show_lag_get_interfaces(lag_info, interfaces):
@@ -253,19 +298,21 @@ class VDX(L2API):
                 lag_info[intf_lag]["attached_interfaces"].append(get_short_ifname(intf_id))
 
     def show_lags(self, lag_id=None):
-        lag_info      = {}
         show_lags_cmd = "show running-config interface"
         if lag_id is not None:
             check_lag_exists(self.transport, lag_id)
             #show_lags_cmd = "show running-config interface po %s" % lag_id
             lag_id = int(lag_id)
-        interfaces = cisco_like_runcfg_parser(self.transport.execute(show_lags_cmd))
+        return self._lags_from_runcfg(cisco_like_runcfg_parser(self.transport.execute_stream(show_lags_cmd)), lag_id=lag_id)
+
+    def _lags_from_runcfg(self, interfaces, lag_id=None):
+        lag_info = {}
         for intf_id, intf_attrs in interfaces.iteritems():
             if not intf_id.lower().startswith("port-channel"):
                 continue
+            lg_id = int(intf_id.lower().replace("port-channel", "").strip())
             if lag_id is not None and lag_id != lg_id:
                 continue
-            lg_id = int(intf_id.lower().replace("port-channel", "").strip())
             lag_info[lg_id] = {
                 "description":         intf_attrs.get("description"),
                 "enabled":             intf_attrs.get("adm_state", "no shutdown").lower() == "no shutdown",
@@ -360,12 +407,14 @@ class VDX(L2API):
                         (self._RE_CMDLAG,  "end")]
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def destroy_vlan(self, vlan_id=None):
         check_vlan_hasnt_members(self, vlan_id)
         interactions = [(self._RE_CMDINIT, "no interface vlan %s" % vlan_id),
                         (self._RE_CMDINIT, "end")]
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def destroy_lag(self, lag_id=None):
         check_lag_hasnt_members(self, lag_id)
         interactions = [(self._RE_CMDINIT, "no interface po %s" % lag_id),
@@ -380,11 +429,11 @@ class VDX(L2API):
         interactions = [(self._RE_CMDINIT,  "interface %s" % interface_id),
                         (self._RE_CMDIFACE, "switchport")]
         if tagged is True:
-            interactions.append((self._RE_CMDIFACE, "switchport mode trunk"),
-                                (self._RE_CMDIFACE, "switchport trunk allowed vlan add %s" % vlan_id))
+            interactions.extend([(self._RE_CMDIFACE, "switchport mode trunk"),
+                                 (self._RE_CMDIFACE, "switchport trunk allowed vlan add %s" % vlan_id)])
         else:
-            interactions.append((self._RE_CMDIFACE, "switchport mode access"),
-                                (self._RE_CMDIFACE, "switchport access vlan %s" % vlan_id))
+            interactions.extend([(self._RE_CMDIFACE, "switchport mode access"),
+                                 (self._RE_CMDIFACE, "switchport access vlan %s" % vlan_id)])
         interactions.append((self._RE_CMDIFACE, "end"))
         self.transport.execute("configure terminal", interactions=interactions)
 
@@ -402,10 +451,11 @@ class VDX(L2API):
         interactions.append((self._RE_CMDIFACE,  "end"))
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def lag_attach_vlan(self, lag_id=None, vlan_id=None, tagged=True):
         interactions = []
-        check_lag_exists(self.transport, lag_id)
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_lag_exists(self, lag_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         tagged   = bool(tagged)
         vlan_tag = "tagged" if tagged is True else "untagged"
         interactions.append((self._RE_CMDINIT, "interface po %s" % lag_id))
@@ -418,9 +468,10 @@ class VDX(L2API):
         interactions.append((self._RE_CMDLAG,  "end"))
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def lag_detach_vlan(self, lag_id=None, vlan_id=None, tagged=True):
-        check_lag_exists(self.transport, lag_id)
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_lag_exists(self, lag_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         tagged   = bool(tagged)
         vlan_tag = "tagged" if tagged is True else "untagged"
         interactions = [(self._RE_CMDINIT, "interface po %s" % lag_id)]
@@ -431,9 +482,10 @@ class VDX(L2API):
         interactions.append((self._RE_CMDLAG, "end"))
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def lag_attach_interface(self, lag_id=None, interface_id=None):
         interface_id = parse_interface_id(self.transport, interface_id)
-        check_lag_exists(self.transport, lag_id)
+        check_snapshot_lag_exists(self, lag_id)
         check_interface_isnt_in_use_by_lag(self, interface_id)
         interactions = [(self._RE_CMDINIT,  "interface %s" % interface_id),
                         (self._RE_CMDIFACE, "no switchport"),
@@ -441,12 +493,17 @@ class VDX(L2API):
                         (self._RE_CMDIFACE, "end")]
         self.transport.execute("configure terminal", interactions=interactions)
 
+    @with_device_snapshot
     def lag_detach_interface(self, lag_id=None, interface_id=None):
         interactions = []
         interface_id = parse_interface_id(self.transport, interface_id)
-        check_lag_exists(self.transport, lag_id)
+        check_snapshot_lag_exists(self, lag_id)
         check_interface_in_use_by_lagid(self, interface_id, lag_id)
         interactions = [(self._RE_CMDINIT, "interface %s" % interface_id),
                         (self._RE_CMDIFACE, "no channel-group"),
                         (self._RE_CMDIFACE, "end")]
         self.transport.execute("configure terminal", interactions=interactions)
+
+    def _cache_interface_key(self, interface_id):
+        # mutators accept interface aliases (see parse_interface_id())
+        return parse_interface_id(self.transport, interface_id)
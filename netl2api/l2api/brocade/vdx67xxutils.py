@@ -22,32 +22,56 @@
 __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
+import re
 from netl2api.l2api.utils import *
 from netl2api.l2api.brocade.vdx67xxchecks import *
 from netl2api.l2api.brocade.vdx67xxexceptions import *
+from netl2api.l2api.inventory import lookup_interface
 
 
-__all__ = ["parse_interface_id", "get_interface_name", "get_short_ifname"]
+__all__ = ["parse_interface_id", "list_interfaces", "get_interface_name", "get_short_ifname"]
+
+
+# "<type> <rbridge>/<stack>/<port>": any type prefix (long or short name, with or without the space) or none
+RE_INTERFACE_ALIAS = re.compile(r"^(?:[a-z]+\s*)?(\d+)/(\d+)/(\d+)$", re.IGNORECASE)
 
 
 def parse_interface_id(transport, interface_id):
+    """
+    Interface id ("te 1/0/1") of an interface alias: "te 1/0/1", "Te1/0/1", "TenGigabitEthernet 1/0/1"
+    or "1/0/1" (see netl2api.l2api.inventory). Malformed ids are rejected before the lookup (no device command).
+    """
+    _check_interface_id_format(interface_id)
+    switch_interface_id = lookup_interface(transport, interface_id, list_interfaces)
+    if switch_interface_id is None:
+        raise VDXInvalidParam("No such interface => '%s'" % interface_id)
+    return switch_interface_id
+
+
+def _check_interface_id_format(interface_id):
     try:
-        int_type, int_id = interface_id.split(" ")
-        if len(int_type) > 2:
-            raise VDXInvalidParam("Invalid interface type/prefix => '%s'" % int_type)
-        rbridge, stack, port = int_id.split("/")
-        rbridge = int(rbridge)
-        port    = int(port)
-        stack   = int(stack)
-    except (AttributeError, IndexError, ValueError, TypeError):
+        rbridge, stack, port = RE_INTERFACE_ALIAS.match(interface_id.strip()).groups()
+    except (AttributeError, TypeError):
         raise VDXInvalidParam("Invalid interface => '%s'" % interface_id)
     check_rbridge_id(rbridge)
     check_stackunit_id(stack)
     check_port_id(port)
-    switch_interface_id = get_short_ifname(get_interface_name(transport, rbridge, stack, port))
-    if interface_id != switch_interface_id:
-        raise VDXInvalidParam("No such interface => '%s'" % interface_id)
-    return switch_interface_id
+
+
+def list_interfaces(transport):
+    """
+    (interface id, aliases) of the switch ports ("show ip interface brief")
+    """
+    for intf_ln in transport.execute("show ip interface brief").splitlines():
+        if not "gig" in intf_ln.lower():
+            continue
+        try:
+            int_type, int_id = intf_ln.split()[:2]
+        except ValueError:
+            continue
+        interface_id = get_short_ifname("%s %s" % (int_type, int_id))
+        yield interface_id, ["%s %s" % (int_type, int_id), "%s%s" % (int_type, int_id),
+                             interface_id.replace(" ", ""), int_id]
 
 
 def get_interface_name(transport, rbridge, stack, port):
@@ -23,7 +23,8 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
 import re
-from netl2api.l2api import L2API
+from netl2api.l2api import L2API, VLANS_PATCH_ON, LAGS_PATCH_ON
+from netl2api.l2api.snapshot import DeviceSnapshot, with_device_snapshot
 from netl2api.l2api.utils import *
 from netl2api.l2api.dell.force10res import *
 from netl2api.l2api.dell.force10utils import *
@@ -31,10 +32,37 @@ from netl2api.l2api.dell.force10checks import *
 from netl2api.l2api.dell.force10exceptions import *
 
 
-__all__ = ["Force10"]
+__all__ = ["Force10", "Force10Snapshot"]
+
+
+class Force10Snapshot(DeviceSnapshot):
+    """
+        vlans, lags and interfaces views read (fresh, no autocache) from a single
+        'show running-config interface'
+    """
+
+    def _fetch_running_config(self, view):
+        runcfg = cisco_like_runcfg_parser(self.l2api.transport.execute_stream("show running-config interface"))
+        self._views.update({
+            "vlans":      self.l2api._vlans_from_runcfg(runcfg),
+            "lags":       self.l2api._lags_from_runcfg(runcfg),
+            "interfaces": frozenset([get_short_ifname(i) for i in runcfg.iterkeys() if "gig" in i.lower()]),
+        })
+        return self._views[view]
+
+    def fetch_vlans(self):
+        return self._fetch_running_config("vlans")
+
+    def fetch_lags(self):
+        return self._fetch_running_config("lags")
+
+    def fetch_interfaces(self):
+        return self._fetch_running_config("interfaces")
 
 
 class Force10(L2API):
+    device_snapshot_class = Force10Snapshot
+
     def __init__(self, *args, **kwargs):
         self.__VENDOR__      = "DELL"
         self.__HWTYPE__      = "stackable_switch"
@@ -60,6 +88,10 @@ class Force10(L2API):
                             "I": "internal_tagged",
                             "v": "vlt_untagged",
                             "V": "vlt_tagged" }
+        # parse_interface_id() normalizes interface ids to the short name used by show_vlans()/show_lags()
+        # (new VLANs aren't patched: their initial admin state depends on the FTOS release)
+        self.cache_config["show_vlans"]["patch_on"] = dict(VLANS_PATCH_ON)
+        self.cache_config["show_lags"]["patch_on"]  = dict(LAGS_PATCH_ON, create_lag="_patch_lags_create_lag")
 
     @property
     def f10_platform(self):
@@ -68,16 +100,24 @@ class Force10(L2API):
         return self._f10_platform
 
     def dump_config(self):
-        return self.transport.execute("show running")
+        return "\r\n".join(self.stream_config())
+
+    def stream_config(self):
+        return self.transport.execute_stream("show running")
 
     def save_config(self):
         self.transport.execute("copy running-config startup-config", 
                                interactions=[("Proceed to copy the file.*", "yes")])
 
     def show_system(self):
-        sys_bootvar    = self._show_bootvar()
-        sys_version    = self.show_version()
-        sys_os_version = self._show_os_version()
+        # one round trip per batch (see L2Transport.execute_many())
+        raw_bootvar, raw_version, raw_os_version = self.transport.execute_many(["show bootvar", "show version",
+                                                                                "show os-version"])
+        sys_bootvar    = self._show_bootvar(cmdout=raw_bootvar)
+        sys_version    = self._parse_version(raw_version)
+        sys_os_version = self._show_os_version(cmdout=raw_os_version)
+        if not self._f10_platform and sys_os_version:
+            self._f10_platform = sys_os_version["platform"].upper()
         system_info    = {
             "cpu": sys_version["control_processor"],
             "platform": "%s %s" % (sys_version["sys_name"], sys_version["ftos_version"]),
@@ -98,29 +138,43 @@ class Force10(L2API):
         if self.f10_platform.startswith("S") or self.f10_platform.startswith("Z"):
             system_info["stacks"] = {}
             system_info["stacks"].update(self._s_series_show_system_brief())
-            for stack in system_info["stacks"].iterkeys():
-                system_info["stacks"][stack].update(self._s_series_show_system_stack(stack=stack))
-                system_info["stacks"][stack]["boot_system"] = self._s_series_show_boot_system()
+            stacks = system_info["stacks"].keys()
+            for stack in stacks:
+                check_stackunit_id(stack)
+            raw_stacks = self.transport.execute_many(["show system stack-unit %s" % stack for stack in stacks] + \
+                                                     ["show boot system stack-unit 0"])
+            boot_system = self._s_series_show_boot_system(cmdout=raw_stacks.pop())
+            for stack, raw_show_system in zip(stacks, raw_stacks):
+                system_info["stacks"][stack].update(self._s_series_show_system_stack(stack=stack, cmdout=raw_show_system))
+                system_info["stacks"][stack]["boot_system"] = boot_system
         return system_info
 
     def show_hostname(self):
         return self.transport.execute("show running-config | grep hostname").split()[1].strip()
 
     def show_version(self):
-        m = RE_SH_VERSION.search(self.transport.execute("show version"))
+        return self._parse_version(self.transport.execute("show version"))
+
+    @staticmethod
+    def _parse_version(raw_version):
+        m = RE_SH_VERSION.search(raw_version)
         if m:
             return m.groupdict()
         return {}
 
-    def _show_os_version(self):
-        m = RE_SH_OS_VERSION.search(self.transport.execute("show os-version"))
+    def _show_os_version(self, cmdout=None):
+        if cmdout is None:
+            cmdout = self.transport.execute("show os-version")
+        m = RE_SH_OS_VERSION.search(cmdout)
         if m:
             return m.groupdict()
         return {}
 
-    def _show_bootvar(self):
+    def _show_bootvar(self, cmdout=None):
+        if cmdout is None:
+            cmdout = self.transport.execute("show bootvar")
         return dict([(k.strip().lower().replace(" ", "_"),v.strip()) for k,v in \
-            [l.split(" = ") for l in self.transport.execute("show bootvar").splitlines()]])
+            [l.split(" = ") for l in cmdout.splitlines()]])
 
     def _s_series_show_system_brief(self):
         system_brief_info = {}
@@ -130,10 +184,10 @@ class Force10(L2API):
                 system_brief_info[m.group(1).strip()] = m.groupdict()
         return system_brief_info
 
-    def _s_series_show_system_stack(self, stack=0):
+    def _s_series_show_system_stack(self, stack=0, cmdout=None):
         check_stackunit_id(stack)
         system_stack_info = {}
-        raw_show_system   = self.transport.execute("show system stack-unit %s" % stack)
+        raw_show_system   = cmdout if cmdout is not None else self.transport.execute("show system stack-unit %s" % stack)
         for sh_sys_ln in raw_show_system.splitlines():
             m = self._RE_F10_LIST_REC_FMT.search(sh_sys_ln)
             if m:
@@ -164,9 +218,9 @@ class Force10(L2API):
         #         }
         return system_stack_info
 
-    def _s_series_show_boot_system(self, stack_unit=0):
+    def _s_series_show_boot_system(self, stack_unit=0, cmdout=None):
         check_stackunit_id(stack_unit)
-        raw_show_bootsys = self.transport.execute("show boot system stack-unit %s" % stack_unit)
+        raw_show_bootsys = cmdout if cmdout is not None else self.transport.execute("show boot system stack-unit %s" % stack_unit)
         boot_system_info = {}
         m = RE_SH_BOOT_SYSTEM_STACK_UNIT.search(raw_show_bootsys)
         if m:
@@ -178,9 +232,11 @@ class Force10(L2API):
             boot_system_info["B"] = m.group(3).lower().replace("[boot]", "").strip()
         return boot_system_info
 
-    def _show_interfaces_status(self):
+    def _show_interfaces_status(self, cmdout=None):
         interfaces_info = {}
-        for intf_st_l in self.transport.execute("show interfaces status").splitlines():
+        if cmdout is None:
+            cmdout = self.transport.execute("show interfaces status")
+        for intf_st_l in cmdout.splitlines():
             m = RE_SH_INTERFACE_STATUS.search(intf_st_l)
             if m:
                 intf_id = get_short_ifname(m.group(1).strip())
@@ -193,8 +249,9 @@ class Force10(L2API):
         if interface_id is not None:
             interface_id = parse_interface_id(self.transport, interface_id)
             show_interfaces_cmd = "show running-config interface %s" % interface_id
-        interfaces_status_info = self._show_interfaces_status()
-        for intf_id, intf_attrs in cisco_like_runcfg_parser(self.transport.execute(show_interfaces_cmd)).iteritems():
+        raw_status, raw_interfaces = self.transport.execute_many(["show interfaces status", show_interfaces_cmd])
+        interfaces_status_info     = self._show_interfaces_status(cmdout=raw_status)
+        for intf_id, intf_attrs in cisco_like_runcfg_parser(raw_interfaces).iteritems():
             if not "gig" in intf_id.lower():
                 continue
             intf_id        = get_short_ifname(intf_id)
@@ -247,8 +304,7 @@ class Force10(L2API):
         if interface_id is not None:
             interface_id = parse_interface_id(self.transport, interface_id)
             show_arp_cmd = "show mac-address-table interface %s" % interface_id
-        m = self.transport.execute(show_arp_cmd).splitlines()[1:]
-        for mm in m:
+        for mm in skip_lines(self.transport.execute_stream(show_arp_cmd), head=1):
             spl     = mm.split("\t")
             intf_id = spl[3].strip()
             mac     = spl[1].strip()
@@ -282,12 +338,17 @@ class Force10(L2API):
         return uplinks_info
 
     def show_vlans(self, vlan_id=None):
-        vlan_info      = {}
         show_vlans_cmd = "show running-config interface vlan"
         if vlan_id is not None:
             check_vlan_exists(self.transport, vlan_id)
             show_vlans_cmd = "show running-config interface vlan %s" % vlan_id
-        for vln_id, vln_attrs in cisco_like_runcfg_parser(self.transport.execute(show_vlans_cmd)).iteritems():
+        return self._vlans_from_runcfg(cisco_like_runcfg_parser(self.transport.execute_stream(show_vlans_cmd)))
+
+    def _vlans_from_runcfg(self, runcfg):
+        vlan_info = {}
+        for vln_id, vln_attrs in runcfg.iteritems():
+            if not vln_id.lower().startswith("vlan"):
+                continue
             vln_id = int(vln_id.split()[1])
             vlan_info[vln_id] = {
                 "description": vln_attrs.get("description"),
@@ -320,13 +381,15 @@ class Force10(L2API):
                 lag_info[intf_lag]["attached_interfaces"].append(get_short_ifname(intf_id, ))
 
     def show_lags(self, lag_id=None):
-        lag_info      = {}
         show_lags_cmd = "show running-config interface"
         if lag_id is not None:
             check_lag_exists(self.transport, lag_id)
             #show_lags_cmd = "show running-config interface port-channel %s" % lag_id
             lag_id = int(lag_id)
-        interfaces = cisco_like_runcfg_parser(self.transport.execute(show_lags_cmd))
+        return self._lags_from_runcfg(cisco_like_runcfg_parser(self.transport.execute_stream(show_lags_cmd)), lag_id=lag_id)
+
+    def _lags_from_runcfg(self, interfaces, lag_id=None):
+        lag_info = {}
         for intf_id, intf_attrs in interfaces.iteritems():
             if not intf_id.lower().startswith("port-channel"):
                 continue
@@ -362,6 +425,18 @@ class Force10(L2API):
         interactions.append((r"\(conf-if-po-\d+\)#", "end"))
         self.transport.execute("configure", interactions=interactions)
 
+    def _cache_interface_key(self, interface_id):
+        # mutators accept interface aliases (see parse_interface_id())
+        return parse_interface_id(self.transport, interface_id)
+
+    def _patch_lags_create_lag(self, lags, lag_id=None, lag_description=None):
+        lags[self._cache_lag_key(lag_id)] = {
+            "description": lag_description or None,
+            "enabled":     True,
+            "attached_interfaces": [],
+        }
+        return lags
+
     def enable_interface(self, interface_id=None):
         interface_id = parse_interface_id(self.transport, interface_id)
         interactions = [
@@ -434,6 +509,7 @@ class Force10(L2API):
             (r"\(conf-if-po-\d+\)#", "end")]
         self.transport.execute("configure", interactions=interactions)
 
+    @with_device_snapshot
     def destroy_vlan(self, vlan_id=None):
         check_vlan_hasnt_members(self, vlan_id)
         interactions = [
@@ -441,6 +517,7 @@ class Force10(L2API):
             (r"\(conf\)#", "exit")]
         self.transport.execute("configure", interactions=interactions)
 
+    @with_device_snapshot
     def destroy_lag(self, lag_id=None):
         check_lag_hasnt_members(self, lag_id)
         interactions = [
@@ -448,9 +525,10 @@ class Force10(L2API):
             (r"\(conf\)#", "end")]
         self.transport.execute("configure", interactions=interactions)
 
+    @with_device_snapshot
     def interface_attach_vlan(self, interface_id=None, vlan_id=None, tagged=True):
-        interface_id = parse_interface_id(self.transport, interface_id)
-        check_vlan_exists(self.transport, vlan_id)
+        interface_id = parse_snapshot_interface_id(self, interface_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         check_interface_isnt_in_use_by_lag(self, interface_id)
         tagged    = bool(tagged)
         vlan_tag  = "tagged" if tagged is True else "untagged"
@@ -463,9 +541,10 @@ class Force10(L2API):
             (r"\(conf-if-vl-\d+\)#",         "end")]
         self.transport.execute("configure", interactions=interactions)
 
+    @with_device_snapshot
     def interface_detach_vlan(self, interface_id=None, vlan_id=None, tagged=True):
-        interface_id = parse_interface_id(self.transport, interface_id)
-        check_vlan_exists(self.transport, vlan_id)
+        interface_id = parse_snapshot_interface_id(self, interface_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         check_interface_in_use_by_vlanid(self, interface_id, vlan_id)
         tagged   = bool(tagged)
         vlan_tag = "tagged" if tagged is True else "untagged"
@@ -479,9 +558,10 @@ class Force10(L2API):
             # (r"\(conf-if-[a-z]+-\d+/\d+\)#", "end")]
         self.transport.execute("configure", interactions=interactions)
 
+    @with_device_snapshot
     def lag_attach_vlan(self, lag_id=None, vlan_id=None, tagged=True):
-        check_lag_exists(self.transport, lag_id)
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_lag_exists(self, lag_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         check_vlan_isnt_in_use_by_lagid(self, vlan_id, lag_id)
         tagged   = bool(tagged)
         vlan_tag = "tagged" if tagged is True else "untagged"
@@ -491,9 +571,10 @@ class Force10(L2API):
             (r"\(conf-if-vl-\d+\)#", "end")]
         self.transport.execute("configure", interactions=interactions)
 
+    @with_device_snapshot
     def lag_detach_vlan(self, lag_id=None, vlan_id=None, tagged=True):
-        check_lag_exists(self.transport, lag_id)
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_lag_exists(self, lag_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         check_vlan_in_use_by_lagid(self, vlan_id, lag_id)
         tagged   = bool(tagged)
         vlan_tag = "tagged" if tagged is True else "untagged"
@@ -503,9 +584,10 @@ class Force10(L2API):
             (r"\(conf-if-vl-\d+\)#", "end")]
         self.transport.execute("configure", interactions=interactions)
 
+    @with_device_snapshot
     def lag_attach_interface(self, lag_id=None, interface_id=None):
-        interface_id = parse_interface_id(self.transport, interface_id)
-        check_lag_exists(self.transport, lag_id)
+        interface_id = parse_snapshot_interface_id(self, interface_id)
+        check_snapshot_lag_exists(self, lag_id)
         check_interface_isnt_in_use_by_vlan_or_lag(self, interface_id)
         #self.port_reset(stack=stack, port=port)
         interactions = [
@@ -519,9 +601,10 @@ class Force10(L2API):
             (r"\(conf-if-[a-z]+-\d+/\d+\)#",      "end")]
         self.transport.execute("configure", interactions=interactions)
 
+    @with_device_snapshot
     def lag_detach_interface(self, lag_id=None, interface_id=None):
-        interface_id = parse_interface_id(self.transport, interface_id)
-        check_lag_exists(self.transport, lag_id)
+        interface_id = parse_snapshot_interface_id(self, interface_id)
+        check_snapshot_lag_exists(self, lag_id)
         check_interface_in_use_by_lagid(self, interface_id, lag_id)
         interactions = [
             (r"\(conf\)#",                   "interface %s" % interface_id),
@@ -22,29 +22,66 @@
 __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
+import re
 from netl2api.l2api.dell.force10checks import *
 from netl2api.l2api.dell.force10exceptions import *
+from netl2api.l2api.snapshot import get_device_snapshot
+from netl2api.l2api.inventory import lookup_interface
 
 
-__all__ = ["parse_interface_id", "get_interface_name", "get_short_ifname"]
+__all__ = ["parse_interface_id", "parse_snapshot_interface_id", "list_interfaces", "get_interface_name",
+           "get_short_ifname"]
+
+
+# "<type> <stack>/<port>": any type prefix (long or short name, with or without the space) or none
+RE_INTERFACE_ALIAS = re.compile(r"^(?:[a-z]+\s*)?(\d+)/(\d+)$", re.IGNORECASE)
 
 
 def parse_interface_id(transport, interface_id):
+    """
+    Interface id ("te 0/1") of an interface alias: "te 0/1", "Te0/1", "TenGigabitEthernet 0/1" or "0/1"
+    (see netl2api.l2api.inventory). Malformed ids are rejected before the lookup (no device command).
+    """
+    _check_interface_id_format(interface_id)
+    switch_interface_id = lookup_interface(transport, interface_id, list_interfaces)
+    if switch_interface_id is None:
+        raise Force10InvalidParam("No such interface => '%s'" % interface_id)
+    return switch_interface_id
+
+
+def parse_snapshot_interface_id(self, interface_id):
+    """
+    parse_interface_id() validated against the device snapshot of the mutation (see force10.Force10Snapshot)
+    """
+    interface_id = parse_interface_id(self.transport, interface_id)
+    if interface_id not in get_device_snapshot(self).interfaces:
+        raise Force10InvalidParam("No such interface => '%s'" % interface_id)
+    return interface_id
+
+
+def _check_interface_id_format(interface_id):
     try:
-        int_type, int_id = interface_id.split(" ")
-        if len(int_type) > 2:
-            raise Force10InvalidParam("Invalid interface type/prefix => '%s'" % int_type)
-        stack, port = int_id.split("/")
-        port  = int(port)
-        stack = int(stack)
-    except (AttributeError, IndexError, ValueError, TypeError):
+        stack, port = RE_INTERFACE_ALIAS.match(interface_id.strip()).groups()
+    except (AttributeError, TypeError):
         raise Force10InvalidParam("Invalid interface => '%s'" % interface_id)
     check_stackunit_id(stack)
     check_port_id(port)
-    switch_interface_id = get_short_ifname(get_interface_name(transport, stack, port)).lower()
-    if interface_id != switch_interface_id:
-        raise Force10InvalidParam("No such interface => '%s'" % interface_id)
-    return switch_interface_id
+
+
+def list_interfaces(transport):
+    """
+    (interface id, aliases) of the switch ports ("show ip interface brief")
+    """
+    for intf_ln in transport.execute("show ip interface brief").splitlines():
+        if not "gig" in intf_ln.lower():
+            continue
+        try:
+            int_type, int_id = intf_ln.split()[:2]
+        except ValueError:
+            continue
+        interface_id = get_short_ifname("%s %s" % (int_type, int_id))
+        yield interface_id, ["%s %s" % (int_type, int_id), "%s%s" % (int_type, int_id),
+                             interface_id.replace(" ", ""), int_id]
 
 
 def get_interface_name(transport, stack, port):
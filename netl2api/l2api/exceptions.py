@@ -23,7 +23,7 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
 __all__ = ["L2Exception", "InvalidParameter", "TransportTimeout", "TransportSocketTimeout",
-           "TransportTransactionException", "NoTransportConnectionsAvailable",
+           "TransportTransactionException", "NoTransportConnectionsAvailable", "TransportCircuitOpen",
            "SwitchAuthenticationException", "SwitchInvalidParameter", "SwitchCommandException"]
 
 
@@ -45,6 +45,11 @@ class TransportTransactionException(TransportTimeout):
 class NoTransportConnectionsAvailable(L2Exception):
     pass
 
+class TransportCircuitOpen(L2Exception):
+    def __init__(self, msg=None, retry_after=None):
+        super(TransportCircuitOpen, self).__init__(msg)
+        self.retry_after = retry_after
+
 class SwitchAuthenticationException(L2Exception):
     pass
 
@@ -24,6 +24,7 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 import re
 from netl2api.l2api import L2API
+from netl2api.l2api.snapshot import with_device_snapshot
 from netl2api.l2api.exceptions import *
 from netl2api.l2api.hp.flex10res import *
 from netl2api.l2api.hp.flex10utils import *
@@ -115,29 +116,38 @@ class Flex10(L2API):
         return parsed_list
 
     def dump_config(self):
-        return "\r\n".join([l for l in self.transport.execute("show config").splitlines() \
-                        if not "Generating configuration" in l and \
-                        not l.strip().startswith("SUCCESS:") and not l.startswith(self.prompt_mark)])
+        return "\r\n".join(self.stream_config())
+
+    def stream_config(self):
+        return (l for l in self.transport.execute_stream("show config") \
+                    if not "Generating configuration" in l and \
+                    not l.strip().startswith("SUCCESS:") and not l.startswith(self.prompt_mark))
 
     # def save_config(self):
     #     raise NotImplementedError("Not implemented")
 
-    def _show_interconnect_mods(self):
-        return  self._parse_flex10_list(raw_list=self.transport.execute("show interconnect *"),
+    def _show_interconnect_mods(self, cmdout=None):
+        if cmdout is None:
+            cmdout = self.transport.execute("show interconnect *")
+        return  self._parse_flex10_list(raw_list=cmdout,
                                         eof_mark_len=45,
                                         omit_fields=["Enclosure"],
                                         fields_map={"id": "interconnect_id"},
                                         group_by=["interconnect_id"])
 
-    def _show_enclosure(self):
-        return self._parse_flex10_list(raw_list=self.transport.execute("show enclosure *"),
+    def _show_enclosure(self, cmdout=None):
+        if cmdout is None:
+            cmdout = self.transport.execute("show enclosure *")
+        return self._parse_flex10_list(raw_list=cmdout,
                                        omit_fields=["Import Status", "Overall Status",
                                                     "Asset Tag", "Primary", "Comm Status"],
                                        fields_map={"id": "enclosure_id"},
                                        group_by=["enclosure_id"])
 
-    def _show_servers(self, server_id="*"):
-        return self._parse_flex10_list(raw_list=self.transport.execute("show server %s" % server_id),
+    def _show_servers(self, server_id="*", cmdout=None):
+        if cmdout is None:
+            cmdout = self.transport.execute("show server %s" % server_id)
+        return self._parse_flex10_list(raw_list=cmdout,
                                        omit_fields=["Enclosure Name", "UID", "Height", "Width",
                                                     "Server Name", "OS Name", "Asset Tag"],
                                        group_by=["server_id"])
@@ -193,16 +203,19 @@ class Flex10(L2API):
         return uplinkports
 
     def show_system(self):
-        sys_version = self.show_version()
-        enclosure   = self._show_enclosure()["enc0"]
+        # one round trip (see L2Transport.execute_many())
+        raw_version, raw_enclosure, raw_servers, raw_interconnect_mods = \
+                self.transport.execute_many(["show version", "show enclosure *", "show server *", "show interconnect *"])
+        sys_version = self._parse_version(raw_version)
+        enclosure   = self._show_enclosure(cmdout=raw_enclosure)["enc0"]
         system_info = {
             "platform": "%s %s" % (sys_version["sys_name"], sys_version["build"]),
             "manufacturer":  enclosure["manufacturer"],
             "product_name":  enclosure["description"],
             "serial_number": enclosure["serial_number"],
             "part_number":   enclosure["spare_part_number"],
-            "servers":       self._show_servers(),
-            "interconnect_modules": self._show_interconnect_mods(),
+            "servers":       self._show_servers(cmdout=raw_servers),
+            "interconnect_modules": self._show_interconnect_mods(cmdout=raw_interconnect_mods),
         }
         return system_info
 
@@ -210,7 +223,11 @@ class Flex10(L2API):
         return self._show_enclosure()["enc0"]["enclosure_name"]
 
     def show_version(self):
-        m = RE_SH_VERSION.search(self.transport.execute("show version"))
+        return self._parse_version(self.transport.execute("show version"))
+
+    @staticmethod
+    def _parse_version(raw_version):
+        m = RE_SH_VERSION.search(raw_version)
         if m:
             return m.groupdict()
         return {}
@@ -324,7 +341,7 @@ class Flex10(L2API):
         for interconnect_mod in self._show_interconnect_mods().keys():
             interconnect_enc_id = interconnect_mod.split(":")[0]
             try:
-                for mac_ln in self.transport.execute("show interconnect-mac-table %s" % interconnect_mod).splitlines():
+                for mac_ln in self.transport.execute_stream("show interconnect-mac-table %s" % interconnect_mod):
                     m = RE_SH_INTERCONN_MAC.search(mac_ln)
                     if m:
                         intf_id = "%s:%s" % (interconnect_enc_id, m.group(1).strip())
@@ -474,6 +491,7 @@ class Flex10(L2API):
         for network in networks:
             self.transport.execute("remove network %s" % network)
 
+    @with_device_snapshot
     def destroy_vlan(self, vlan_id=None):
         check_vlan_hasnt_members(self, vlan_id)
         return self._destroy_network(vlan_id=int(vlan_id))
@@ -533,6 +551,7 @@ class Flex10(L2API):
             raise Flex10Exception("No enough free ports/FlexNICs => '%s:%s' (VCProfile='%s')" % (enc_id, bay_id, vcprofile))
         return unused_ports_pair[0:2]
 
+    @with_device_snapshot
     def interface_attach_vlan(self, interface_id=None, vlan_id=None, tagged=False):
         if bool(tagged) is True:
             raise Flex10InvalidParam("Tagged VLANs are not supported")
@@ -544,7 +563,7 @@ class Flex10(L2API):
         else:
             check_interface_exists(self, enc_id, bay_id, port_id)
             port_ids = [port_id]
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         check_interface_in_use_by_vlan(self, interface_id)
         for port_id in port_ids:
             self._network_attach_port(enc_id=enc_id, bay_id=bay_id, port_id=port_id, vlan_id=vlan_id)
@@ -563,6 +582,7 @@ class Flex10(L2API):
             raise Flex10Exception("No ports/FlexNICs of server '%s' found in VLAN => '%s'" % (server_id, vlan_id))
         return vlan_server_ports
 
+    @with_device_snapshot
     def interface_detach_vlan(self, interface_id=None, vlan_id=None, tagged=False):
         if bool(tagged) is True:
             raise Flex10InvalidParam("Tagged VLANs are not supported")
@@ -574,7 +594,7 @@ class Flex10(L2API):
         else:
             check_interface_exists(self, enc_id, bay_id, port_id)
             port_ids = [port_id]
-        check_vlan_exists(self.transport, vlan_id)
+        check_snapshot_vlan_exists(self, vlan_id)
         check_interface_in_use_by_vlanid(self, interface_id, vlan_id)
         for port_id in port_ids:
             self._network_detach_port(enc_id=enc_id, bay_id=bay_id, port_id=port_id, vlan_id=vlan_id)
@@ -25,12 +25,14 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 import re
 from netl2api.l2api.exceptions import *
 from netl2api.l2api.hp.flex10exceptions import *
+from netl2api.l2api.snapshot import get_device_snapshot
 
 
 __all__ = ["check_enc_id", "check_bay_id", "check_switch_id", "check_port_id", "check_server_exists",
            "check_interface_exists", "check_uplinkport_exists", "check_vlan_id", "check_vlan_exists",
            "check_vlan_doesnt_exists", "check_vlan_hasnt_members", "check_interface_in_use_by_vlan",
-           "check_interface_in_use_by_vlanid", "check_vcprofile_exists", "check_interface_bay"]
+           "check_interface_in_use_by_vlanid", "check_vcprofile_exists", "check_interface_bay",
+           "check_snapshot_vlan_exists"]
 
 
 def check_enc_id(enc_id):
@@ -124,22 +126,28 @@ def check_vlan_doesnt_exists(transport, vlan_id):
         raise Flex10InvalidParam("VLAN already exists => '%s'" % vlan_id)
 
 
+def check_snapshot_vlan_exists(self, vlan_id):
+    check_vlan_id(vlan_id)
+    if not get_device_snapshot(self).vlans.has_key(int(vlan_id)):
+        raise Flex10InvalidParam("No such VLAN => '%s'" % vlan_id)
+
+
 def check_vlan_hasnt_members(self, vlan_id):
-    check_vlan_exists(self.transport, vlan_id)
-    if len(self.show_vlans()[int(vlan_id)]["attached_interfaces"]) >= 1:
+    check_snapshot_vlan_exists(self, vlan_id)
+    if len(get_device_snapshot(self).vlans[int(vlan_id)]["attached_interfaces"]) >= 1:
         raise Flex10InvalidParam("VLAN have members => '%s'" % vlan_id)
 
 
-# exec 'check_vlan_exists' before
+# exec 'check_snapshot_vlan_exists' before
 def check_interface_in_use_by_vlan(self, interface_id):
-    vlans = [str(k) for k,v in self.show_vlans().iteritems() if interface_id in v["attached_interfaces"]]
+    vlans = [str(k) for k,v in get_device_snapshot(self).vlans.iteritems() if interface_id in v["attached_interfaces"]]
     if len(vlans) >= 1:
         raise Flex10InvalidParam("The given interface ('%s') already is member of the VLAN(s) => '%s'" % (interface_id, ", ".join(vlans)))
 
 
-# exec 'check_vlan_exists' before
+# exec 'check_snapshot_vlan_exists' before
 def check_interface_in_use_by_vlanid(self, interface_id, vlan_id):
-    if interface_id not in self.show_vlans()[int(vlan_id)]["attached_interfaces"]:
+    if interface_id not in get_device_snapshot(self).vlans[int(vlan_id)]["attached_interfaces"]:
         raise Flex10InvalidParam("The given interface ('%s') is not member of the VLAN => '%s'" % (interface_id, vlan_id))
 
 
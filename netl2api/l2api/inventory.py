@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import threading
+from time import time
+
+
+__all__ = ["InterfaceInventory", "configure_interface_inventory", "lookup_interface",
+           "clear_interface_inventories"]
+
+
+_inventory_cfg = {"ttl": 3600, "min_refresh_interval": 30}
+# "host:port" => InterfaceInventory
+_inventories      = {}
+_inventories_lock = threading.Lock()
+# "host:port" => lock serializing the listings of the device
+_build_locks      = {}
+
+
+def normalize_alias(alias):
+    return " ".join(alias.lower().split())
+
+
+class InterfaceInventory(object):
+    """
+        Interfaces of a device indexed by every accepted alias (case/whitespace insensitive)
+        => interface id as used by the L2API (see lookup_interface()).
+
+        :interfaces: Iterable of (interface id, [alias, ...]). An alias shared by two
+                     interfaces is dropped (ambiguous); interface ids always resolve to themselves.
+            - type: list/generator.
+            - ex: [("te 0/1", ["TenGigabitEthernet 0/1", "te0/1", "0/1"])]
+    """
+
+    def __init__(self, interfaces=None):
+        self.built_at = time()
+        self.index    = {}
+        ambiguous     = set()
+        ids           = {}
+        for interface_id, aliases in interfaces or []:
+            ids[normalize_alias(interface_id)] = interface_id
+            for alias in aliases:
+                alias = normalize_alias(alias)
+                if self.index.get(alias, interface_id) != interface_id:
+                    ambiguous.add(alias)
+                self.index[alias] = interface_id
+        for alias in ambiguous:
+            del(self.index[alias])
+        self.index.update(ids)
+
+    def get(self, alias):
+        try:
+            return self.index.get(normalize_alias(alias))
+        except AttributeError:
+            # not a string
+            return None
+
+    @property
+    def interfaces(self):
+        return frozenset(self.index.itervalues())
+
+
+def configure_interface_inventory(ttl=3600, min_refresh_interval=30):
+    """
+    Process-wide interface inventory settings. Existing inventories are dropped.
+
+        :ttl: Seconds an inventory is used before the device interfaces are listed again.
+            - type: int/float.
+            - ex: 3600
+
+        :min_refresh_interval: An unknown alias refreshes the inventory at most once per
+                               this interval (seconds), so invalid ids can't flood the device.
+            - type: int/float.
+            - ex: 30
+    """
+    _inventory_cfg.update({"ttl": ttl, "min_refresh_interval": min_refresh_interval})
+    clear_interface_inventories()
+
+
+def clear_interface_inventories():
+    with _inventories_lock:
+        _inventories.clear()
+
+
+def lookup_interface(transport, interface_id, list_interfaces):
+    """
+    Interface id of the alias 'interface_id' on the 'transport' device (None: no such interface).
+    'list_interfaces(transport)' lists the device interfaces in one command (see InterfaceInventory);
+    it's called on first use, after 'ttl' and on a miss (at most once per 'min_refresh_interval').
+    """
+    key       = "%s:%s" % (transport.host, transport.port)
+    now       = time()
+    inventory = _inventories.get(key)
+    if inventory is None or now - inventory.built_at > _inventory_cfg["ttl"]:
+        inventory = _build_inventory(key, inventory, transport, list_interfaces)
+    found = inventory.get(interface_id)
+    if found is None and now - inventory.built_at >= _inventory_cfg["min_refresh_interval"]:
+        found = _build_inventory(key, inventory, transport, list_interfaces).get(interface_id)
+    return found
+
+
+def _build_inventory(key, outdated, transport, list_interfaces):
+    """
+    Replaces 'outdated' (None: no inventory yet). Callers racing for the same device list it
+    once: the others get the inventory built meanwhile.
+    """
+    with _inventories_lock:
+        build_lock = _build_locks.get(key)
+        if build_lock is None:
+            build_lock = _build_locks[key] = threading.Lock()
+    with build_lock:
+        current = _inventories.get(key)
+        if current is not None and current is not outdated:
+            return current
+        inventory = InterfaceInventory(list_interfaces(transport))
+        with _inventories_lock:
+            _inventories[key] = inventory
+        return inventory
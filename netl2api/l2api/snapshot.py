@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import threading
+from functools import wraps
+
+
+__all__ = ["DeviceSnapshot", "get_device_snapshot", "with_device_snapshot"]
+
+
+# per thread: {id(L2API instance): DeviceSnapshot of the running mutation}
+_scopes = threading.local()
+
+
+class DeviceSnapshot(object):
+    """
+        Device state used to validate a mutation (the vendor *checks.py functions taking 'self').
+        Each view (vlans, lags, interfaces) is read on first use by fetch_<view>() and shared
+        by every check of the mutation (see with_device_snapshot()).
+
+        The default views are the L2API show_vlans()/show_lags()/show_interfaces() responses,
+        read from the device: the autocache (shared, possibly stale) is bypassed, so the existence
+        checks and the membership checks of a mutation see the same state. Vendors set
+        'L2API.device_snapshot_class' to a subclass building several views from one command
+        (or a pipelined execute_many()).
+    """
+
+    def __init__(self, l2api):
+        self.l2api  = l2api
+        self._views = {}
+
+    def view(self, name):
+        try:
+            return self._views[name]
+        except KeyError:
+            pass
+        return self._views.setdefault(name, getattr(self, "fetch_%s" % name)())
+
+    def invalidate(self):
+        self._views.clear()
+
+    @property
+    def vlans(self):
+        return self.view("vlans")
+
+    @property
+    def lags(self):
+        return self.view("lags")
+
+    @property
+    def interfaces(self):
+        """
+        Interface ids (as used by the vlans/lags views)
+        """
+        return self.view("interfaces")
+
+    def _fresh(self, method):
+        autocache = getattr(self.l2api, "_autocache", None)
+        if autocache is not None and method in autocache.cached:
+            return getattr(self.l2api, method)(use_cache=False)
+        return getattr(self.l2api, method)()
+
+    def fetch_vlans(self):
+        return self._fresh("show_vlans")
+
+    def fetch_lags(self):
+        return self._fresh("show_lags")
+
+    def fetch_interfaces(self):
+        return frozenset(self._fresh("show_interfaces").keys())
+
+
+def get_device_snapshot(l2api):
+    """
+    DeviceSnapshot of the mutation running on 'l2api' in this thread (see with_device_snapshot());
+    outside of one, a new (unshared) snapshot
+    """
+    snapshots = getattr(_scopes, "snapshots", None)
+    if snapshots is not None and snapshots.has_key(id(l2api)):
+        return snapshots[id(l2api)]
+    return l2api.device_snapshot_class(l2api)
+
+
+def with_device_snapshot(f):
+    """
+    L2API mutator decorator: the checks called by the mutator share one DeviceSnapshot,
+    dropped when it returns. A mutator called by another one shares the caller snapshot,
+    whose views are dropped afterwards (the device changed).
+    """
+    @wraps(f)
+    def device_snapshot_scope(self, *args, **kwargs):
+        snapshots = getattr(_scopes, "snapshots", None)
+        if snapshots is None:
+            snapshots = _scopes.snapshots = {}
+        snapshot = snapshots.get(id(self))
+        if snapshot is not None:
+            try:
+                return f(self, *args, **kwargs)
+            finally:
+                snapshot.invalidate()
+        snapshots[id(self)] = self.device_snapshot_class(self)
+        try:
+            return f(self, *args, **kwargs)
+        finally:
+            del(snapshots[id(self)])
+    # the mutator signature (see L2APIAutoCache._cache_patch_keys())
+    device_snapshot_scope.__wrapped__ = f
+    return device_snapshot_scope
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import re
+import time
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from netl2api.l2api.exceptions import *
+from netl2api.lib.utils import get_context_uid
+from netl2api.l2api.transport import L2Transport, RecvBuffer
+from netl2api.l2api.transport.IOLoop import IOLoop, Future
+from netl2api.l2api.transport.SysSSHTransport import SysSSH
+from netl2api.l2api.transport.SystemSSH import SSHProcessException
+
+
+__all__ = ["AsyncSysSSH"]
+
+
+_blocking_pool      = None
+_blocking_pool_lock = threading.Lock()
+
+
+def _run_blocking(f, *args):
+    """
+    Session setup/teardown (ssh login, close(): sleep + waitpid) off the IOLoop thread
+    """
+    global _blocking_pool
+    with _blocking_pool_lock:
+        if _blocking_pool is None:
+            _blocking_pool = ThreadPool(processes=AsyncSysSSH.blocking_workers)
+    _blocking_pool.apply_async(f, args)
+
+
+class AsyncSysSSH(SysSSH):
+    """
+        SysSSH transport driven by the process-wide IOLoop: after the session is authenticated
+        (blocking, once per session), commands are written/read by the IOLoop thread (non-blocking),
+        so any number of sessions are multiplexed by a single thread.
+
+        execute_async() returns an IOLoop.Future and never blocks (can be used by IOLoop.coroutine()s):
+        a session not yet authenticated is opened by a small worker pool ('blocking_workers' threads,
+        also closing sessions after errors). execute() (L2Transport contract) just waits for the
+        Future, so vendor classes work unchanged (see netl2api.l2api.asyncapi.AsyncL2API).
+        Commands sent to the same session are queued and run one at a time; when a failed command
+        closes the session (close_on_switch_error/close_on_transaction_error), the commands queued
+        behind it fail with NoTransportConnectionsAvailable (never sent).
+
+        Each session is still one ssh process (see SystemSSH; ControlMaster multiplexing shares
+        the TCP connection and authentication of a device, not the process).
+
+        Parameters: see L2Transport.
+    """
+
+    blocking_workers = 8
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncSysSSH, self).__init__(*args, **kwargs)
+        self.ioloop    = IOLoop.instance()
+        self._queue    = deque()
+        self._running  = None
+        # lazy session setup: execute_async() callers, vendor (execute()) callers and the login pool
+        self._connect_lock = threading.Lock()
+
+    @property
+    def connection(self):
+        with self._connect_lock:
+            return SysSSH.connection.fget(self)
+
+    def _connected(self):
+        connection = self._connection
+        return connection is not None and getattr(connection, "closed", False) is False
+
+    def execute_async(self, cmd=None, interactions=None):
+        """
+        Same parameters as execute(); returns an IOLoop.Future (cmd output)
+        """
+        future = Future()
+        if cmd is None:
+            future.set_result(None)
+            return future
+        if type(cmd) not in (str, unicode):
+            raise InvalidParameter("'cmd' parameter is invalid")
+        if interactions is not None and type(interactions) not in (list, tuple):
+            raise InvalidParameter("'interactions' parameter is invalid")
+        breaker = self.circuit_breaker
+        try:
+            if breaker is not None:
+                breaker.before_call()
+        except TransportCircuitOpen, e:
+            future.set_exception(e)
+            return future
+        if breaker is not None:
+            future.add_done_callback(lambda f: self._update_breaker(breaker, f))
+        if self._connected():
+            self._submit(future, self._connection, cmd, interactions)
+        else:
+            _run_blocking(self._connect_and_submit, future, cmd, interactions)
+        return future
+
+    def _connect_and_submit(self, future, cmd, interactions):
+        # login pool thread
+        try:
+            connection = self.connection
+        except Exception, e:
+            future.set_exception(e)
+            return
+        self._submit(future, connection, cmd, interactions)
+
+    def _submit(self, future, connection, cmd, interactions):
+        L2Transport._execute(self, connection=connection, cmd=cmd, interactions=interactions)
+        future.add_done_callback(lambda f: self._close_on_error(f, connection))
+        self.ioloop.add_callback(self._enqueue, future, connection, cmd, interactions)
+
+    def _closes_session(self, e):
+        # the session is closed after 'e' (see _close_on_error() and L2Transport.execute())
+        return (isinstance(e, SwitchCommandException) and self.close_on_switch_error is True) or \
+               (isinstance(e, TransportTransactionException) and self.close_on_transaction_error is True)
+
+    def _close_on_error(self, future, connection):
+        # usually called on the IOLoop thread: close() blocks (ssh teardown)
+        if self._closes_session(future._exception):
+            _run_blocking(self._close_session, connection)
+
+    def _close_session(self, connection):
+        # login pool thread
+        with self._connect_lock:
+            if self._connection is not connection:
+                # closed/replaced meanwhile
+                return
+            self.close()
+
+    def _update_breaker(self, breaker, future):
+        e = future._exception
+        if e is None or isinstance(e, (SwitchCommandException, SwitchAuthenticationException)):
+            breaker.record_success()
+        elif isinstance(e, self.device_failures):
+            breaker.record_failure(e)
+        else:
+            breaker.release_probe()
+
+    def _execute(self, connection=None, cmd=None, interactions=None):
+        if self.ioloop.in_loop_thread():
+            # a blocking wait inside the IOLoop thread would deadlock it
+            return super(AsyncSysSSH, self)._execute(connection=connection, cmd=cmd, interactions=interactions)
+        L2Transport._execute(self, connection=connection, cmd=cmd, interactions=interactions)
+        future = Future()
+        self.ioloop.add_callback(self._enqueue, future, connection, cmd, interactions)
+        return future.result()
+
+    def _execute_many(self, connection=None, cmds=None):
+        # no pipelining: each command goes through the IOLoop queue (shared with execute_async() callers)
+        return L2Transport._execute_many(self, connection=connection, cmds=cmds)
+
+    def _execute_stream(self, connection=None, cmd=None):
+        return L2Transport._execute_stream(self, connection=connection, cmd=cmd)
+
+    def _enqueue(self, future, connection, cmd, interactions):
+        # IOLoop thread
+        self._queue.append(_AsyncCommand(transport=self, future=future, connection=connection,
+                                         cmd=cmd, interactions=interactions))
+        if self._running is None:
+            self._run_next()
+
+    def _run_next(self, previous=None):
+        # IOLoop thread
+        self._running = None
+        if previous is not None and self._closes_session(previous.future._exception):
+            self._drain(previous.connection)
+        while self._queue and self._running is None:
+            command = self._queue.popleft()
+            if command.start() is True:
+                self._running = command
+                command.future.add_done_callback(lambda f, command=command: self._run_next(command))
+
+    def _drain(self, connection):
+        # IOLoop thread: 'connection' is being closed, its queued commands are never sent
+        # (the next command would read the CLI output left by the failed one)
+        drained     = [c for c in self._queue if c.connection is connection]
+        self._queue = deque(c for c in self._queue if c.connection is not connection)
+        for command in drained:
+            command.future.set_exception(NoTransportConnectionsAvailable("Session closed after a failed command; '%s' was not sent" \
+                                                                             % command.cmd))
+
+
+class _AsyncCommand(object):
+    """
+        State of one command (+interactions) running on the IOLoop (see SysSSH._execute())
+    """
+
+    def __init__(self, transport=None, future=None, connection=None, cmd=None, interactions=None):
+        self.transport   = transport
+        self.future      = future
+        self.connection  = connection
+        self.cmd         = cmd
+        self.ioloop      = transport.ioloop
+        self.context     = {"CTX-UUID": get_context_uid()}
+        self.buff        = RecvBuffer()
+        self.interaction = 0
+        self.interactions_re = [(re.compile(i_res), i_res, i_cmd) for i_res, i_cmd in interactions] if interactions else None
+        self._fd      = None
+        self._timeout = None
+
+    def start(self):
+        try:
+            self._fd = self.connection.fileno()
+            self.connection.send(self.transport.crlf(self.cmd))
+        except Exception, e:
+            self.future.set_exception(e)
+            return False
+        self.ioloop.add_handler(self._fd, self._on_readable, IOLoop.READ)
+        if self.transport.transaction_timeout:
+            self._timeout = self.ioloop.add_timeout(time.time() + self.transport.transaction_timeout, self._on_timeout)
+        return True
+
+    def _finish(self):
+        self.ioloop.remove_handler(self._fd)
+        if self._timeout is not None:
+            self.ioloop.remove_timeout(self._timeout)
+
+    def _on_timeout(self):
+        self._finish()
+        self.transport._logger.error("Incomplete data received: Stuck process or bad configured interactions -- context: %s. (transaction_timeout='%s'; recv_buffer='%s')" \
+                                        % (self.context, self.transport.transaction_timeout, self.buff.getvalue()))
+        self.buff.close()
+        self.future.set_exception(TransportTransactionException("Incomplete data received: Stuck process or bad configured interactions (transaction_timeout='%s')" \
+                                                                    % self.transport.transaction_timeout))
+
+    def _on_readable(self, fd, events):
+        transport  = self.transport
+        connection = self.connection
+        try:
+            if events & IOLoop.ERROR and not connection.recv_ready():
+                connection._check_child_state()
+                raise SSHProcessException("SSH process closed the connection")
+            stats = transport.recv_stats
+            while connection.recv_ready():
+                data = connection.recv(8192)
+                self.buff.write(data)
+                stats.iterations += 1
+                stats.bytes      += len(data)
+        except Exception, e:
+            self._finish()
+            self.buff.close()
+            self.future.set_exception(e)
+            return
+        if self.buff.search(transport.prompt_mark_re):
+            self._finish()
+            self._complete()
+            return
+        if self.interactions_re and self.interaction <= (len(self.interactions_re) - 1):
+            i_res_re, i_res, i_cmd = self.interactions_re[self.interaction]
+            if self.buff.search(i_res_re):
+                transport._logger.info("Pattern '%s' matched; Sending reply-command '%s' -- context: %s" % (i_res, i_cmd, self.context))
+                connection.send(transport.crlf(i_cmd))
+                self.interaction += 1
+
+    def _complete(self):
+        transport = self.transport
+        cmdout    = "\r\n".join(self.buff.getvalue().splitlines()[1:-1])
+        self.buff.close()
+        if transport.error_mark is not None:
+            m = transport.error_mark_re.search(cmdout)
+            if m:
+                self.future.set_exception(SwitchCommandException(m.group(1).strip()))
+                return
+        self.future.set_result(cmdout)
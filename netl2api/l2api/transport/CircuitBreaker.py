@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import time
+import random
+import threading
+from netl2api.l2api.exceptions import TransportCircuitOpen
+
+
+__all__ = ["CircuitBreaker", "configure_circuit_breakers", "get_circuit_breaker",
+           "circuit_breakers_state", "backoff_delay"]
+
+
+_circuit_breaker_cfg = {"enabled": True, "failure_threshold": 3, "open_timeout": 5,
+                        "max_open_timeout": 300, "probe_timeout": 120}
+_circuit_breakers      = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def backoff_delay(attempt, base=0.25, cap=2):
+    """
+    Jittered ('full jitter') exponential backoff: random delay in [0, min(cap, base * 2^(attempt-1))].
+    """
+    return random.uniform(0, min(cap, base * (2 ** max(attempt - 1, 0))))
+
+
+class CircuitBreaker(object):
+    """
+        Health state of a device (host:port), shared by every transport/session of it.
+
+        closed:    calls go through; 'failure_threshold' consecutive failures open the circuit.
+        open:      calls fail fast (TransportCircuitOpen) for a jittered exponential interval
+                   ('open_timeout' doubling on each consecutive opening, up to 'max_open_timeout').
+        half-open: the first call after that interval is let through as a probe (the others
+                   keep failing fast) -- success closes the circuit, failure reopens it.
+
+        Only connection-level failures count (see L2Transport.device_failures); a switch
+        replying with an error is a healthy device.
+    """
+
+    CLOSED    = "closed"
+    OPEN      = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, key=None, failure_threshold=3, open_timeout=5, max_open_timeout=300, probe_timeout=120):
+        self.key               = key
+        self.failure_threshold = failure_threshold
+        self.open_timeout      = open_timeout
+        self.max_open_timeout  = max_open_timeout
+        self.probe_timeout     = probe_timeout
+        self.state             = self.CLOSED
+        self.failures          = 0
+        self.opens             = 0
+        self.opened_at         = None
+        self.retry_at          = None
+        self.last_failure      = None
+        self.last_failure_at   = None
+        self.last_success_at   = None
+        self._probe_started    = None
+        self._lock             = threading.Lock()
+
+    def before_call(self, probe=True):
+        """
+        Raises TransportCircuitOpen if the call must fail fast.
+        probe=False: just check it (a half-open circuit is not claimed for a probe)
+        """
+        with self._lock:
+            now = time.time()
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and now >= self.retry_at:
+                self.state = self.HALF_OPEN
+                self._probe_started = None
+            if self.state == self.HALF_OPEN:
+                if self._probe_started is None or now - self._probe_started >= self.probe_timeout:
+                    if probe is True:
+                        self._probe_started = now
+                    return
+                retry_after = self.probe_timeout - (now - self._probe_started)
+            else:
+                retry_after = self.retry_at - now
+        raise TransportCircuitOpen("Device '%s' is unavailable (circuit %s after %s consecutive failures; last error: %s); retry after %.1f seconds" \
+                                       % (self.key, self.state, self.failures, self.last_failure, retry_after),
+                                   retry_after=retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self.state            = self.CLOSED
+            self.failures         = 0
+            self.opens            = 0
+            self.opened_at        = None
+            self.retry_at         = None
+            self.last_success_at  = time.time()
+            self._probe_started   = None
+
+    def record_failure(self, exc=None):
+        with self._lock:
+            now = time.time()
+            self.failures        += 1
+            self.last_failure     = "%s(%s)" % (exc.__class__.__name__, exc) if exc is not None else None
+            self.last_failure_at  = now
+            if self.state == self.OPEN:
+                # late failure of a call started before the circuit opened
+                return
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opens     += 1
+                interval        = min(self.max_open_timeout, self.open_timeout * (2 ** (self.opens - 1)))
+                self.state      = self.OPEN
+                self.opened_at  = now
+                # 'equal jitter': sessions of many devices that died together don't probe in lockstep
+                self.retry_at   = now + interval / 2.0 + random.uniform(0, interval / 2.0)
+                self._probe_started = None
+
+    def release_probe(self):
+        """
+        The half-open probe ended without telling anything about the device health
+        (eg. InvalidParameter): let the next call probe it
+        """
+        with self._lock:
+            self._probe_started = None
+
+    def allows_retry(self):
+        return self.state == self.CLOSED
+
+    def get_state(self):
+        with self._lock:
+            return { "state":                self.state,
+                     "consecutive_failures": self.failures,
+                     "opens":                self.opens,
+                     "opened_at":            self.opened_at,
+                     "retry_at":             self.retry_at,
+                     "last_failure":         self.last_failure,
+                     "last_failure_at":      self.last_failure_at,
+                     "last_success_at":      self.last_success_at }
+
+
+def configure_circuit_breakers(enabled=True, failure_threshold=3, open_timeout=5, max_open_timeout=300, probe_timeout=120):
+    """
+    Process-wide circuit breaker settings (see CircuitBreaker). Existing breakers are reset.
+
+        :enabled: Per-device circuit breakers on/off.
+            - type: bool.
+
+        :failure_threshold: Consecutive failures that open the circuit of a device.
+            - type: int.
+            - ex: 3
+
+        :open_timeout: Initial open interval (seconds); doubles on each consecutive opening.
+            - type: int/float.
+            - ex: 5
+
+        :max_open_timeout: Upper bound of the open interval (seconds).
+            - type: int/float.
+            - ex: 300
+
+        :probe_timeout: A half-open probe running for longer than this (seconds) is given up
+                        and another call is let through.
+            - type: int/float.
+            - ex: 120
+    """
+    with _circuit_breakers_lock:
+        _circuit_breaker_cfg.update({"enabled": enabled, "failure_threshold": failure_threshold,
+                                     "open_timeout": open_timeout, "max_open_timeout": max_open_timeout,
+                                     "probe_timeout": probe_timeout})
+        _circuit_breakers.clear()
+
+
+def get_circuit_breaker(host=None, port=None):
+    """
+    CircuitBreaker of 'host':'port' (None if disabled)
+    """
+    if _circuit_breaker_cfg["enabled"] is not True:
+        return None
+    key = "%s:%s" % (host, port)
+    try:
+        return _circuit_breakers[key]
+    except KeyError:
+        pass
+    with _circuit_breakers_lock:
+        if not _circuit_breakers.has_key(key):
+            _circuit_breakers[key] = CircuitBreaker(key=key,
+                failure_threshold=_circuit_breaker_cfg["failure_threshold"],
+                open_timeout=_circuit_breaker_cfg["open_timeout"],
+                max_open_timeout=_circuit_breaker_cfg["max_open_timeout"],
+                probe_timeout=_circuit_breaker_cfg["probe_timeout"])
+        return _circuit_breakers[key]
+
+
+def circuit_breakers_state():
+    """
+    {"host:port": CircuitBreaker.get_state()} of every device used by this process
+    """
+    return dict([(key, breaker.get_state()) for key, breaker in _circuit_breakers.items()])
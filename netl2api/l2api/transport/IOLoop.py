@@ -0,0 +1,322 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import os
+import time
+import fcntl
+import errno
+import heapq
+import select
+import logging
+import threading
+from functools import wraps
+from collections import deque
+
+
+__all__ = ["IOLoop", "Future", "FutureTimeout", "coroutine", "gather", "Return"]
+
+
+class Future(object):
+    """
+        Result of an operation scheduled on the IOLoop.
+        result() blocks the calling thread until set_result()/set_exception() is called.
+    """
+
+    def __init__(self):
+        self._done      = threading.Event()
+        self._result    = None
+        self._exception = None
+        self._callbacks = []
+        self._lock      = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise FutureTimeout("Operation not completed within %s seconds" % timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise FutureTimeout("Operation not completed within %s seconds" % timeout)
+        return self._exception
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._set_done()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._set_done()
+
+    def _set_done(self):
+        with self._lock:
+            self._done.set()
+            callbacks       = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+
+class IOLoop(object):
+    """
+        poll()-based event loop. A single thread multiplexes the I/O of every registered
+        file descriptor (eg. one pty per switch session), so waiting for hundreds of
+        switch responses doesn't need one blocked thread per session.
+
+        Handlers/timeouts must be (un)registered from the loop thread. Other threads
+        schedule work with add_callback() (thread-safe).
+    """
+
+    READ  = select.POLLIN | select.POLLPRI
+    WRITE = select.POLLOUT
+    ERROR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+    _instance      = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._poll      = select.poll()
+        self._handlers  = {}
+        self._callbacks = deque()
+        self._timeouts  = []
+        self._timeout_seq = 0
+        self._thread    = None
+        self._logger    = logging.getLogger(self.__class__.__name__)
+        self._waker_r, self._waker_w = os.pipe()
+        for fd in (self._waker_r, self._waker_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self._poll.register(self._waker_r, self.READ)
+
+    @classmethod
+    def instance(cls):
+        """
+        Process-wide IOLoop (started on first use, daemon thread)
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                ioloop        = cls()
+                ioloop.start()
+                cls._instance = ioloop
+        return cls._instance
+
+    def in_loop_thread(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def add_handler(self, fd, handler, events):
+        self._handlers[fd] = handler
+        self._poll.register(fd, events | self.ERROR)
+
+    def remove_handler(self, fd):
+        if self._handlers.pop(fd, None) is None:
+            return
+        try:
+            self._poll.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+    def add_timeout(self, deadline, callback):
+        """
+        Call 'callback' at 'deadline' (time.time() based). Returns an object to be passed to remove_timeout()
+        """
+        self._timeout_seq += 1
+        timeout = [deadline, self._timeout_seq, callback]
+        heapq.heappush(self._timeouts, timeout)
+        return timeout
+
+    @staticmethod
+    def remove_timeout(timeout):
+        timeout[2] = None
+
+    def add_callback(self, callback, *args, **kwargs):
+        self._callbacks.append((callback, args, kwargs))
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._waker_w, "x")
+        except OSError, e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _consume_waker(self):
+        try:
+            while os.read(self._waker_r, 4096):
+                pass
+        except OSError, e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _run_safe(self, callback, *args, **kwargs):
+        try:
+            callback(*args, **kwargs)
+        except Exception, e:
+            self._logger.exception("Exception on IOLoop callback %r: %s" % (callback, e))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="IOLoop")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            while self._callbacks:
+                callback, args, kwargs = self._callbacks.popleft()
+                self._run_safe(callback, *args, **kwargs)
+            poll_timeout = None
+            now = time.time()
+            while self._timeouts:
+                deadline, seq, callback = self._timeouts[0]
+                if callback is None:
+                    heapq.heappop(self._timeouts)
+                elif deadline <= now:
+                    heapq.heappop(self._timeouts)
+                    self._run_safe(callback)
+                else:
+                    poll_timeout = (deadline - now) * 1000
+                    break
+            if self._callbacks:
+                poll_timeout = 0
+            try:
+                events = self._poll.poll(poll_timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                if fd == self._waker_r:
+                    self._consume_waker()
+                    continue
+                handler = self._handlers.get(fd)
+                if handler is not None:
+                    self._run_safe(handler, fd, event)
+
+
+def gather(futures):
+    """
+    Future of the results of 'futures' (same order); fails with the first exception
+    """
+    futures = list(futures)
+    future  = Future()
+    pending = [len(futures)]
+    lock    = threading.Lock()
+    if not futures:
+        future.set_result([])
+        return future
+    def done(f):
+        with lock:
+            pending[0] -= 1
+            last = pending[0] == 0
+        if future.done():
+            return
+        if f._exception is not None:
+            future.set_exception(f._exception)
+        elif last is True:
+            future.set_result([f._result for f in futures])
+    for f in futures:
+        f.add_done_callback(done)
+    return future
+
+
+def coroutine(f):
+    """
+    Generator function => function returning a Future. The generator runs on the IOLoop thread:
+    it yields Futures (or lists of them, see gather()) and is resumed with their results (or their
+    exceptions are raised at the 'yield'); 'raise Return(value)' sets the Future result.
+    No thread is held while waiting, so it must not block (no execute(), only execute_async()).
+
+    Ex.:
+    @coroutine
+    def show_vlans_and_macs(transport):
+        vlans, macs = yield [transport.execute_async("show vlan brief"),
+                             transport.execute_async("show mac-address-table")]
+        raise Return((parse_vlans(vlans), parse_macs(macs)))
+    """
+    @wraps(f)
+    def start(*args, **kwargs):
+        future = Future()
+        ioloop = IOLoop.instance()
+        ioloop.add_callback(_Coroutine(ioloop, future, f, args, kwargs).step)
+        return future
+    return start
+
+
+class _Coroutine(object):
+    def __init__(self, ioloop, future, f, args, kwargs):
+        self.ioloop = ioloop
+        self.future = future
+        self.f      = f
+        self.args   = args
+        self.kwargs = kwargs
+        self.gen    = None
+
+    def step(self, value=None, exception=None):
+        # IOLoop thread
+        try:
+            if self.gen is None:
+                self.gen = self.f(*self.args, **self.kwargs)
+                yielded  = self.gen.next()
+            elif exception is not None:
+                yielded = self.gen.throw(exception)
+            else:
+                yielded = self.gen.send(value)
+        except StopIteration:
+            self.future.set_result(None)
+            return
+        except Return, r:
+            self.future.set_result(r.value)
+            return
+        except Exception, e:
+            self.future.set_exception(e)
+            return
+        if isinstance(yielded, (list, tuple)):
+            yielded = gather(yielded)
+        if not isinstance(yielded, Future):
+            self.gen.close()
+            self.future.set_exception(TypeError("Coroutines must yield Futures (got %r)" % (yielded,)))
+            return
+        yielded.add_done_callback(lambda f: self.ioloop.add_callback(self.step, f._result, f._exception))
+
+
+class Return(Exception):
+    """ 'return value' of a coroutine() (Python 2 generators can't return values) """
+
+    def __init__(self, value=None):
+        super(Return, self).__init__()
+        self.value = value
+
+
+class FutureTimeout(Exception):
+    pass
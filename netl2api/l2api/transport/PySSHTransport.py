@@ -25,15 +25,12 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 import re
 import ssh
 import time
+import errno
+import select
 from netl2api.l2api.utils import LF
 from netl2api.l2api.exceptions import *
 from netl2api.lib.utils import get_context_uid
-from netl2api.l2api.transport import L2Transport
-
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
+from netl2api.l2api.transport import L2Transport, RecvBuffer
 
 
 __all__ = ["PySSH"]
@@ -45,16 +42,11 @@ class PySSH(L2Transport):
         super(PySSH, self).__init__(port=port, *args, **kwargs)
         self.transport.crlf = LF
         self._ssh = None
-        self._recv_interactions_wait = 0.01
-        self._recv_interactions_max  = (self.transaction_timeout / self._recv_interactions_wait)
 
     @property
     def connection(self):
         if not self._connection or self._connection.closed is True:
-            connection = self._setup_connection()
-            self._skip_motd(connection=connection)
-            self._config_term(connection=connection)
-            self._connection = connection
+            self._connection = self._connect()
         return self._connection
 
     def _setup_connection(self):
@@ -75,30 +67,46 @@ class PySSH(L2Transport):
         return ssh_channel
 
     def _skip_motd(self, connection=None):
-        buff = StringIO()
-        while not self.prompt_mark_re.search(buff.getvalue()):
+        buff = RecvBuffer()
+        while not buff.search(self.prompt_mark_re):
             self._recvall_with_timeout(connection=connection, buff=buff)
         buff.close()
 
-    def _recvall_with_timeout(self, connection=None, buff=None):
-        i = 1
+    def _recvall_with_timeout(self, connection=None, buff=None, max_bytes=None):
+        # wake up as soon as new data arrives (no sleep-polling)
+        stats = self.recv_stats
         while not connection.recv_ready():
-            i += 1
-            if i >= self._recv_interactions_max:
+            waited = time.time()
+            try:
+                r_ready_fd, w_ready_fd, error_fd = select.select([connection], [], [], self.transaction_timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            finally:
+                stats.select_wait += time.time() - waited
+            if not r_ready_fd:
                 raise SSHTimeout(recv_timeout=self.transaction_timeout, recv_buff=buff.getvalue())
-            time.sleep(self._recv_interactions_wait)
+        recv_bytes = 0
         while connection.recv_ready():
-            buff.write(connection.recv(8192))
-            time.sleep(0.05) # give some time to kernel fill the buffer - next recv
+            data = connection.recv(8192)
+            buff.write(data)
+            recv_bytes += len(data)
+            stats.iterations += 1
+            if max_bytes is not None and recv_bytes >= max_bytes:
+                break
+        stats.bytes += recv_bytes
 
     def _execute(self, connection=None, cmd=None, interactions=None):
         super(PySSH, self)._execute(connection=connection, cmd=cmd, interactions=interactions)
         context     = {"CTX-UUID": get_context_uid()}
         logger      = self._logger
-        buff        = StringIO()
+        buff        = RecvBuffer()
         interaction = 0
+        # interaction patterns compiled once per call
+        interactions_re = [(re.compile(i_res), i_res, i_cmd) for i_res, i_cmd in interactions] if interactions else None
         connection.send(self.crlf(cmd))
-        while not self.prompt_mark_re.search(buff.getvalue()):
+        while not buff.search(self.prompt_mark_re):
             try:
                 self._recvall_with_timeout(connection=connection, buff=buff)
             except SSHTimeout, e:
@@ -106,10 +114,9 @@ class PySSH(L2Transport):
                 logger.error("Incomplete data received: Stuck process or bad configured interactions -- context: %s. (transaction_timeout='%s'; recv_buffer='%s')" \
                                      % (context, e.recv_timeout, e.recv_buff))
                 raise TransportTransactionException("Incomplete data received: Stuck process or bad configured interactions (transaction_timeout='%s')" % e.recv_timeout)
-            if interactions and interaction <= (len(interactions) - 1):
-                i_res, i_cmd = interactions[interaction]
-                i_res_re     = re.compile(i_res)
-                if i_res_re.search(buff.getvalue()):
+            if interactions_re and interaction <= (len(interactions_re) - 1):
+                i_res_re, i_res, i_cmd = interactions_re[interaction]
+                if buff.search(i_res_re):
                     logger.info("Pattern '%s' matched; Sending reply-command '%s' -- context: %s" % (i_res, i_cmd, context))
                     connection.send(self.crlf(i_cmd))
                     interaction += 1
@@ -124,6 +131,14 @@ class PySSH(L2Transport):
                 raise SwitchCommandException(m.group(1).strip())
         return cmdout
 
+    def _execute_many(self, connection=None, cmds=None):
+        if len(cmds) == 1:
+            return [self._execute(connection=connection, cmd=cmds[0])]
+        return self._execute_pipelined(connection=connection, cmds=cmds)
+
+    def _execute_stream(self, connection=None, cmd=None):
+        return self._execute_streamed(connection=connection, cmd=cmd)
+
 
 class SSHTimeout(TransportTimeout):
     def __init__(self, *args, **kwargs):
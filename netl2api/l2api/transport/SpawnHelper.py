@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import os
+import sys
+import pty
+import errno
+import signal
+import resource
+import threading
+from multiprocessing import Process, Pipe
+from multiprocessing.reduction import send_handle, recv_handle
+
+
+__all__ = ["close_fds", "SpawnHelper", "start_spawn_helper", "get_spawn_helper", "stop_spawn_helper"]
+
+
+def close_fds():
+    """
+    Close every fd >= 3 of the current process (child side of a fork, before exec).
+    Only the fds actually open are closed (/proc/self/fd): no RLIMIT_NOFILE-sized loop.
+    """
+    try:
+        fds = [int(fd) for fd in os.listdir("/proc/self/fd")]
+    except OSError:
+        # no procfs: single C-level loop
+        os.closerange(3, resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+        return
+    for fd in fds:
+        if fd > 2:
+            try:
+                os.close(fd)
+            except OSError:
+                # eg. the fd of the (already closed) listdir() handle
+                pass
+
+
+def _exec_child(argv, env):
+    close_fds()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        os.execvpe(argv[0], argv, env)
+    except Exception:
+        pass
+    os._exit(127)
+
+
+def _serve(conn):
+    # helper process: spawn/wait/kill requests, one at a time, until the daemon goes away
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, IOError):
+            os._exit(0)
+        op   = request[0]
+        args = request[1:]
+        try:
+            if op == "spawn":
+                child_pid, master_pty_fd = pty.fork()
+                if child_pid == pty.CHILD:
+                    _exec_child(*args)
+                conn.send(("ok", child_pid))
+                send_handle(conn, master_pty_fd, None)
+                os.close(master_pty_fd)
+            elif op == "waitpid":
+                conn.send(("ok", os.waitpid(*args)))
+            elif op == "kill":
+                conn.send(("ok", os.kill(*args)))
+            else:
+                conn.send(("error", errno.EINVAL, "Unknown spawn-helper request '%s'" % op))
+        except OSError, e:
+            conn.send(("error", e.errno, e.strerror))
+
+
+class SpawnHelper(object):
+    """
+        Small process forked at daemon start-up (single-threaded, small address space) that
+        forks/execs the ssh children on behalf of the daemon: the pty master fd is passed back
+        over a unix socket (SCM_RIGHTS), so the multi-threaded daemon itself never forks.
+
+        The ssh processes are children of the helper: waitpid()/kill() are also requests to it.
+        Requests are serialized (one lock); only the process that started the helper uses it
+        (forked workers spawn their children themselves).
+    """
+
+    def __init__(self):
+        self._conn, child_conn = Pipe(duplex=True)
+        self._process = Process(target=_serve, args=(child_conn,), name="netl2api [spawn-helper]")
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+        self._owner_pid = os.getpid()
+        self._lock      = threading.Lock()
+
+    @property
+    def usable(self):
+        return os.getpid() == self._owner_pid and self._process.is_alive()
+
+    def _request(self, *request):
+        # self._lock must be held
+        try:
+            self._conn.send(request)
+            reply = self._conn.recv()
+        except (EOFError, IOError), e:
+            raise OSError(errno.EPIPE, "Spawn-helper is gone: %s" % e)
+        if reply[0] == "error":
+            raise OSError(reply[1], reply[2])
+        return reply[1]
+
+    def spawn(self, argv, env):
+        """
+        pty.fork() + execvpe(argv[0], argv, env). Returns (child_pid, master_pty_fd)
+        """
+        with self._lock:
+            child_pid     = self._request("spawn", list(argv), dict(env))
+            master_pty_fd = recv_handle(self._conn)
+        return (child_pid, master_pty_fd)
+
+    def waitpid(self, pid, options):
+        with self._lock:
+            return self._request("waitpid", pid, options)
+
+    def kill(self, pid, sig):
+        with self._lock:
+            return self._request("kill", pid, sig)
+
+    def stop(self):
+        self._conn.close()
+        self._process.join(5)
+
+
+_spawn_helper      = None
+_spawn_helper_lock = threading.Lock()
+
+
+def start_spawn_helper():
+    """
+    Start the process-wide spawn helper (call early, before threads are started)
+    """
+    global _spawn_helper
+    with _spawn_helper_lock:
+        if _spawn_helper is None:
+            _spawn_helper = SpawnHelper()
+    return _spawn_helper
+
+
+def get_spawn_helper():
+    """
+    The spawn helper, or None if it is not started/usable from this process
+    """
+    helper = _spawn_helper
+    if helper is not None and helper.usable:
+        return helper
+    return None
+
+
+def stop_spawn_helper():
+    global _spawn_helper
+    with _spawn_helper_lock:
+        if _spawn_helper is not None:
+            _spawn_helper.stop()
+            _spawn_helper = None
@@ -24,62 +24,78 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 import re
 import time
+import errno
+import select
 from netl2api.l2api.exceptions import *
 from netl2api.lib.utils import get_context_uid
-from netl2api.l2api.transport import L2Transport
-from netl2api.l2api.transport.SystemSSH import SystemSSH, SSHAuthenticationFailed
-
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
+from netl2api.l2api.transport import L2Transport, RecvBuffer
+from netl2api.l2api.transport.SystemSSH import SystemSSH, SSHAuthenticationFailed, SSHProcessException, \
+                                              SSHNotReady, SSHTimeout, get_control_master
 
 
 __all__ = ["SysSSH"]
 
 
 class SysSSH(L2Transport):
+    device_failures = L2Transport.device_failures + (SSHProcessException, SSHNotReady, SSHTimeout)
+
     def __init__(self, port=22, *args, **kwargs):
         port = port if port is not None else 22
         super(SysSSH, self).__init__(port=port, *args, **kwargs)
-        self._recv_interactions_wait = 0.01
-        self._recv_interactions_max  = (self.transaction_timeout / self._recv_interactions_wait)
 
     @property
     def connection(self):
         if not self._connection or self._connection.closed is True:
-            connection = self._setup_connection()
-            self._config_term(connection=connection)
-            self._connection = connection
+            # no _skip_motd(): SystemSSH.open_session() returns at the prompt
+            self._connection = self._connect()
         return self._connection
 
     def _setup_connection(self):
-        ssh = SystemSSH(host=self.host, port=self.port, username=self.username, passwd=self.passwd)
         try:
+            # None unless SystemSSH.enable_control_master() was called (opt-in)
+            control_master = get_control_master(host=self.host, port=self.port, username=self.username, passwd=self.passwd)
+            ssh = SystemSSH(host=self.host, port=self.port, username=self.username, passwd=self.passwd,
+                            control_master=control_master)
             ssh.open_session()
         except SSHAuthenticationFailed:
             raise SwitchAuthenticationException("SSH Authentication failed (invalid username and/or passwd)")
         return ssh
 
-    def _recvall_with_timeout(self, connection=None, buff=None):
-        i = 1
+    def _recvall_with_timeout(self, connection=None, buff=None, max_bytes=None):
+        # wake up as soon as new data arrives (no sleep-polling)
+        stats = self.recv_stats
         while not connection.recv_ready():
-            i += 1
-            if i >= self._recv_interactions_max:
+            waited = time.time()
+            try:
+                r_ready_fd, w_ready_fd, error_fd = select.select([connection], [], [], self.transaction_timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            finally:
+                stats.select_wait += time.time() - waited
+            if not r_ready_fd:
                 raise SSHTimeout(recv_timeout=self.transaction_timeout, recv_buff=buff.getvalue())
-            time.sleep(self._recv_interactions_wait)
+        recv_bytes = 0
         while connection.recv_ready():
-            buff.write(connection.recv(8192))
-            time.sleep(0.05) # give some time to kernel fill the buffer - next recv
+            data = connection.recv(8192)
+            buff.write(data)
+            recv_bytes += len(data)
+            stats.iterations += 1
+            if max_bytes is not None and recv_bytes >= max_bytes:
+                break
+        stats.bytes += recv_bytes
 
     def _execute(self, connection=None, cmd=None, interactions=None):
         super(SysSSH, self)._execute(connection=connection, cmd=cmd, interactions=interactions)
         context     = {"CTX-UUID": get_context_uid()}
         logger      = self._logger
-        buff        = StringIO()
+        buff        = RecvBuffer()
         interaction = 0
+        # interaction patterns compiled once per call
+        interactions_re = [(re.compile(i_res), i_res, i_cmd) for i_res, i_cmd in interactions] if interactions else None
         connection.send(self.crlf(cmd))
-        while not self.prompt_mark_re.search(buff.getvalue()):
+        while not buff.search(self.prompt_mark_re):
             try:
                 self._recvall_with_timeout(connection=connection, buff=buff)
             except SSHTimeout, e:
@@ -87,10 +103,9 @@ class SysSSH(L2Transport):
                 logger.error("Incomplete data received: Stuck process or bad configured interactions -- context: %s. (transaction_timeout='%s'; recv_buffer='%s')" \
                                      % (context, e.recv_timeout, e.recv_buff))
                 raise TransportTransactionException("Incomplete data received: Stuck process or bad configured interactions (transaction_timeout='%s')" % e.recv_timeout)
-            if interactions and interaction <= (len(interactions) - 1):
-                i_res, i_cmd = interactions[interaction]
-                i_res_re     = re.compile(i_res)
-                if i_res_re.search(buff.getvalue()):
+            if interactions_re and interaction <= (len(interactions_re) - 1):
+                i_res_re, i_res, i_cmd = interactions_re[interaction]
+                if buff.search(i_res_re):
                     logger.info("Pattern '%s' matched; Sending reply-command '%s' -- context: %s" % (i_res, i_cmd, context))
                     connection.send(self.crlf(i_cmd))
                     interaction += 1
@@ -105,9 +120,10 @@ class SysSSH(L2Transport):
                 raise SwitchCommandException(m.group(1).strip())
         return cmdout
 
+    def _execute_many(self, connection=None, cmds=None):
+        if len(cmds) == 1:
+            return [self._execute(connection=connection, cmd=cmds[0])]
+        return self._execute_pipelined(connection=connection, cmds=cmds)
 
-class SSHTimeout(TransportTimeout):
-    def __init__(self, *args, **kwargs):
-        self.__dict__.update(kwargs)
-    def __str__(self):
-        return repr(self.__dict__)
+    def _execute_stream(self, connection=None, cmd=None):
+        return self._execute_streamed(connection=connection, cmd=cmd)
@@ -31,8 +31,14 @@ import errno
 #import shlex
 import signal
 import select
-import resource
+import shutil
+import tempfile
+import threading
 import collections
+from hashlib import sha1
+from netl2api.l2api.exceptions import TransportTimeout
+from netl2api.l2api.transport import RecvBuffer
+from netl2api.l2api.transport.SpawnHelper import close_fds, get_spawn_helper
 
 try:
     from cStringIO import StringIO
@@ -40,7 +46,8 @@ except ImportError:
     from StringIO import StringIO
 
 
-__all__ = ["SystemSSH"]
+__all__ = ["SystemSSH", "SSHControlMaster", "enable_control_master", "get_control_master",
+           "close_control_masters"]
 
 
 AUTH_PASSWD_RE = re.compile(r"(?:password|passcode):[\s]*$", re.IGNORECASE)
@@ -48,7 +55,16 @@ AUTH_PASSWD_RE = re.compile(r"(?:password|passcode):[\s]*$", re.IGNORECASE)
 
 
 class SystemSSH(object):
-    def __init__(self, host=None, port=22, username=None, passwd=None):
+    """
+        Interactive 'ssh' (OpenSSH client) process on a pty.
+
+        :control_master: Open the session as a channel of an already authenticated
+                         master connection (see get_control_master()); no password exchange.
+                         Falls back to a regular login if the master is gone.
+            - type: SSHControlMaster.
+    """
+
+    def __init__(self, host=None, port=22, username=None, passwd=None, control_master=None):
         self.host     = host
         self.port     = port if port is not None else 22
         self.username = username
@@ -60,6 +76,7 @@ class SystemSSH(object):
         self._ssh_auth_timeout    = 60
         self._ssh_child_pid       = None
         self._ssh_master_pty_fd   = None
+        self._spawn_helper        = None
         self.shell_prompt         = None
         # Causing some problems with python26 on Debian6:
         # -- 'execve() argument 1 must be encoded string without NULL bytes, not str'
@@ -71,6 +88,11 @@ class SystemSSH(object):
                          "-o StrictHostKeyChecking=no", "-o PreferredAuthentications=password,keyboard-interactive",
                          "-o NumberOfPasswordPrompts=1", "-o ControlMaster=no", "-o LogLevel=INFO",
                          "-p %s" % self.port, "%s@%s" % (self.username, self.host)]
+        self.control_master = control_master
+        self._control_master_acquired = False
+        if control_master is not None:
+            self._ssh_cmd.insert(self._ssh_cmd.index("-o ControlMaster=no") + 1,
+                                 "-o ControlPath=%s" % control_master.control_path)
 
     @property
     def opened(self):
@@ -91,7 +113,7 @@ class SystemSSH(object):
     def _check_child_state(self):
         self._check_child_basic()
         try:
-            pid, exit_st = os.waitpid(self._ssh_child_pid, os.WNOHANG)
+            pid, exit_st = self._waitpid(os.WNOHANG)
         except OSError, e:
             if e.errno == errno.ECHILD:
                 self._reset()
@@ -111,6 +133,17 @@ class SystemSSH(object):
             ssh_err_msg   = "%s exited with code '%s'" % (ssh_err_msg, ssh_exit_code)
         raise SSHProcessException(ssh_err_msg, pid=ssh_pid, exit_code=ssh_exit_code, signal=ssh_signal)
 
+    def _waitpid(self, options):
+        if self._spawn_helper is None:
+            return os.waitpid(self._ssh_child_pid, options)
+        # child of the spawn-helper: only ask it once the pty is hung up (ssh has exited)
+        if options & os.WNOHANG:
+            poller = select.poll()
+            poller.register(self._ssh_master_pty_fd, select.POLLHUP)
+            if not poller.poll(0):
+                return (0, 0)
+        return self._spawn_helper.waitpid(self._ssh_child_pid, options)
+
     def _select_fd(self, read=None, write=None, no_wait=False):
         no_wait = bool(no_wait)
         timeout = 0 if no_wait is True else self.timeout
@@ -143,6 +176,13 @@ class SystemSSH(object):
     def gettimeout(self):
         return self.timeout
 
+    def fileno(self):
+        """
+        PTY master fd -- allows select()/poll() on SystemSSH objects
+        """
+        self._check_child_basic()
+        return self._ssh_master_pty_fd
+
     def recv_ready(self):
         self._check_child_state()
         try:
@@ -166,21 +206,31 @@ class SystemSSH(object):
             pass
         else:
             raise SSHProcessException("SSH is already started")
-        try:
-            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
-        except ValueError:
-            # ValueError: signal only works in main thread
-            pass
-        try:
-            child_pid, master_pty_fd = pty.fork()
-        except OSError, e:
-            raise SSHProcessException("Error on pty.fork(): %s" % e)
-        if child_pid == pty.CHILD:
-            self._spawn_ssh()
+        spawn_helper = get_spawn_helper()
+        if spawn_helper is not None:
+            try:
+                child_pid, master_pty_fd = spawn_helper.spawn(self._ssh_cmd, self._get_env())
+            except OSError, e:
+                raise SSHSpawnException("Error on spawn-helper pty.fork(): %s" % e)
+            self._spawn_helper = spawn_helper
         else:
-            self._ssh_master_pty_fd = master_pty_fd
-            self._ssh_child_pid     = child_pid
-            self._ssh_auth()
+            try:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            except ValueError:
+                # ValueError: signal only works in main thread
+                pass
+            try:
+                child_pid, master_pty_fd = pty.fork()
+            except OSError, e:
+                raise SSHSpawnException("Error on pty.fork(): %s" % e)
+            if child_pid == pty.CHILD:
+                self._spawn_ssh()
+        self._ssh_master_pty_fd = master_pty_fd
+        self._ssh_child_pid     = child_pid
+        if self.control_master is not None:
+            self.control_master.acquire()
+            self._control_master_acquired = True
+        self._ssh_auth()
 
     def _spawn_ssh(self):
         self._close_fds()
@@ -193,12 +243,7 @@ class SystemSSH(object):
 
     @staticmethod
     def _close_fds():
-        max_fd = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
-        for fd in xrange(3, max_fd):
-            try:
-                os.close(fd)
-            except OSError:
-                pass
+        close_fds()
 
     # def _redir_stderr(self, to=None):
     #     stderr_fd = sys.__stderr__.fileno()
@@ -219,15 +264,19 @@ class SystemSSH(object):
         self.setblocking(1)
         self.settimeout(self._ssh_auth_timeout)
         try:
-            self._ssh_auth_wait_passwd_prompt()
-            self._ssh_auth_send_passwd()
-            self._ssh_auth_wait_shell_prompt()
+            if self.control_master is not None:
+                # multiplexed channel: already authenticated by the master
+                self._ssh_auth_wait_shell_prompt(passwd_fallback=True)
+            else:
+                self._ssh_auth_wait_passwd_prompt()
+                self._ssh_auth_send_passwd()
+                self._ssh_auth_wait_shell_prompt()
         finally:
             self.setblocking(old_block_flag)
             self.settimeout(old_timeout_value)
 
     def _ssh_auth_wait_passwd_prompt(self):
-        buff = StringIO()
+        buff = RecvBuffer()
         while True:
             try:
                 buff.write(self.recv())
@@ -235,15 +284,15 @@ class SystemSSH(object):
                 if buff.getvalue():
                     raise SSHProcessException(buff.getvalue().strip())
                 raise e
-            if AUTH_PASSWD_RE.search(buff.getvalue()):
+            if buff.search(AUTH_PASSWD_RE):
                 return
 
     def _ssh_auth_send_passwd(self):
         self.send("%s\r\n" % self.passwd)
         time.sleep(0.2)
 
-    def _ssh_auth_wait_shell_prompt(self):
-        buff           = StringIO()
+    def _ssh_auth_wait_shell_prompt(self, passwd_fallback=False):
+        buff           = RecvBuffer()
         #last_read_lens = collections.deque(maxlen=10)
         last_read_lens = collections.deque([], 10)
         crlf_sent      = False
@@ -251,9 +300,10 @@ class SystemSSH(object):
             while True:
                 curr_line = None
                 prev_line = None
-                buff_recv = self.recvall()
+                buff_recv = self.recvall(wait=0.02)
                 buff.write(buff_recv)
-                buff_lines = buff.getvalue().splitlines()
+                # only the last lines are needed (tail)
+                buff_lines = buff.tail.splitlines()
                 last_read_lens.append(len(buff_recv))
                 if len(buff_lines) == 0:
                     continue
@@ -263,7 +313,13 @@ class SystemSSH(object):
                     continue
                 if len(buff_lines) >= 2:
                     prev_line = buff_lines[-2].strip()
-                if AUTH_PASSWD_RE.search(buff.getvalue()):
+                if buff.search(AUTH_PASSWD_RE):
+                    if passwd_fallback is True:
+                        # master connection is gone: ssh fell back to a regular login
+                        passwd_fallback = False
+                        self._ssh_auth_send_passwd()
+                        buff = RecvBuffer()
+                        continue
                     raise SSHAuthenticationFailed("SSH Authentication failed (invalid username and/or passwd)")
                 staled = len(last_read_lens) == 10 and \
                                 reduce(lambda x,y: x+y, last_read_lens) == 0
@@ -296,7 +352,6 @@ class SystemSSH(object):
         else:
             if self.recv_ready() is False:
                 raise IOError("SSH file descriptor (stdout) is not ready for read operations")
-        time.sleep(0.05)
         try:
             buff = os.read(self._ssh_master_pty_fd, recv_bytes)
         except (OSError, ValueError), e:
@@ -304,8 +359,18 @@ class SystemSSH(object):
             raise e
         return buff
 
-    def recvall(self):
+    def recvall(self, wait=0):
+        """
+        Read everything available. If nothing is available, waits up to
+        'wait' seconds for new data (returns as soon as data arrives).
+        """
         buff = StringIO()
+        if wait and self.recv_ready() is False:
+            try:
+                select.select([self._ssh_master_pty_fd], [], [], wait)
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
         while self.recv_ready() is True:
             buff.write(self.recv(8192))
         return buff.getvalue()
@@ -319,7 +384,6 @@ class SystemSSH(object):
         else:
             if self.write_ready() is False:
                 raise IOError("SSH file descriptor (stdin) is not ready for write operations")
-        time.sleep(0.05)
         try:
             sent_bytes = os.write(self._ssh_master_pty_fd, data)
         except (OSError, ValueError), e:
@@ -330,18 +394,26 @@ class SystemSSH(object):
     def _reset(self):
         self._ssh_child_pid     = None
         self._ssh_master_pty_fd = None
+        self._spawn_helper      = None
         self.shell_prompt       = None
 
     def close(self):
+        if self._control_master_acquired is True:
+            self._control_master_acquired = False
+            self.control_master.release()
         try:
             self._check_child_state()
         except (SSHProcessException, SSHNotReady):
             pass
         else:
             try:
-                os.kill(self._ssh_child_pid, signal.SIGTERM)
+                if self._spawn_helper is not None:
+                    self._spawn_helper.kill(self._ssh_child_pid, signal.SIGTERM)
+                else:
+                    os.kill(self._ssh_child_pid, signal.SIGTERM)
                 time.sleep(0.1)
-                os.wait()
+                # only our own child (os.wait() could reap a control master process)
+                self._waitpid(0)
                 os.close(self._ssh_master_pty_fd)
             except OSError:
                 pass
@@ -352,6 +424,183 @@ class SystemSSH(object):
         self.close()
 
 
+class SSHControlMaster(SystemSSH):
+    """
+        OpenSSH master connection ('ssh -M -N') of a device. It authenticates once and
+        listens on 'control_path' (unix socket); SystemSSH(control_master=...) sessions
+        are opened as multiplexed channels over it (no TCP/SSH handshake, no password).
+
+        Managed by get_control_master()/close_control_masters(): kept while it has
+        sessions, closed after 'idle_timeout' seconds without them.
+    """
+
+    def __init__(self, host=None, port=22, username=None, passwd=None, control_path=None):
+        super(SSHControlMaster, self).__init__(host=host, port=port, username=username, passwd=passwd)
+        self.control_path = control_path
+        self.sessions     = 0
+        self.last_used    = time.time()
+        self._lock        = threading.Lock()
+        self._ssh_cmd = ["ssh", "-M", "-N", "-o ConnectTimeout=%s" % self._ssh_connect_timeout, "-o Protocol=2,1",
+                         "-o StrictHostKeyChecking=no", "-o PreferredAuthentications=password,keyboard-interactive",
+                         "-o NumberOfPasswordPrompts=1", "-o ControlMaster=yes", "-o ControlPath=%s" % control_path,
+                         "-o ControlPersist=no", "-o ServerAliveInterval=30", "-o LogLevel=INFO",
+                         "-p %s" % self.port, "%s@%s" % (self.username, self.host)]
+
+    def acquire(self):
+        with self._lock:
+            self.sessions += 1
+            self.last_used = time.time()
+
+    def release(self):
+        with self._lock:
+            self.sessions -= 1
+            self.last_used = time.time()
+
+    @property
+    def healthy(self):
+        """
+        Master process alive (pty not hung up) and control socket in place. A dead link makes
+        'ssh -M' exit (ServerAliveInterval), so no 'ssh -O check' process is forked to ask it
+        """
+        return self.opened and os.path.exists(self.control_path)
+
+    def _ssh_auth(self):
+        old_block_flag    = int(self.blocking)
+        old_timeout_value = self.timeout
+        self.setblocking(1)
+        self.settimeout(self._ssh_auth_timeout)
+        try:
+            self._ssh_auth_wait_passwd_prompt()
+            self._ssh_auth_send_passwd()
+            self._ssh_auth_wait_control_socket()
+        finally:
+            self.setblocking(old_block_flag)
+            self.settimeout(old_timeout_value)
+
+    def _ssh_auth_wait_control_socket(self):
+        # 'ssh -N' prints nothing once authenticated: the control socket shows up instead
+        buff     = RecvBuffer()
+        deadline = time.time() + self._ssh_auth_timeout
+        try:
+            while not os.path.exists(self.control_path):
+                if time.time() > deadline:
+                    self.close()
+                    raise SSHAuthenticationFailed("Timeout on SSH authentication")
+                buff.write(self.recvall(wait=0.1))
+                if buff.search(AUTH_PASSWD_RE):
+                    self.close()
+                    raise SSHAuthenticationFailed("SSH Authentication failed (invalid username and/or passwd)")
+        except SSHProcessException, e:
+            if hasattr(e, "exit_code") and getattr(e, "exit_code") == 255:
+                raise SSHAuthenticationFailed("SSH Authentication failed (invalid username and/or passwd)")
+            raise e
+
+    def close(self):
+        super(SSHControlMaster, self).close()
+        try:
+            os.unlink(self.control_path)
+        except OSError:
+            pass
+
+
+_control_masters       = {}
+_control_masters_lock  = threading.Lock()
+_control_master_locks  = {}
+_control_master_reaper = None
+_control_master_cfg    = {"enabled": False, "control_dir": None, "remove_dir": False, "idle_timeout": 300}
+
+
+def enable_control_master(control_dir=None, idle_timeout=300):
+    """
+    Opt-in: SysSSH sessions will be opened as channels of a per-device master connection.
+
+        :control_dir: Private (0700) directory for the control sockets (a temporary one if None).
+            - type: str.
+            - ex: "/var/run/netl2api/ssh"
+
+        :idle_timeout: Masters without sessions for this time (seconds) are closed.
+            - type: int/float.
+    """
+    global _control_master_reaper
+    remove_dir = False
+    if not control_dir:
+        control_dir = tempfile.mkdtemp(prefix="netl2api-ssh-")
+        remove_dir  = True
+    elif not os.path.isdir(control_dir):
+        os.makedirs(control_dir, 0700)
+    os.chmod(control_dir, 0700)
+    with _control_masters_lock:
+        _control_master_cfg.update({"enabled": True, "control_dir": control_dir,
+                                    "remove_dir": remove_dir, "idle_timeout": idle_timeout})
+        if _control_master_reaper is None:
+            _control_master_reaper = threading.Thread(target=_reap_control_masters, name="ssh-control-master-reaper")
+            _control_master_reaper.daemon = True
+            _control_master_reaper.start()
+
+
+def get_control_master(host=None, port=22, username=None, passwd=None):
+    """
+    Authenticated master connection of host/port/username (started on demand).
+    Returns None if the ControlMaster mode is disabled or the master could not be started
+    (SystemSSH then does a regular login); raises SSHAuthenticationFailed on bad credentials.
+    """
+    if _control_master_cfg["enabled"] is False:
+        return None
+    key = (host, port if port is not None else 22, username)
+    with _control_masters_lock:
+        master_lock = _control_master_locks.setdefault(key, threading.Lock())
+    # one login per device at a time (other devices are not blocked)
+    with master_lock:
+        master = _control_masters.get(key)
+        if master is not None and master.healthy:
+            return master
+        if master is not None:
+            _control_masters.pop(key, None)
+            master.close()
+        # unix socket paths are short (~100 chars): hashed name, pid avoids clashes between processes
+        control_path = os.path.join(_control_master_cfg["control_dir"], "%s-%s" \
+                                        % (os.getpid(), sha1("%s@%s:%s" % (username, host, key[1])).hexdigest()[:16]))
+        master = SSHControlMaster(host=host, port=key[1], username=username, passwd=passwd, control_path=control_path)
+        try:
+            master.open_session()
+        except SSHAuthenticationFailed:
+            raise
+        except (SystemSSHException, OSError, IOError):
+            master.close()
+            return None
+        _control_masters[key] = master
+        return master
+
+
+def _reap_control_masters():
+    while True:
+        idle_timeout = _control_master_cfg["idle_timeout"]
+        time.sleep(max(idle_timeout / 2.0, 1))
+        for key, master in _control_masters.items():
+            with _control_master_locks[key]:
+                if _control_masters.get(key) is not master:
+                    continue
+                if master.healthy and (master.sessions > 0 or (time.time() - master.last_used) <= idle_timeout):
+                    continue
+                _control_masters.pop(key, None)
+                master.close()
+
+
+def close_control_masters():
+    """
+    Close every master connection and remove the control sockets (daemon stop)
+    """
+    with _control_masters_lock:
+        masters = _control_masters.values()
+        _control_masters.clear()
+        _control_master_cfg["enabled"] = False
+    for master in masters:
+        master.close()
+    control_dir = _control_master_cfg["control_dir"]
+    if control_dir and _control_master_cfg["remove_dir"] is True:
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+
 class SystemSSHException(Exception):
     pass
 
@@ -369,8 +618,17 @@ class SSHProcessException(SystemSSHException):
 class SSHNotReady(SystemSSHException):
     pass
 
-class SSHTimeout(SystemSSHException):
+class SSHSpawnException(SystemSSHException):
+    # local failure to start ssh (eg. EAGAIN/EMFILE on pty.fork()): not a device failure
     pass
 
+class SSHTimeout(SystemSSHException, TransportTimeout):
+    # also a TransportTimeout: SysSSH raises it with recv_timeout/recv_buff (see L2Transport._execute_pipelined())
+    def __init__(self, *args, **kwargs):
+        super(SSHTimeout, self).__init__(*args)
+        self.__dict__.update(kwargs)
+    def __str__(self):
+        return self.args[0] if self.args else repr(self.__dict__)
+
 class SSHAuthenticationFailed(SystemSSHException):
     pass
@@ -88,11 +88,16 @@ class Telnet(L2Transport):
             for i_res, i_cmd in interactions:
                 i_res_re  = re.compile(i_res)
                 i_cmd_res = connection.expect([i_res_re], self.transaction_timeout)
+                self.recv_stats.iterations += 1
+                self.recv_stats.bytes      += len(i_cmd_res[2])
                 if i_cmd_res[0] >= 0:
                     logger.info("Pattern '%s' matched; Sending reply-command '%s' -- context: %s" % (i_res, i_cmd, context))
                     buff.write(i_cmd_res[2])
                     connection.write(self.crlf(i_cmd))
         cmd_res = connection.expect([self.prompt_mark_re], self.transaction_timeout)
+        # telnetlib.expect() reads+waits internally: one iteration per expect() (no select time split)
+        self.recv_stats.iterations += 1
+        self.recv_stats.bytes      += len(cmd_res[2])
         buff.write(cmd_res[2])
         try:
             self._check_telnet_return(cmd_res)
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import time
+import socket
+import logging
+import threading
+from collections import deque
+from netl2api.l2api.exceptions import *
+
+
+__all__ = ["TransportPool"]
+
+
+class TransportPool(object):
+    """
+        Pool of L2Transport sessions (same switch/credentials) for L2API.
+        Exposes the same interface used by L2API classes (execute(), close(), crlf, host, etc),
+        so it can replace a single transport object. Each execute() checks out one session
+        (with all its interactions) and checks it in afterwards, so concurrent calls run
+        in parallel on different CLI sessions.
+
+        :transport: L2Transport class (SysSSH, PySSH, Telnet).
+            - type: class.
+            - ex: SysSSHTransport.SysSSH
+
+        :max_connections: Max number of sessions opened against the switch.
+            - type: int.
+            - ex: 2
+
+        :wait_timeout: Time to wait for a free session. If no session is checked in within
+                        this time, a NoTransportConnectionsAvailable() exception is raised.
+                        None = wait forever.
+            - type: int/float.
+            - ex: 60
+
+        Any other keyword argument is passed to the transport class (see L2Transport).
+    """
+
+    def __init__(self, transport=None, max_connections=2, wait_timeout=60, **kwargs):
+        if transport is None:
+            raise InvalidParameter("'transport' parameter is not defined or invalid")
+        if type(max_connections) is not int or max_connections < 1:
+            raise InvalidParameter("'max_connections' parameter is invalid")
+        if type(wait_timeout) not in (type(None), int, float):
+            raise InvalidParameter("'wait_timeout' parameter is invalid")
+
+        self.transport_class = transport
+        self.max_connections = max_connections
+        self.wait_timeout    = wait_timeout
+        self._transport_args = kwargs
+        self._transports     = []
+        self._idle_transports = deque()
+        self._cond   = threading.Condition(threading.Lock())
+        self._logger = logging.getLogger(self.__class__.__name__)
+        # no connection is established here (lazy) -- only validates parameters
+        tmpl_transport = self.transport_class(**self._transport_args)
+        self._transports.append(tmpl_transport)
+        self._idle_transports.append(tmpl_transport)
+        self.host     = tmpl_transport.host
+        self.port     = tmpl_transport.port
+        self.username = tmpl_transport.username
+        self._crlf    = tmpl_transport.crlf
+        self.device_failures = tmpl_transport.device_failures
+
+    @property
+    def crlf(self):
+        return self._crlf
+
+    @crlf.setter
+    def crlf(self, value):
+        with self._cond:
+            self._crlf = value
+            for t in self._transports:
+                t.crlf = value
+
+    @property
+    def _connection(self):
+        """
+        Some session is established (see L2Transport._connection)
+        """
+        for t in self._transports:
+            if t._connection is not None:
+                return t._connection
+
+    def checkout(self):
+        deadline = time.time() + self.wait_timeout if self.wait_timeout is not None else None
+        evicted  = []
+        try:
+            with self._cond:
+                while True:
+                    while self._idle_transports:
+                        transport = self._idle_transports.pop()
+                        if self._is_alive(transport):
+                            return transport
+                        evicted.append(self._evict(transport))
+                    if len(self._transports) < self.max_connections:
+                        transport      = self.transport_class(**self._transport_args)
+                        transport.crlf = self._crlf
+                        self._transports.append(transport)
+                        return transport
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise NoTransportConnectionsAvailable("No transport connections available for '%s' (max_connections='%s'; wait_timeout='%s')" \
+                                                                % (self.host, self.max_connections, self.wait_timeout))
+                    self._cond.wait(remaining)
+        finally:
+            self._close_evicted(evicted)
+
+    def checkin(self, transport, evict=False):
+        evicted = []
+        with self._cond:
+            if evict is True:
+                evicted.append(self._evict(transport))
+            elif transport in self._transports:
+                self._idle_transports.append(transport)
+            self._cond.notify()
+        self._close_evicted(evicted)
+
+    @staticmethod
+    def _is_alive(transport):
+        connection = transport._connection
+        return connection is None or getattr(connection, "closed", False) is not True
+
+    def _evict(self, transport):
+        # self._cond must be held -- close it (_close_evicted()) after releasing the lock:
+        # closing a session may block (eg. waiting for the ssh process to exit)
+        try:
+            self._transports.remove(transport)
+        except ValueError:
+            pass
+        return transport
+
+    def _close_evicted(self, transports):
+        for transport in transports:
+            self._logger.debug("Evicting transport session (%s@%s:%s)" % (self.username, self.host, self.port))
+            transport.close()
+
+    def execute(self, cmd=None, interactions=None):
+        """
+        See L2Transport.execute()
+        """
+        transport = self.checkout()
+        evict     = False
+        try:
+            return transport.execute(cmd=cmd, interactions=interactions)
+        except (socket.error, socket.timeout, TransportTimeout, SwitchAuthenticationException):
+            evict = True
+            raise
+        finally:
+            self.checkin(transport, evict=evict)
+
+    def execute_many(self, cmds=None):
+        """
+        See L2Transport.execute_many()
+        """
+        transport = self.checkout()
+        evict     = False
+        try:
+            return transport.execute_many(cmds=cmds)
+        except (socket.error, socket.timeout, TransportTimeout, SwitchAuthenticationException):
+            evict = True
+            raise
+        finally:
+            self.checkin(transport, evict=evict)
+
+    def execute_stream(self, cmd=None):
+        """
+        See L2Transport.execute_stream() -- the session is held until the iteration ends
+        """
+        transport = self.checkout()
+        evict     = False
+        try:
+            for line in transport.execute_stream(cmd=cmd):
+                yield line
+        except (socket.error, socket.timeout, TransportTimeout, SwitchAuthenticationException):
+            evict = True
+            raise
+        finally:
+            self.checkin(transport, evict=evict)
+
+    def close(self):
+        """
+        Close all idle sessions (sessions in use are kept)
+        """
+        evicted = []
+        with self._cond:
+            while self._idle_transports:
+                evicted.append(self._evict(self._idle_transports.pop()))
+            self._cond.notify_all()
+        self._close_evicted(evicted)
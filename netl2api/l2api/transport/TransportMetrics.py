@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import re
+import threading
+from netl2api.l2api.transport.CircuitBreaker import CircuitBreaker, circuit_breakers_state
+
+
+__all__ = ["RecvStats", "MetricsRegistry", "transport_metrics", "command_family", "render_prometheus"]
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180)
+
+# name => (type, help)
+METRICS = {
+    "netl2api_transport_command_duration_seconds": ("histogram", "Command round trip (send to prompt), per device and command family"),
+    "netl2api_transport_batch_duration_seconds":   ("histogram", "Pipelined command batch round trip (execute_many())"),
+    "netl2api_transport_commands_total":           ("counter",   "Commands executed (batched ones included)"),
+    "netl2api_transport_command_errors_total":     ("counter",   "Commands that raised an exception, per exception type"),
+    "netl2api_transport_recv_bytes_total":         ("counter",   "Bytes received from the device"),
+    "netl2api_transport_recv_iterations_total":    ("counter",   "recv() calls on the device connection"),
+    "netl2api_transport_select_wait_seconds_total":("counter",   "Time blocked in select() waiting for device output"),
+    "netl2api_transport_retry_sleep_seconds_total":("counter",   "Time slept between retries (l2api_retry backoff)"),
+    "netl2api_transport_retries_total":            ("counter",   "Retried calls (connection reset by the device)"),
+    "netl2api_transport_connect_duration_seconds": ("histogram", "Session setup: connect + authentication + MOTD + terminal config"),
+    "netl2api_transport_connects_total":           ("counter",   "Sessions established"),
+    "netl2api_transport_reconnects_total":         ("counter",   "Sessions re-established by a transport that already had one"),
+    "netl2api_transport_connect_errors_total":     ("counter",   "Failed session setups, per exception type"),
+    "netl2api_transport_circuit_state":            ("gauge",     "Circuit breaker state of the device (1 for the current state)"),
+    "netl2api_autocache_patch_drift_total":        ("counter",   "Write-through patched L2API responses found different from the device on reconciliation"),
+}
+
+RE_FAMILY_WORD = re.compile(r"^[a-z][a-z\-]*$")
+
+
+def command_family(cmd):
+    """
+    Low-cardinality label of a CLI command: up to two leading keywords (arguments dropped).
+
+        >>> command_family("show interfaces switchport TenGigabitEthernet 0/1")
+        'show interfaces'
+        >>> command_family("vlan 100")
+        'vlan'
+    """
+    words = []
+    for word in cmd.strip().lower().split(None, 2)[:2]:
+        if not RE_FAMILY_WORD.match(word):
+            break
+        words.append(word)
+    return " ".join(words) or "other"
+
+
+class RecvStats(object):
+    """
+        Receive counters of one transport session, updated by its recv loop
+        (cheap attribute increments) and flushed to the registry once per command
+    """
+
+    __slots__ = ("bytes", "iterations", "select_wait")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.bytes       = 0
+        self.iterations  = 0
+        self.select_wait = 0.0
+
+
+class _Histogram(object):
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts  = [0] * len(buckets)
+        self.sum     = 0.0
+        self.count   = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum   += value
+        self.count += 1
+
+
+class MetricsRegistry(object):
+    """
+        Process-wide counters/histograms keyed by (metric name, labels);
+        render() writes them in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self._counters   = {}
+        self._histograms = {}
+        self._lock       = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            try:
+                histogram = self._histograms[key]
+            except KeyError:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(value)
+
+    def flush_recv_stats(self, labels, stats):
+        if not stats.iterations and not stats.select_wait:
+            return
+        with self._lock:
+            for name, value in (("netl2api_transport_recv_bytes_total",          stats.bytes),
+                                ("netl2api_transport_recv_iterations_total",     stats.iterations),
+                                ("netl2api_transport_select_wait_seconds_total", stats.select_wait)):
+                key = (name, labels)
+                self._counters[key] = self._counters.get(key, 0) + value
+        stats.reset()
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters   = self._counters.items()
+            histograms = [(key, (h.buckets, list(h.counts), h.sum, h.count)) for key, h in self._histograms.items()]
+        samples = {}
+        for (name, labels), value in counters:
+            samples.setdefault(name, []).append((labels, ["%s%s %s" % (name, _fmt_labels(labels), _fmt_value(value))]))
+        for (name, labels), (buckets, counts, h_sum, h_count) in histograms:
+            lines      = []
+            cumulative = 0
+            for bound, count in zip(buckets, counts):
+                cumulative += count
+                lines.append("%s_bucket%s %s" % (name, _fmt_labels(labels + (("le", _fmt_value(bound)),)), cumulative))
+            lines.append("%s_bucket%s %s" % (name, _fmt_labels(labels + (("le", "+Inf"),)), h_count))
+            lines.append("%s_sum%s %s" % (name, _fmt_labels(labels), _fmt_value(h_sum)))
+            lines.append("%s_count%s %s" % (name, _fmt_labels(labels), h_count))
+            samples.setdefault(name, []).append((labels, lines))
+        return _render_samples(samples)
+
+
+def _fmt_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(['%s="%s"' % (k, str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) \
+                                  for k, v in labels])
+
+
+def _fmt_value(value):
+    if type(value) is float:
+        return repr(value)
+    return str(value)
+
+
+def _render_samples(samples):
+    # samples: {name: [(labels, lines), ...]} -- one HELP/TYPE header per metric, series sorted by labels
+    out = []
+    for name in sorted(samples.keys()):
+        m_type, m_help = METRICS.get(name, ("untyped", name))
+        out.append("# HELP %s %s" % (name, m_help))
+        out.append("# TYPE %s %s" % (name, m_type))
+        for labels, lines in sorted(samples[name]):
+            out.extend(lines)
+    return "\n".join(out) + "\n" if out else ""
+
+
+transport_metrics = MetricsRegistry()
+
+
+def render_prometheus():
+    """
+    Transport metrics + circuit breaker states (Prometheus text format, version 0.0.4)
+    """
+    name    = "netl2api_transport_circuit_state"
+    circuit = []
+    for key, state in circuit_breakers_state().items():
+        for s in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN):
+            labels = (("host", key), ("state", s))
+            circuit.append((labels, ["%s%s %s" % (name, _fmt_labels(labels), int(state["state"] == s))]))
+    return transport_metrics.render() + (_render_samples({name: circuit}) if circuit else "")
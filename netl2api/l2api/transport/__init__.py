@@ -27,40 +27,117 @@ import time
 import socket
 import logging
 from functools import wraps
+from contextlib import contextmanager
 from netl2api.l2api.exceptions import *
 from netl2api.l2api.utils import LF, CRLF
 from netl2api.lib.utils import get_context_uid
+from netl2api.l2api.transport.CircuitBreaker import get_circuit_breaker, backoff_delay
+from netl2api.l2api.transport.TransportMetrics import RecvStats, transport_metrics, command_family
 from errno import EPIPE, ECONNABORTED, ECONNRESET, ENETRESET
 
 
-__all__ = ["L2Transport"]
+__all__ = ["L2Transport", "RecvBuffer"]
 
 
 def l2api_retry(times=1):
     def proxy(f):
         @wraps(f)
         def retry_exec(self, *args, **kwargs):
-            count = 1
+            breaker = self.circuit_breaker
+            count   = 1
             while True:
+                if breaker is not None:
+                    # fail fast: no connect/auth timeouts while the device is known to be down
+                    breaker.before_call()
                 try:
                     r = f(self, *args, **kwargs)
-                except (socket.error, socket.timeout), e:
-                    if isinstance(e, socket.error) and \
+                except self.device_failures, e:
+                    if breaker is not None:
+                        breaker.record_failure(e)
+                    if not isinstance(e, socket.error) or \
                             e.errno not in (EPIPE, ECONNABORTED, ECONNRESET, ENETRESET):
                         raise e
-                    if count >= times:
+                    if count >= times or (breaker is not None and not breaker.allows_retry()):
                         raise e
                     count += 1
                     self.close()
-                    #if isinstance(e, socket.timeout):
-                    #    time.sleep(2)
-                    time.sleep(3)
+                    # short jittered pause (the request thread used to sleep 3 seconds here)
+                    delay = backoff_delay(count - 1)
+                    transport_metrics.inc("netl2api_transport_retries_total", self.metrics_labels)
+                    transport_metrics.inc("netl2api_transport_retry_sleep_seconds_total", self.metrics_labels, delay)
+                    time.sleep(delay)
+                except (SwitchCommandException, SwitchAuthenticationException):
+                    # the device is up and replying
+                    if breaker is not None:
+                        breaker.record_success()
+                    raise
+                except Exception:
+                    if breaker is not None:
+                        breaker.release_probe()
+                    raise
                 else:
+                    if breaker is not None:
+                        breaker.record_success()
                     return r
         return retry_exec
     return proxy
 
 
+class RecvBuffer(object):
+    """
+        Receive buffer used by transports while waiting for the prompt mark/interactions.
+        Every received chunk is kept (see getvalue()), but search() only scans the data
+        received since the last search plus a bounded overlap window of the previously
+        scanned data (tail) -- instead of rescanning the whole output on each read.
+
+        :window: Size (bytes) of the overlap window kept from the previously scanned data.
+                    Must be larger than the longest prompt/interaction to be matched.
+            - type: int.
+            - ex: 1024
+    """
+
+    def __init__(self, window=1024):
+        self.window   = window
+        self._chunks  = []
+        self._pending = []
+        self._unread  = []
+        self._tail    = ""
+
+    def write(self, data):
+        if not data:
+            return
+        self._chunks.append(data)
+        self._pending.append(data)
+        self._unread.append(data)
+
+    def read_new(self):
+        """ Data received since the last read_new() call (independent of search()/getvalue()) """
+        data         = "".join(self._unread)
+        self._unread = []
+        return data
+
+    @property
+    def tail(self):
+        if self._pending:
+            self._tail    = self._tail[-self.window:] + "".join(self._pending)
+            self._pending = []
+        return self._tail
+
+    def search(self, regex):
+        return regex.search(self.tail)
+
+    def getvalue(self):
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def close(self):
+        self._chunks  = []
+        self._pending = []
+        self._unread  = []
+        self._tail    = ""
+
+
 class L2Transport(object):
     """
         SSH transport (encrypted) for L2API.
@@ -161,22 +238,78 @@ class L2Transport(object):
         self.close_on_switch_error      = close_on_switch_error
         self.close_on_transaction_error = close_on_transaction_error
         self._connection = None
+        self._connects   = 0
+        self.recv_stats  = RecvStats()
+        self.metrics_labels = (("host", "%s:%s" % (self.host, self.port)),)
         self._logger     = logging.getLogger(self.__class__.__name__)
         logging.basicConfig(format="%%(asctime)s [%%(levelname)s] %s[%%(process)d/%%(threadName)s]: %%(message)s" %\
                                  self.__class__.__name__)
         self._logger.setLevel(logging.DEBUG)
 
+    # exceptions meaning "device unreachable/unresponsive" (circuit breaker failures, see l2api_retry())
+    device_failures = (EnvironmentError, EOFError, TransportTimeout)
+
+    @property
+    def circuit_breaker(self):
+        """
+        Health state shared by every session of this device (None if disabled)
+        """
+        return get_circuit_breaker(host=self.host, port=self.port)
+
     @property
     def connection(self):
         """
         Lazy connection-object creation (SSH, Telnet, etc)
         """
         if not self._connection:
+            self._connection = self._connect()
+        return self._connection
+
+    def _connect(self):
+        """
+        _setup_connection() + _skip_motd() + _config_term(), timed (see TransportMetrics)
+        """
+        started = time.time()
+        try:
             connection = self._setup_connection()
             self._skip_motd(connection=connection)
             self._config_term(connection=connection)
-            self._connection = connection
-        return self._connection
+        except Exception, e:
+            transport_metrics.inc("netl2api_transport_connect_errors_total",
+                                  self.metrics_labels + (("error", e.__class__.__name__),))
+            raise
+        finally:
+            transport_metrics.flush_recv_stats(self.metrics_labels, self.recv_stats)
+        transport_metrics.observe("netl2api_transport_connect_duration_seconds", self.metrics_labels, time.time() - started)
+        transport_metrics.inc("netl2api_transport_connects_total", self.metrics_labels)
+        if self._connects > 0:
+            transport_metrics.inc("netl2api_transport_reconnects_total", self.metrics_labels)
+        self._connects += 1
+        return connection
+
+    @contextmanager
+    def _command_metrics(self, cmds):
+        """
+        Latency/errors of 'cmds' (one command, or a pipelined batch) + recv counters
+        """
+        families = [command_family(cmd) for cmd in cmds]
+        started  = time.time()
+        try:
+            yield
+        except Exception, e:
+            transport_metrics.inc("netl2api_transport_command_errors_total",
+                                  self.metrics_labels + (("family", families[0]), ("error", e.__class__.__name__)))
+            raise
+        finally:
+            elapsed = time.time() - started
+            if len(families) == 1:
+                transport_metrics.observe("netl2api_transport_command_duration_seconds",
+                                          self.metrics_labels + (("family", families[0]),), elapsed)
+            else:
+                transport_metrics.observe("netl2api_transport_batch_duration_seconds", self.metrics_labels, elapsed)
+            for family in families:
+                transport_metrics.inc("netl2api_transport_commands_total", self.metrics_labels + (("family", family),))
+            transport_metrics.flush_recv_stats(self.metrics_labels, self.recv_stats)
 
     def _setup_connection(self):
         """
@@ -208,6 +341,206 @@ class L2Transport(object):
             "; ".join(["'%s'->'%s'" % (i_res, i_cmd) for i_res, i_cmd in interactions]) \
             if interactions else "''", context))
 
+    def _execute_many(self, connection=None, cmds=None):
+        """
+        Execute read-only commands 'cmds' using 'connection' object (one round trip per command).
+        Transports able to pipeline them (see _execute_pipelined()) override this
+        """
+        return [self._execute(connection=connection, cmd=cmd) for cmd in cmds]
+
+    def _execute_pipelined(self, connection=None, cmds=None):
+        """
+        Write all 'cmds' at once and split the combined output using the echoed command
+        lines ('<prompt><cmd>') as boundaries. Requires _recvall_with_timeout() (stream transports)
+        """
+        context = {"CTX-UUID": get_context_uid()}
+        self._logger.info("%s(%s@%s:%s): Commands '%s' invoked (pipelined) -- context: %s" % \
+            (self.__class__.__name__, self.username, self.host, self.port, "'; '".join(cmds), context))
+        echo_res = [re.compile(r"^[^\r\n]*%s\s*%s[ \t]*\r?$" % (self.prompt_mark, re.escape(cmd.strip())), re.M) \
+                        for cmd in cmds[1:]]
+        # echo line offsets; the echoes are searched only in newly received data (plus the
+        # last, possibly incomplete, line already scanned), never in the whole output again
+        echoes    = []
+        scan      = ""
+        scan_base = 0
+        buff      = RecvBuffer()
+        connection.send("".join([self.crlf(cmd) for cmd in cmds]))
+        while True:
+            try:
+                self._recvall_with_timeout(connection=connection, buff=buff)
+            except TransportTimeout, e:
+                buff.close()
+                self._logger.error("Incomplete data received: Stuck process or unexpected pipelined output -- context: %s. (transaction_timeout='%s'; recv_buffer='%s')" \
+                                     % (context, e.recv_timeout, e.recv_buff))
+                raise TransportTransactionException("Incomplete data received: Stuck process or unexpected pipelined output (transaction_timeout='%s')" % e.recv_timeout)
+            if len(echoes) < len(echo_res):
+                scan += buff.read_new()
+                pos   = 0
+                while len(echoes) < len(echo_res):
+                    m = echo_res[len(echoes)].search(scan, pos)
+                    if not m:
+                        break
+                    echoes.append(scan_base + m.start())
+                    pos = m.end()
+                keep       = scan.rfind("\n", pos) + 1 or pos
+                scan_base += keep
+                scan       = scan[keep:]
+            # last prompt: only after the echo of the last command
+            if len(echoes) == len(echo_res) and buff.search(self.prompt_mark_re):
+                break
+        data   = buff.getvalue()
+        bounds = [0] + echoes + [len(data)]
+        buff.close()
+        cmdouts = []
+        for i in xrange(len(cmds)):
+            # segment: echo line, output, (last segment only) prompt line
+            lines = data[bounds[i]:bounds[i+1]].splitlines()
+            cmdouts.append("\r\n".join(lines[1:-1] if i == len(cmds) - 1 else lines[1:]))
+        if self.error_mark is not None:
+            for cmdout in cmdouts:
+                m = self.error_mark_re.search(cmdout)
+                if m:
+                    raise SwitchCommandException(m.group(1).strip())
+        return cmdouts
+
+    def _execute_stream(self, connection=None, cmd=None):
+        """
+        Generator: output lines of 'cmd' using 'connection' object.
+        Transports able to read it incrementally (see _execute_streamed()) override this
+        """
+        for line in self._execute(connection=connection, cmd=cmd).splitlines():
+            yield line
+
+    def _execute_streamed(self, connection=None, cmd=None):
+        """
+        Yield the output lines of 'cmd' as they arrive (without the echoed command and the prompt).
+        Only the current (incomplete) line is buffered. Requires _recvall_with_timeout() (stream transports)
+        """
+        L2Transport._execute(self, connection=connection, cmd=cmd)
+        context  = {"CTX-UUID": get_context_uid()}
+        echoed   = False
+        pending  = ""
+        cmd_err  = None
+        connection.send(self.crlf(cmd))
+        while True:
+            chunk = RecvBuffer()
+            try:
+                # bounded reads: a fast device must not fill the memory while lines are consumed
+                self._recvall_with_timeout(connection=connection, buff=chunk, max_bytes=65536)
+            except TransportTimeout, e:
+                self._logger.error("Incomplete data received: Stuck process or bad configured interactions -- context: %s. (transaction_timeout='%s'; recv_buffer='%s')" \
+                                     % (context, e.recv_timeout, e.recv_buff))
+                raise TransportTransactionException("Incomplete data received: Stuck process or bad configured interactions (transaction_timeout='%s')" % e.recv_timeout)
+            lines   = (pending + chunk.getvalue()).splitlines(True)
+            pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+            chunk.close()
+            for line in lines:
+                line = line.rstrip("\r\n")
+                if echoed is False:
+                    echoed = True
+                    continue
+                if cmd_err is not None:
+                    continue
+                if self.error_mark is not None:
+                    m = self.error_mark_re.search(line)
+                    if m:
+                        # drain the output (keeps the session usable), then raise
+                        cmd_err = m.group(1).strip()
+                        continue
+                yield line
+            if self.prompt_mark_re.search("\n%s" % pending):
+                break
+        if cmd_err is not None:
+            raise SwitchCommandException(cmd_err)
+
+    def execute_stream(self, cmd=None):
+        """ Execute a read-only command on remote host (no interactions), yielding its output
+            lines as they arrive. With stream transports (SysSSH, PySSH) memory use doesn't grow
+            with the output size. Stopping the iteration before the end closes the session
+            (the rest of the output would be left unread).
+
+            :cmd: The command to execute
+                - type: str.
+                - ex: "show mac-address-table"
+        """
+        if cmd is None:
+            return iter([])
+        if type(cmd) not in (str, unicode):
+            raise InvalidParameter("'cmd' parameter is invalid")
+        return self._iter_stream(cmd)
+
+    def _iter_stream(self, cmd):
+        breaker = self.circuit_breaker
+        if breaker is not None:
+            breaker.before_call()
+        completed = False
+        healthy   = False
+        failure   = None
+        try:
+            connection = self.connection
+            with self._command_metrics([cmd]):
+                for line in self._execute_stream(connection=connection, cmd=cmd):
+                    healthy = True
+                    yield line
+            completed = True
+            healthy   = True
+        except SwitchCommandException, e:
+            completed = True
+            healthy   = True
+            if self.close_on_switch_error is True:
+                self.close()
+            raise e
+        except TransportTransactionException, e:
+            completed = True
+            failure   = e
+            if self.close_on_transaction_error is True:
+                self.close()
+            raise e
+        except self.device_failures, e:
+            failure = e
+            raise e
+        finally:
+            if completed is False:
+                self.close()
+            if breaker is not None:
+                if failure is not None:
+                    breaker.record_failure(failure)
+                elif healthy is True:
+                    breaker.record_success()
+                else:
+                    breaker.release_probe()
+
+    @l2api_retry(times=2)
+    def execute_many(self, cmds=None):
+        """ Execute a batch of read-only commands on remote host (no interactions).
+            Pipelining transports (SysSSH, PySSH) send them in one go: one round trip for the batch.
+            Returns the outputs (same order as 'cmds'). SwitchCommandException is raised
+            if any command fails (after the whole batch is read).
+
+            :cmds: The commands to execute
+                - type: list of str.
+                - ex: ["show version", "show bootvar"]
+        """
+        if cmds is None:
+            return
+        if type(cmds) not in (list, tuple) or [c for c in cmds if type(c) not in (str, unicode)]:
+            raise InvalidParameter("'cmds' parameter is invalid")
+        if not cmds:
+            return []
+        try:
+            connection = self.connection
+            with self._command_metrics(cmds):
+                r = self._execute_many(connection=connection, cmds=list(cmds))
+        except SwitchCommandException, e:
+            if self.close_on_switch_error is True:
+                self.close()
+            raise e
+        except TransportTransactionException, e:
+            if self.close_on_transaction_error is True:
+                self.close()
+            raise e
+        return r
+
     @l2api_retry(times=2)
     def execute(self, cmd=None, interactions=None):
         """ Execute commands on remote host
@@ -227,7 +560,9 @@ class L2Transport(object):
         if interactions is not None and type(interactions) not in (list, tuple):
             raise InvalidParameter("'interactions' parameter is invalid")
         try:
-            r = self._execute(connection=self.connection, cmd=cmd, interactions=interactions)
+            connection = self.connection
+            with self._command_metrics([cmd]):
+                r = self._execute(connection=connection, cmd=cmd, interactions=interactions)
         except SwitchCommandException, e:
             if self.close_on_switch_error is True:
                 self.close()
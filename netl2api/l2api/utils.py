@@ -23,9 +23,10 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
 import re
+from collections import deque
 
 
-__all__ = ["LF", "CRLF", "cisco_like_runcfg_parser", "expand_vlan_ids", "expand_interface_ids", "expand_int_ranges"]
+__all__ = ["LF", "CRLF", "skip_lines", "cisco_like_runcfg_parser", "expand_vlan_ids", "expand_interface_ids", "expand_int_ranges"]
 
 
 LF   = lambda l: "%s\n" % l if not l.endswith("\n") else l
@@ -33,7 +34,6 @@ CRLF = lambda l: "%s\r\n" % l if not l.endswith("\r\n") else l
 
 
 RE_CISCOLIKE_IF_NAME_FMT          = re.compile(r"^([a-zA-Z\-\s]+)(\d+/)?([0-9\-,]+)$")
-RE_CISCOLIKE_CFG_COMMENT          = re.compile(r"^!")
 RE_CISCOLIKE_CFG_IF_NAME          = re.compile(r"^(?:interface\s(.+)|lag\s(.+)|vlan\s(.+))$")
 RE_CISCOLIKE_CFG_IF_DESC          = re.compile(r"^\s+description\s(.+)$")
 RE_CISCOLIKE_CFG_IP_ADDR          = re.compile(r"^\sip\saddress\s(.+)?$")
@@ -42,75 +42,98 @@ RE_CISCOLIKE_CFG_IF_SPEED         = re.compile(r"^\sspeed\s(.+)$")
 RE_CISCOLIKE_CFG_IF_DUPLEX        = re.compile(r"^\sduplex\s(.+)$")
 RE_CISCOLIKE_CFG_IF_VLAN_TAGGED   = re.compile(r"^\s(?:tagged|switchport\strunk\sallowed\svlan)\s(.+)$")
 RE_CISCOLIKE_CFG_IF_VLAN_UNTAGGED = re.compile(r"^\s(?:untagged|switchport\s(?:access|trunk\snative)\svlan)\s(.+)$")
+RE_CISCOLIKE_CFG_IF_SWITCHPORT    = re.compile(r"^\sswitchport\s(?:trunk\sallowed\svlan\s(.+)|(?:access|trunk\snative)\svlan\s(.+))$")
 RE_CISCOLIKE_CFG_IF_LAG           = re.compile(r"^\s(?:channel-group|\sport-channel)\s(.+)\smode")
 RE_CISCOLIKE_CFG_IF_LAG_PRIPORT   = re.compile(r"^\sprimary-port\s(.+)")
 RE_CISCOLIKE_CFG_IF_LAG_PORTS     = re.compile(r"^\sports\s(.+)")
 RE_CISCOLIKE_CFG_IF_ADM_STATE     = re.compile(r"^\s+((?:no\s)?shutdown|disable|enable)$")
 RE_CISCOLIKE_CFG_IF_INLINE_NAME   = re.compile(r"^([0-9]+)\sname(.+)$")
 
+def skip_lines(lines=None, head=0, tail=0):
+    """
+    Lines of an iterable (eg. L2Transport.execute_stream()) without the first 'head' and the last 'tail' ones
+    (like lines[head:-tail], but only 'tail' lines are held in memory)
+    """
+    held = deque()
+    for i, line in enumerate(lines):
+        if i < head:
+            continue
+        held.append(line)
+        if len(held) > tail:
+            yield held.popleft()
+
+
+def _runcfg_set_attr(attr):
+    def set_attr(if_attrs, m):
+        if_attrs[attr] = m.group(1).strip()
+    return set_attr
+
+
+def _runcfg_append_attr(attr):
+    def append_attr(if_attrs, m):
+        if not if_attrs.has_key(attr):
+            if_attrs[attr] = []
+        if_attrs[attr].append(m.group(1).strip())
+    return append_attr
+
+
+def _runcfg_switchport_vlan(if_attrs, m):
+    attr, vlan_ifs = ("vlan_tagged_ifs", m.group(1)) if m.group(1) is not None else ("vlan_untagged_ifs", m.group(2))
+    if not if_attrs.has_key(attr):
+        if_attrs[attr] = []
+    if_attrs[attr].append(vlan_ifs.strip())
+
+
+# first word of a running-config line => (the only regex tried on it, attribute setter);
+# None setter: interface/LAG/VLAN header
+RUNCFG_KEYWORDS = {
+    "interface":     (RE_CISCOLIKE_CFG_IF_NAME,          None),
+    "lag":           (RE_CISCOLIKE_CFG_IF_NAME,          None),
+    "vlan":          (RE_CISCOLIKE_CFG_IF_NAME,          None),
+    "description":   (RE_CISCOLIKE_CFG_IF_DESC,          _runcfg_set_attr("description")),
+    "ip":            (RE_CISCOLIKE_CFG_IP_ADDR,          _runcfg_append_attr("ip_addr")),
+    "mtu":           (RE_CISCOLIKE_CFG_IF_MTU,           _runcfg_set_attr("mtu")),
+    "speed":         (RE_CISCOLIKE_CFG_IF_SPEED,         _runcfg_set_attr("speed")),
+    "duplex":        (RE_CISCOLIKE_CFG_IF_DUPLEX,        _runcfg_set_attr("duplex")),
+    "tagged":        (RE_CISCOLIKE_CFG_IF_VLAN_TAGGED,   _runcfg_append_attr("vlan_tagged_ifs")),
+    "untagged":      (RE_CISCOLIKE_CFG_IF_VLAN_UNTAGGED, _runcfg_append_attr("vlan_untagged_ifs")),
+    "switchport":    (RE_CISCOLIKE_CFG_IF_SWITCHPORT,    _runcfg_switchport_vlan),
+    "channel-group": (RE_CISCOLIKE_CFG_IF_LAG,           _runcfg_set_attr("lag")),
+    "port-channel":  (RE_CISCOLIKE_CFG_IF_LAG,           _runcfg_set_attr("lag")),
+    "primary-port":  (RE_CISCOLIKE_CFG_IF_LAG_PRIPORT,   _runcfg_set_attr("lag_primary_port")),
+    "ports":         (RE_CISCOLIKE_CFG_IF_LAG_PORTS,     _runcfg_set_attr("lag_ports")),
+    "shutdown":      (RE_CISCOLIKE_CFG_IF_ADM_STATE,     _runcfg_set_attr("adm_state")),
+    "no":            (RE_CISCOLIKE_CFG_IF_ADM_STATE,     _runcfg_set_attr("adm_state")),
+    "disable":       (RE_CISCOLIKE_CFG_IF_ADM_STATE,     _runcfg_set_attr("adm_state")),
+    "enable":        (RE_CISCOLIKE_CFG_IF_ADM_STATE,     _runcfg_set_attr("adm_state")),
+}
+
+
 def cisco_like_runcfg_parser(rawruncfg=None):
+    """
+    'rawruncfg': running-config text or an iterable of its lines (eg. L2Transport.execute_stream())
+
+    Single pass: the first word of a line selects the only regex tried on it (RUNCFG_KEYWORDS);
+    lines of any other keyword ("!" comments included) are skipped without running a regex.
+    """
     currnt_if_name = None
     parsed_runcfg  = {}
-    for runcfg_ln in rawruncfg.splitlines():
-        if RE_CISCOLIKE_CFG_COMMENT.search(runcfg_ln):
-            continue
-        m = RE_CISCOLIKE_CFG_IF_NAME.search(runcfg_ln)
-        if m:
-            #currnt_if_name = m.group(1).strip()
-            currnt_if_name = m.group(1) or m.group(2) or m.group(3)
-            currnt_if_name = currnt_if_name.strip()
-            parsed_runcfg[currnt_if_name] = {}
-            continue
-        m = RE_CISCOLIKE_CFG_IF_DESC.search(runcfg_ln)
-        if m:
-            parsed_runcfg[currnt_if_name]["description"] = m.group(1).strip()
-            continue
-        m = RE_CISCOLIKE_CFG_IP_ADDR.search(runcfg_ln)
-        if m:
-            if not parsed_runcfg[currnt_if_name].has_key("ip_addr"):
-                parsed_runcfg[currnt_if_name]["ip_addr"] = []
-            parsed_runcfg[currnt_if_name]["ip_addr"].append(m.group(1).strip())
+    keywords       = RUNCFG_KEYWORDS
+    if isinstance(rawruncfg, basestring):
+        rawruncfg = rawruncfg.splitlines()
+    for runcfg_ln in rawruncfg:
+        words = runcfg_ln.split(None, 1)
+        if not words or not keywords.has_key(words[0]):
             continue
-        m = RE_CISCOLIKE_CFG_IF_MTU.search(runcfg_ln)
-        if m:
-            parsed_runcfg[currnt_if_name]["mtu"] = m.group(1).strip()
+        regex, set_attr = keywords[words[0]]
+        m = regex.match(runcfg_ln)
+        if m is None:
             continue
-        m = RE_CISCOLIKE_CFG_IF_SPEED.search(runcfg_ln)
-        if m:
-            parsed_runcfg[currnt_if_name]["speed"] = m.group(1).strip()
-            continue
-        m = RE_CISCOLIKE_CFG_IF_DUPLEX.search(runcfg_ln)
-        if m:
-            parsed_runcfg[currnt_if_name]["duplex"] = m.group(1).strip()
-            continue
-        m = RE_CISCOLIKE_CFG_IF_VLAN_TAGGED.search(runcfg_ln)
-        if m:
-            if not parsed_runcfg[currnt_if_name].has_key("vlan_tagged_ifs"):
-                parsed_runcfg[currnt_if_name]["vlan_tagged_ifs"] = []
-            parsed_runcfg[currnt_if_name]["vlan_tagged_ifs"].append(m.group(1).strip())
-            continue
-        m = RE_CISCOLIKE_CFG_IF_VLAN_UNTAGGED.search(runcfg_ln)
-        if m:
-            if not parsed_runcfg[currnt_if_name].has_key("vlan_untagged_ifs"):
-                parsed_runcfg[currnt_if_name]["vlan_untagged_ifs"] = []
-            parsed_runcfg[currnt_if_name]["vlan_untagged_ifs"].append(m.group(1).strip())
-            continue
-        m = RE_CISCOLIKE_CFG_IF_LAG.search(runcfg_ln)
-        if m:
-            parsed_runcfg[currnt_if_name]["lag"] = m.group(1).strip()
-            continue
-        m = RE_CISCOLIKE_CFG_IF_LAG_PRIPORT.search(runcfg_ln)
-        if m:
-            parsed_runcfg[currnt_if_name]["lag_primary_port"] = m.group(1).strip()
-            continue
-        m = RE_CISCOLIKE_CFG_IF_LAG_PORTS.search(runcfg_ln)
-        if m:
-            parsed_runcfg[currnt_if_name]["lag_ports"] = m.group(1).strip()
-            continue
-        m = RE_CISCOLIKE_CFG_IF_ADM_STATE.search(runcfg_ln)
-        if m:
-            parsed_runcfg[currnt_if_name]["adm_state"] = m.group(1).strip()
+        if set_attr is None:
+            currnt_if_name = m.group(m.lastindex).strip()
+            parsed_runcfg[currnt_if_name] = {}
             continue
+        set_attr(parsed_runcfg[currnt_if_name], m)
     return parsed_runcfg
 
 
@@ -25,13 +25,16 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 import os
 import sys
 import stat
+import time
 import redis
 import logging
+import threading
 import ConfigParser
 from logging.handlers import SysLogHandler
 
 
-__all__ = ["get_netl2server_cfg", "get_devices_cfg", "setup_netl2server_logger", "setup_persistence_ctrl_logger"]
+__all__ = ["get_netl2server_cfg", "get_devices_cfg", "get_cfg_opt", "setup_netl2server_logger",
+           "setup_persistence_ctrl_logger"]
 
 
 ENVVAR_CFGBASE  = "NETL2API_CFG_BASE"
@@ -75,24 +78,85 @@ def get_netl2server_cfg():
     return get_cfg("netl2server", check_permission=None)
 
 
+def get_cfg_opt(cfg, cfg_section, option, default=None, opt_type=str):
+    """ optional settings -- keep old config files working """
+    if not cfg.has_option(cfg_section, option):
+        return default
+    if opt_type is bool:
+        return cfg.get(cfg_section, option).lower() == "true"
+    return opt_type(cfg.get(cfg_section, option))
+
+
+_REDIS_CONN_ERRORS = (redis.exceptions.ConnectionError,) + \
+                        ((redis.exceptions.TimeoutError,) if hasattr(redis.exceptions, "TimeoutError") else ())
+
+
+class _PooledRedis(redis.Redis):
+    """
+    redis.Redis on a shared ConnectionPool. Connection errors are detected by the
+    commands themselves (no PING) and open a backoff window (see RedisClient).
+    """
+
+    def __init__(self, backoff_min=1, backoff_max=30, *args, **kwargs):
+        super(_PooledRedis, self).__init__(*args, **kwargs)
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self._failures   = 0
+        self._down_until = 0
+
+    def execute_command(self, *args, **options):
+        try:
+            r = super(_PooledRedis, self).execute_command(*args, **options)
+        except _REDIS_CONN_ERRORS:
+            self._failures  += 1
+            self._down_until = time.time() + min(self.backoff_min * 2 ** (self._failures - 1), self.backoff_max)
+            raise
+        if self._failures:
+            self._failures   = 0
+            self._down_until = 0
+        return r
+
+    @property
+    def available(self):
+        return self._down_until <= time.time()
+
+
+_redis_clients      = {}
+_redis_clients_lock = threading.Lock()
 class RedisClient(object):
-    # TODO: move-me to a more appropriate library file
+    """
+    Process-wide, thread-safe redis client (one ConnectionPool per host/port/db), shared
+    by the HTTP cache, the persistence control and the persistence worker.
+    get_connection() doesn't talk to redis-server: a broken connection is detected (and
+    replaced by the pool) on the next command. After a connection error, get_connection()
+    raises RedisUnavailable during an exponential backoff window (1s, 2s, 4s.. up to 30s),
+    so callers fall back quickly instead of waiting for socket timeouts on every request.
+    """
+
     def __init__(self, db=7, timeout=3):
         cfg       = get_netl2server_cfg()
         self.host = cfg.get("redis", "host")
         self.port = cfg.getint("redis", "port")
         self.timeout = timeout
         self.db      = db
-        self._redis  = redis.Redis(host=self.host, port=self.port, db=self.db,
-                                   socket_timeout=self.timeout)
+        client_key   = (self.host, self.port, self.db, self.timeout)
+        with _redis_clients_lock:
+            if not _redis_clients.has_key(client_key):
+                pool = redis.ConnectionPool(host=self.host, port=self.port, db=self.db,
+                                            socket_timeout=self.timeout)
+                _redis_clients[client_key] = _PooledRedis(connection_pool=pool)
+            self._redis = _redis_clients[client_key]
 
     def get_connection(self):
-        if self._redis is None or not self._redis.ping():
-            self._redis = redis.Redis(host=self.host, port=self.port, db=self.db,
-                                      socket_timeout=self.timeout)
+        if not self._redis.available:
+            raise RedisUnavailable("Redis server (%s:%s) is unavailable (backing off)" % (self.host, self.port))
         return self._redis
 
 
+class RedisUnavailable(Exception):
+    pass
+
+
 def get_devices_cfg():
     switches    = {}
     devices_cfg = get_cfg("devices", check_permission=600)
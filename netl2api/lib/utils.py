@@ -23,13 +23,17 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
 import re
+import time
 import threading
 from uuid import uuid4
-from collections import deque
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 from netl2api.lib import config
 
 
-__all__ = ["gen_context_uid", "get_context_uid", "get_sw_handler_class", "get_switch_instance"]
+__all__ = ["gen_context_uid", "get_context_uid", "set_context_uid", "get_sw_handler_class", "get_switch_instance",
+           "get_switch_pool", "switch_instance", "close_switch_pools", "get_device_address",
+           "get_device_circuit_breaker", "LRUCache"]
 
 
 _thr_local = threading.local()
@@ -45,6 +49,11 @@ def get_context_uid():
         return
 
 
+def set_context_uid(ctx_uid=None):
+    """ propagate a request context to worker threads """
+    _thr_local.l2api_ctx_uid = ctx_uid
+
+
 def get_sw_handler_class(sw_classname=None):
     sw_classname = sw_classname.split(".")
     sw_module = __import__(".".join(sw_classname[:-1]), fromlist=[sw_classname[-1:][0]])
@@ -62,9 +71,275 @@ def get_switch_instance(device):
     return swapi(host=switches[device]["mgmt-host"], port=int(switches[device]["mgmt-port"]),
                  username=switches[device]["mgmt-user"], passwd=switches[device]["mgmt-pass"])
 
+
+def get_device_address(device):
+    """
+    (host, port) of the 'device' management interface -- as used by its L2API transport
+    """
+    switches = config.get_devices_cfg()
+    if not switches.has_key(device):
+        raise DeviceNotFound("Switch not known/configured => '%s'" % device)
+    return switches[device]["mgmt-host"], int(switches[device]["mgmt-port"])
+
+
+def get_device_circuit_breaker(device):
+    """
+    Transport circuit breaker (health state) of 'device' -- None if disabled
+    """
+    # netl2api.l2api imports this module
+    from netl2api.l2api.transport.CircuitBreaker import get_circuit_breaker
+    host, port = get_device_address(device)
+    return get_circuit_breaker(host=host, port=port)
+
+
+class LRUCache(object):
+    """
+    Thread-safe, size-bounded LRU cache with per-entry TTL.
+
+        :max_entries: Max number of entries (least recently used are evicted first).
+            - type: int.
+            - ex: 1024
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries    = OrderedDict()
+        self._lock       = threading.Lock()
+
+    def get(self, key):
+        """ (value, expires_at) or None """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            if entry[1] <= time.time():
+                return
+            self._entries[key] = entry
+            return entry
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_matching(self, match):
+        """ delete every entry whose key satisfies match(key) """
+        with self._lock:
+            for key in [k for k in self._entries.iterkeys() if match(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SwitchSessionPool(object):
+    """
+    Warm (already authenticated) L2API instances of a single device.
+    Each instance owns its transport session, so at most 'max_sessions' SSH/Telnet
+    sessions are kept open against the device. An instance is used by one thread
+    at a time (checkout/checkin).
+
+        :device: Device id (see devices.cfg).
+            - type: str.
+
+        :max_sessions: Max number of L2API instances (sessions) for this device.
+            - type: int.
+
+        :idle_timeout: Sessions not used within this time (seconds) are closed by reap().
+            - type: int/float.
+
+        :checkout_timeout: Time (seconds) to wait for a free session before raising NoSwitchSessionsAvailable().
+            - type: int/float.
+    """
+
+    def __init__(self, device=None, max_sessions=2, idle_timeout=300, checkout_timeout=60):
+        self.device           = device
+        self.max_sessions     = max_sessions
+        self.idle_timeout     = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self._idle     = deque()  # (last_used, swinst)
+        self._sessions = 0
+        self._closed   = False
+        self._cond     = threading.Condition(threading.Lock())
+
+    def checkout(self):
+        deadline = time.time() + self.checkout_timeout
+        with self._cond:
+            while True:
+                while self._idle:
+                    last_used, swinst = self._idle.pop()
+                    if self._is_healthy(swinst, last_used):
+                        return swinst
+                    self._discard(swinst)
+                if self._sessions < self.max_sessions:
+                    self._sessions += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise NoSwitchSessionsAvailable("No free sessions for device '%s' (max_sessions='%s'; checkout_timeout='%s')" \
+                                                        % (self.device, self.max_sessions, self.checkout_timeout))
+                self._cond.wait(remaining)
+        # do not hold the lock while building the instance (ssh login happens lazily, but
+        # vendor classes may talk to the device on __init__ -- eg. Flex10)
+        try:
+            return get_switch_instance(self.device)
+        except Exception:
+            with self._cond:
+                self._sessions -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, swinst, discard=False):
+        with self._cond:
+            # checked out when the pool was closed (see close_switch_pools())
+            if discard is True or self._closed is True:
+                self._discard(swinst)
+            else:
+                self._idle.append((time.time(), swinst))
+            self._cond.notify()
+
+    def _is_healthy(self, swinst, last_used):
+        if (time.time() - last_used) > self.idle_timeout:
+            return False
+        connection = swinst.transport._connection
+        if connection is not None and getattr(connection, "closed", False) is True:
+            return False
+        return True
+
+    def _discard(self, swinst):
+        # self._cond must be held
+        self._sessions -= 1
+        try:
+            swinst.transport.close()
+        except Exception:
+            pass
+
+    def reap(self):
+        with self._cond:
+            alive = deque()
+            while self._idle:
+                last_used, swinst = self._idle.popleft()
+                if self._is_healthy(swinst, last_used):
+                    alive.append((last_used, swinst))
+                else:
+                    self._discard(swinst)
+            self._idle = alive
+            self._cond.notify_all()
+
+    def close(self):
+        """ Close the idle sessions; the checked out ones are closed on checkin() """
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop()[1])
+            self._cond.notify_all()
+
+
+_switch_pools      = {}
+_switch_pools_lock = threading.Lock()
+_switch_reaper     = None
+def get_switch_pool(device):
+    global _switch_reaper
+    try:
+        return _switch_pools[device]
+    except KeyError:
+        pass
+    cfg = config.get_netl2server_cfg()
+    with _switch_pools_lock:
+        if not _switch_pools.has_key(device):
+            _switch_pools[device] = SwitchSessionPool(device=device,
+                max_sessions=config.get_cfg_opt(cfg, "switch_pool", "max_sessions", 2, int),
+                idle_timeout=config.get_cfg_opt(cfg, "switch_pool", "idle_timeout", 300, float),
+                checkout_timeout=config.get_cfg_opt(cfg, "switch_pool", "checkout_timeout", 60, float))
+        if _switch_reaper is None:
+            _switch_reaper = threading.Thread(target=_reap_switch_pools, name="switch-pool-reaper",
+                                              args=(_switch_pools[device].idle_timeout,))
+            _switch_reaper.daemon = True
+            _switch_reaper.start()
+        return _switch_pools[device]
+
+
+def _reap_switch_pools(idle_timeout):
+    while True:
+        time.sleep(max(idle_timeout / 2.0, 1))
+        for pool in _switch_pools.values():
+            pool.reap()
+
+
+def close_switch_pools():
+    with _switch_pools_lock:
+        for pool in _switch_pools.values():
+            pool.close()
+        _switch_pools.clear()
+
+
+def _is_transport_error(e):
+    """
+    True if 'e' may have left the session out of sync with the device CLI (or dead).
+    Vendor/validation errors (eg. "No such VLAN") are raised at a CLI prompt: the session is reusable
+    """
+    # netl2api.l2api imports this module
+    from netl2api.l2api.exceptions import TransportTimeout, NoTransportConnectionsAvailable, \
+                                          SwitchAuthenticationException
+    from netl2api.l2api.transport.SystemSSH import SystemSSHException
+    from netl2api.l2api.transport.TelnetTransport import TelnetProtocolException
+    return isinstance(e, (TransportTimeout, NoTransportConnectionsAvailable, SwitchAuthenticationException,
+                          SystemSSHException, TelnetProtocolException, EnvironmentError, EOFError))
+
+
+@contextmanager
+def switch_instance(device):
+    """
+    Borrow an L2API instance of 'device' for the duration of the 'with' block.
+    Uses the process-wide session pool ([switch_pool] in netl2server.cfg) if enabled.
+
+    Usage:
+    >>> with switch_instance("swdelltest0001") as swinst:
+    ...     swinst.show_vlans()
+    """
+    if config.get_cfg_opt(config.get_netl2server_cfg(), "switch_pool", "enabled", False, bool) is False:
+        swinst = get_switch_instance(device)
+        try:
+            yield swinst
+        finally:
+            swinst.transport.close()
+        return
+    pool   = get_switch_pool(device)
+    swinst = pool.checkout()
+    if swinst.shared_cache is False:
+        # per-request semantics for the per-instance autocache: another pooled session
+        # may have changed the device since this instance was last used
+        # (a shared autocache backend is cleared by the mutators of any instance)
+        swinst.clear_cache()
+    try:
+        yield swinst
+    except Exception, e:
+        # a transport error may leave the CLI session in an unknown state (eg. config mode)
+        pool.checkin(swinst, discard=_is_transport_error(e))
+        raise
+    except:
+        # GeneratorExit/KeyboardInterrupt: an unfinished command may be left running
+        pool.checkin(swinst, discard=True)
+        raise
+    pool.checkin(swinst)
+
+
 class MisconfiguredDevice(Exception):
     pass
 
 class DeviceNotFound(Exception):
     pass
 
+class NoSwitchSessionsAvailable(Exception):
+    pass
+
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+import re
+import time
+import threading
+from Queue import Queue, Empty
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from netl2api.lib.utils import switch_instance, get_context_uid, set_context_uid, DeviceNotFound
+from netl2api.lib.config import get_netl2server_cfg, setup_netl2server_logger, get_devices_cfg, get_cfg_opt
+
+
+__all__ = ["FLEET_OPERATIONS", "select_devices", "fleet_run"]
+
+
+cfg    = get_netl2server_cfg()
+logger = setup_netl2server_logger(cfg)
+
+
+# fleet operation => (L2API method, optional query-string parameter passed to it)
+FLEET_OPERATIONS = {
+    "vlans":      ("show_vlans",      "vlan_id"),
+    "interfaces": ("show_interfaces", "interface_id"),
+    "uplinks":    ("show_uplinks",    None),
+    "arp":        ("show_arp",        "interface_id"),
+}
+
+
+_fleet_pool      = None
+_fleet_pool_lock = threading.Lock()
+def _get_fleet_pool():
+    global _fleet_pool
+    with _fleet_pool_lock:
+        if _fleet_pool is None:
+            _fleet_pool = ThreadPool(processes=get_cfg_opt(cfg, "fleet", "workers", 16, int))
+    return _fleet_pool
+
+
+def select_devices(devices=None, selector=None):
+    """
+    Devices (devices.cfg) targeted by a fleet operation.
+
+        :devices: Comma-separated device ids.
+            - type: str.
+            - ex: "swdelltest0001,bladehptest0001"
+
+        :selector: REGEXP matched against the device id (all devices if both are None).
+            - type: str.
+            - ex: "^swdell"
+    """
+    known_devices = get_devices_cfg().keys()
+    if devices:
+        selected = [d.strip() for d in devices.split(",") if d.strip()]
+        unknown  = [d for d in selected if d not in known_devices]
+        if unknown:
+            raise DeviceNotFound("Switch not known/configured => '%s'" % "', '".join(unknown))
+    else:
+        selected = known_devices
+    if selector:
+        selector_re = re.compile(selector)
+        selected    = [d for d in selected if selector_re.search(d)]
+    return sorted(set(selected))
+
+
+@contextmanager
+def _bounded_transaction_timeout(transport, deadline):
+    """
+    Lower the transport 'transaction_timeout' (each command/interaction) to the time left until
+    'deadline' while the block runs: a device hanging past the fleet deadline releases the worker
+    (and its session) instead of holding them for the full transaction_timeout
+    """
+    if not hasattr(transport, "transaction_timeout"):
+        # TransportPool: its sessions keep their own timeout
+        yield
+        return
+    saved     = transport.transaction_timeout
+    remaining = max(deadline - time.time(), 0.1)
+    transport.transaction_timeout = remaining if saved is None else min(saved, remaining)
+    try:
+        yield
+    finally:
+        transport.transaction_timeout = saved
+
+
+def _run_device(results, cancelled, deadline, device, method, kwargs, context_uid):
+    # timed out (or request gone) while queued: already reported, don't hold the worker
+    if cancelled.is_set() or time.time() >= deadline:
+        return
+    set_context_uid(context_uid)
+    try:
+        with switch_instance(device) as swinst:
+            with _bounded_transaction_timeout(swinst.transport, deadline):
+                r = getattr(swinst, method)(**kwargs)
+    except Exception, e:
+        logger.exception("Fleet operation '%s' failed on device '%s' -- context: %s" % (method, device, {"CTX-UUID": context_uid}))
+        results.put((device, None, e))
+    else:
+        results.put((device, r, None))
+
+
+def fleet_run(devices=None, operation=None, kwargs=None, device_timeout=None, timeout=None):
+    """
+    Run 'operation' (see FLEET_OPERATIONS) concurrently on 'devices' (bounded by the [fleet] workers pool).
+    Generator: yields (device, result, exception) as each device finishes.
+    Deadlines are counted from submission (queue wait included): a device not replying within
+    'device_timeout' seconds is reported (and logged) with a FleetDeviceTimeout exception and its
+    late result is discarded. 'timeout' (at most [fleet] timeout) caps the whole run, whatever
+    'device_timeout' the caller asks for.
+    Jobs still queued at that point (or when the generator is closed) are skipped by the workers;
+    running ones wait for the device at most until the deadline per command (transaction_timeout),
+    then fail and release their worker and session (discarded from the [switch_pool]).
+    Logins/connections keep the transport timeouts: up to [fleet] workers devices may still hang there.
+    Failures are logged here (with traceback) -- callers shouldn't log them again.
+    """
+    method, param = FLEET_OPERATIONS[operation]
+    if device_timeout is None:
+        device_timeout = get_cfg_opt(cfg, "fleet", "device_timeout", 60, float)
+    max_timeout = get_cfg_opt(cfg, "fleet", "timeout", 300, float)
+    timeout     = max_timeout if timeout is None else min(timeout, max_timeout)
+    kwargs      = kwargs or {}
+    pool        = _get_fleet_pool()
+    results     = Queue()
+    cancelled   = threading.Event()
+    context_uid = get_context_uid()
+    deadline    = time.time() + min(device_timeout, timeout)
+    pending     = set(devices)
+    for device in devices:
+        pool.apply_async(_run_device, (results, cancelled, deadline, device, method, kwargs, context_uid))
+    try:
+        while pending:
+            wait = deadline - time.time()
+            if wait <= 0:
+                cancelled.set()
+                for device in sorted(pending):
+                    logger.error("Fleet operation '%s' timed out on device '%s' (%s seconds) -- context: %s" \
+                                    % (method, device, min(device_timeout, timeout), {"CTX-UUID": context_uid}))
+                    yield (device, None, FleetDeviceTimeout("Device did not reply within %s seconds" % min(device_timeout, timeout)))
+                break
+            try:
+                device, r, e = results.get(timeout=min(wait, 1))
+            except Empty:
+                continue
+            if device in pending:
+                pending.discard(device)
+                yield (device, r, e)
+    finally:
+        cancelled.set()
+
+
+class FleetDeviceTimeout(Exception):
+    pass
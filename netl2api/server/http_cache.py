@@ -22,12 +22,20 @@
 __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
+import sys
+import time
 import redis
+import threading
 from hashlib import sha1
 from functools import wraps
+from multiprocessing.pool import ThreadPool
 from bottle import request, response
-from netl2api.server.utils import RedisClient
-from netl2api.lib.config import get_netl2server_cfg, setup_netl2server_logger
+from netl2api.lib.utils import LRUCache, get_device_address, DeviceNotFound
+from netl2api.l2api.exceptions import TransportCircuitOpen
+from netl2api.l2api.transport import L2Transport
+from netl2api.l2api.transport.SysSSHTransport import SysSSH
+from netl2api.l2api.autocache import stale_served, clear_local_autocache
+from netl2api.lib.config import RedisClient, get_netl2server_cfg, get_cfg_opt, setup_netl2server_logger
 
 try:
     from cPickle import dumps, loads
@@ -35,7 +43,7 @@ except ImportError:
     from pickle import dumps, loads
 
 
-__all__ = ["cached", "invalidate_cache"]
+__all__ = ["cached", "invalidate_cache", "start_invalidation_listener"]
 
 
 cfg          = get_netl2server_cfg()
@@ -43,6 +51,21 @@ logger       = setup_netl2server_logger(cfg)
 cache_enable = cfg.get("cache", "enabled") == "true"
 redis_cli    = RedisClient()
 
+# in-process tier (in front of redis), kept coherent by redis pub/sub messages (see invalidate_cache())
+local_cache_enable  = get_cfg_opt(cfg, "cache", "local_enabled", True, bool)
+local_cache         = LRUCache(max_entries=get_cfg_opt(cfg, "cache", "local_max_entries", 1024, int))
+INVALIDATION_CHANNEL = "cache-invalidation"
+# max seconds a cache miss waits for an identical in-flight request (single-flight)
+coalesce_timeout    = get_cfg_opt(cfg, "cache", "coalesce_timeout", 120, float)
+# seconds past the ttl an entry is still served (see cached()); redis keeps entries for ttl + stale_max
+stale_while_revalidate = get_cfg_opt(cfg, "cache", "stale_while_revalidate", 0, int)
+stale_if_error         = get_cfg_opt(cfg, "cache", "stale_if_error", 0, int)
+stale_max              = max(stale_while_revalidate, stale_if_error)
+refresh_workers        = get_cfg_opt(cfg, "cache", "refresh_workers", 4, int)
+# errors meaning "the switch is unavailable" (see L2APIAutoCache._cache_stale_if_error()): only
+# those are answered with a stale entry; a validation or programming error is raised as is
+device_failures        = (TransportCircuitOpen,) + L2Transport.device_failures + SysSSH.device_failures
+
 
 def cached(ttl=600):
     def proxy(f):
@@ -50,40 +73,394 @@ def cached(ttl=600):
         def caching(*args, **kwargs):
             if cache_enable is False:
                 return f(*args, **kwargs)
-            try:
-                cache_db = redis_cli.get_connection()
-            except Exception, e:
-                logger.exception("Error in redis_cli connection (cache database)")
-                return f(*args, **kwargs)
             cache_key     = "%s:%s" % (request.environ.get("REQUEST_METHOD"), request.environ.get("PATH_INFO"))
             cache_subkey  = ";".join(["%s=%s" % (k,v) for k,v in request.query.iteritems() \
                                         if k != "ticket"])
             cache_subkey += ";".join(["%s=%s" % (k,v) for k,v in request.forms.iteritems() \
                                         if k != "ticket"])
             cache_rkey    = "cache:%s:%s" % (cache_key, sha1(cache_subkey).hexdigest())
-            cached_r      = cache_db.get(cache_rkey)
-            if cached_r is not None:
-                logger.info("Cache HIT -- context: %s" % request["context"])
+            local_entry   = local_cache_get(cache_rkey)
+            if local_entry is not None:
+                logger.info("Cache HIT (local) -- context: %s" % request["context"])
                 response.set_header("X-Cached", "True")
-                response.set_header("Cache-Control", "max-age=%s, must-revalidate" % int(cache_db.ttl(cache_rkey) or 0))
+                response.set_header("Cache-Control", "max-age=%s, must-revalidate" % int(local_entry[1] - time.time()))
+                return local_entry[0]
+            local_generation = _invalidation_listener.generation
+            try:
+                cache_db = redis_cli.get_connection()
+            except Exception, e:
+                logger.exception("Error in redis_cli connection (cache database)")
+                return f(*args, **kwargs)
+            try:
+                cached_r, cached_ttl = cache_get(cache_db, cache_rkey)
+            except redis.exceptions.RedisError, e:
+                # connection errors are detected here (no PING on get_connection())
+                logger.exception("Error in redis_cli connection (cache database)")
+                return f(*args, **kwargs)
+            call = lambda: f(*args, **kwargs)
+            path = request.environ.get("PATH_INFO")
+            if cached_r is not None:
+                stale_age = cache_stale_age(cached_ttl)
+                if stale_age is None:
+                    logger.info("Cache HIT -- context: %s" % request["context"])
+                    response.set_header("X-Cached", "True")
+                    response.set_header("Cache-Control", "max-age=%s, must-revalidate" % int(cached_ttl - stale_max))
+                    r = loads(cached_r)
+                    local_cache_set(cache_rkey, r, cached_ttl - stale_max, local_generation)
+                    return r
+                if stale_age <= stale_while_revalidate:
+                    logger.info("Cache HIT (stale, revalidating) -- context: %s" % request["context"])
+                    schedule_cache_refresh(cache_rkey, path, ttl, call, request.environ.copy())
+                    set_stale_headers(stale_age, "110 - \"Response is Stale\"")
+                    return loads(cached_r)
+            try:
+                r, leader, stale_age = coalesced_cache_fill(cache_db, cache_rkey, path, ttl, call, local_generation)
+            except device_failures, e:
+                if cached_r is None:
+                    raise
+                # stale-if-error
+                stale_age = cache_stale_age(cached_ttl)
+                logger.warn("Cache HIT (stale, revalidation failed: %s(%s)) -- context: %s" \
+                                % (e.__class__.__name__, e, request["context"]))
+                set_stale_headers(stale_age, "111 - \"Revalidation Failed\"")
                 return loads(cached_r)
-            #logger.debug("Cache MISS (calling %s()) -- context %s" % (f_name, context))
-            r = f(*args, **kwargs)
-            response.set_header("X-Cached", "False")
+            if stale_age is not None:
+                # the switch is unavailable and the L2API returned stale data (see L2APIAutoCache)
+                set_stale_headers(stale_age, "111 - \"Revalidation Failed\"")
+                return r
+            if leader is False:
+                logger.info("Cache MISS coalesced with an in-flight request -- context: %s" % request["context"])
+            response.set_header("X-Cached", "False" if leader else "True")
             response.set_header("Cache-Control", "max-age=%s, must-revalidate" % ttl)
-            cache_db.setex(cache_rkey, dumps(r), ttl)
             return r
         return caching
     return proxy
 
 
+def cache_get(cache_db, cache_rkey):
+    """
+    (pickled entry or None, remaining redis TTL)
+    """
+    pipe = cache_db.pipeline(transaction=False)
+    pipe.get(cache_rkey)
+    pipe.ttl(cache_rkey)
+    cached_r, cached_ttl = pipe.execute()
+    return cached_r, cached_ttl
+
+
+def cache_stale_age(cached_ttl):
+    """
+    Seconds an entry with a remaining redis TTL of 'cached_ttl' is past its ttl (None: fresh)
+    """
+    if stale_max <= 0 or cached_ttl is None or cached_ttl < 0 or cached_ttl > stale_max:
+        return None
+    return stale_max - cached_ttl
+
+
+def set_stale_headers(stale_age, warning):
+    response.set_header("X-Cached", "True")
+    response.set_header("X-Cache-Stale", str(int(stale_age)))
+    response.set_header("Warning", warning)
+    response.set_header("Cache-Control", "max-age=0, must-revalidate")
+
+
+_refresh_pool      = None
+_refreshing        = set()
+_refresh_pool_lock = threading.Lock()
+def schedule_cache_refresh(cache_rkey, path, ttl, call, environ):
+    """
+    Stale-while-revalidate: refill 'cache_rkey' in the background (refresh_workers pool).
+    'call' runs with a copy of the request 'environ' bound to the worker thread.
+    """
+    global _refresh_pool
+    with _refresh_pool_lock:
+        if cache_rkey in _refreshing:
+            return
+        _refreshing.add(cache_rkey)
+        if _refresh_pool is None:
+            _refresh_pool = ThreadPool(processes=refresh_workers)
+    try:
+        _refresh_pool.apply_async(_cache_refresh, (cache_rkey, path, ttl, call, environ))
+    except Exception:
+        with _refresh_pool_lock:
+            _refreshing.discard(cache_rkey)
+        raise
+
+
+def _cache_refresh(cache_rkey, path, ttl, call, environ):
+    try:
+        request.bind(environ)
+        response.bind()
+        local_generation = _invalidation_listener.generation
+        r, leader, stale_age = coalesced_cache_fill(redis_cli.get_connection(), cache_rkey, path, ttl, call, local_generation)
+        if leader is True and stale_age is None:
+            logger.info("Cache refreshed in background -- context: %s" % environ.get("context"))
+    except Exception, e:
+        logger.warn("Background cache refresh failed (stale entry kept): %s(%s) -- context: %s" \
+                        % (e.__class__.__name__, e, environ.get("context")))
+    finally:
+        with _refresh_pool_lock:
+            _refreshing.discard(cache_rkey)
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done     = threading.Event()
+        self.result   = None
+        self.exc_info = None
+
+
+_flights      = {}
+_flights_lock = threading.Lock()
+def coalesced_cache_fill(cache_db, cache_rkey, path, ttl, call, local_generation):
+    """
+    Single-flight cache fill: concurrent misses of the same 'cache_rkey' run 'call' (switch operation) only once.
+    Within a process, followers wait for the leader thread (and get its result/exception); across processes,
+    the leader holds a short redis lock and followers poll for the cached result (see _cache_fill()).
+    Returns (result, leader, stale_age) -- stale_age: see _call_switch().
+    """
+    with _flights_lock:
+        flight = _flights.get(cache_rkey)
+        leader = flight is None
+        if leader is True:
+            flight = _flights[cache_rkey] = _Flight()
+    if leader is False:
+        if flight.done.wait(coalesce_timeout) is True:
+            if flight.exc_info is not None:
+                raise flight.exc_info[1]
+            return flight.result[0], False, flight.result[1]
+        # leader is stuck -- don't wait forever
+        return _cache_fill(cache_db, cache_rkey, path, ttl, call, local_generation)
+    try:
+        r, leader, stale_age = _cache_fill(cache_db, cache_rkey, path, ttl, call, local_generation)
+        flight.result = (r, stale_age)
+        return r, leader, stale_age
+    except Exception:
+        flight.exc_info = sys.exc_info()
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(cache_rkey, None)
+        flight.done.set()
+
+
+def _call_switch(call):
+    """
+    (result, stale_age) -- stale_age: None, or how old (past its ttl) is the oldest stale-if-error
+    response the L2API returned (see L2APIAutoCache); such results are not cached
+    """
+    stale_served(reset=True)
+    r = call()
+    return r, stale_served(reset=True)
+
+
+def _cache_get_fresh(cache_db, cache_rkey):
+    cached_r, cached_ttl = cache_get(cache_db, cache_rkey)
+    if cached_r is None or cache_stale_age(cached_ttl) is not None:
+        return
+    return cached_r
+
+
+def _cache_fill(cache_db, cache_rkey, path, ttl, call, local_generation):
+    lock     = cache_db.lock("flight:%s" % cache_rkey, timeout=coalesce_timeout)
+    deadline = time.time() + coalesce_timeout
+    acquired = None
+    try:
+        while True:
+            acquired = lock.acquire(blocking=False)
+            if acquired is True:
+                # the previous leader may have just filled the cache
+                cached_r = _cache_get_fresh(cache_db, cache_rkey)
+                if cached_r is not None:
+                    return loads(cached_r), False, None
+                break
+            # another netl2server process is calling the switch
+            if time.time() >= deadline:
+                break
+            time.sleep(0.1)
+            cached_r = _cache_get_fresh(cache_db, cache_rkey)
+            if cached_r is not None:
+                return loads(cached_r), False, None
+    except redis.exceptions.RedisError, e:
+        logger.exception("Error in redis_cli connection (cache database)")
+    try:
+        r, stale_age = _call_switch(call)
+        if stale_age is not None:
+            return r, True, stale_age
+        try:
+            # kept past its ttl for stale-while-revalidate/stale-if-error (see cache_stale_age())
+            cache_db.setex(cache_rkey, dumps(r), ttl + stale_max)
+            tag_cache_entry(cache_db, cache_rkey, path, ttl + stale_max)
+        except redis.exceptions.RedisError, e:
+            logger.exception("Error in redis_cli connection (cache database)")
+        else:
+            local_cache_set(cache_rkey, r, ttl, local_generation)
+        return r, True, None
+    finally:
+        if acquired is True:
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+
+class CacheInvalidationListener(threading.Thread):
+    """
+    Subscribes INVALIDATION_CHANNEL and drops the invalidated entries from local_cache and
+    the device entries of the local L2API autocache (see netl2api.l2api.autocache.clear_local_autocache()).
+    The local tier is only used while subscribed: it's cleared on (re)subscription and on
+    any error, so an invalidation message can never be missed while serving local entries.
+    'generation' changes on every invalidation: entries read from redis before an
+    invalidation are not stored in the local tier after it.
+    """
+
+    def __init__(self):
+        super(CacheInvalidationListener, self).__init__(name="cache-invalidation-listener")
+        self.daemon     = True
+        self.subscribed = False
+        self.generation = 0
+        self._started   = False
+        self._lock      = threading.Lock()
+
+    def ensure_started(self):
+        if self._started is False:
+            with self._lock:
+                if self._started is False:
+                    self._started = True
+                    self.start()
+
+    def run(self):
+        backoff = 1
+        while True:
+            try:
+                pubsub = redis_cli.get_connection().pubsub()
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                while True:
+                    msg = pubsub.get_message(timeout=1)
+                    if msg is None:
+                        continue
+                    if msg["type"] == "subscribe":
+                        self.invalidate_all()
+                        self.subscribed = True
+                        backoff         = 1
+                    elif msg["type"] == "message":
+                        self.invalidate(msg["data"])
+            except Exception, e:
+                self.subscribed = False
+                self.invalidate_all()
+                logger.warn("Cache invalidation channel is down (local cache tier disabled): %s" % e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def invalidate(self, key):
+        self.generation += 1
+        key = "/%s" % key.strip("/")
+        local_cache.delete_matching(lambda rkey: _path_under(_cache_rkey_path(rkey), key))
+        # "/<resource>/<device>[/...]"
+        segments = key.strip("/").split("/")
+        try:
+            device = "%s:%s" % get_device_address(segments[1])
+        except (IndexError, DeviceNotFound):
+            device = None
+        clear_local_autocache(device)
+
+    def invalidate_all(self):
+        self.generation += 1
+        local_cache.clear()
+        clear_local_autocache()
+
+
+_invalidation_listener = CacheInvalidationListener()
+
+
+def start_invalidation_listener():
+    """
+    Needed without the local tier too: changes made through other processes are announced
+    in INVALIDATION_CHANNEL (see "local" and "local+redis" autocache backends)
+    """
+    _invalidation_listener.ensure_started()
+
+
+def _cache_rkey_path(cache_rkey):
+    # "cache:<METHOD>:<PATH>:<sha1>" => "<PATH>"
+    return cache_rkey.split(":", 2)[2].rsplit(":", 1)[0]
+
+
+def _path_under(path, key):
+    return path == key or path.startswith("%s/" % key)
+
+
+def local_cache_get(cache_rkey):
+    if local_cache_enable is False:
+        return
+    _invalidation_listener.ensure_started()
+    if _invalidation_listener.subscribed is False:
+        return
+    return local_cache.get(cache_rkey)
+
+
+def local_cache_set(cache_rkey, r, ttl, generation):
+    if local_cache_enable is False or _invalidation_listener.subscribed is False:
+        return
+    if generation != _invalidation_listener.generation:
+        return
+    local_cache.set(cache_rkey, r, ttl)
+
+
+def cache_tag(path=None):
+    """
+    Tag of a cached path: its '/<resource>/<device>' prefix -- the granularity of invalidate_cache().
+    Ex.: "/vlans/swdelltest0001/10" => "/vlans/swdelltest0001"; "/devices" => "/devices"
+    """
+    return "/%s" % "/".join(path.strip("/").split("/")[:2])
+
+
+# SADD + EXPIRE only extending the set TTL (no EXPIRE GT before redis 7): atomic, one round trip
+TAG_CACHE_ENTRY_LUA = """
+redis.call("SADD", KEYS[1], ARGV[1])
+if redis.call("TTL", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+"""
+
+
+def tag_cache_entry(cache_db, cache_rkey, path, ttl):
+    """
+    Register 'cache_rkey' in the 'cache-tag:<tag>' set of 'path' (see invalidate_cache()).
+    The tag set lives as long as its longest-lived entry.
+    """
+    tag = "cache-tag:%s" % cache_tag(path)
+    cache_db.register_script(TAG_CACHE_ENTRY_LUA)(keys=[tag], args=[cache_rkey, int(ttl)])
+
+
 def invalidate_cache(key=None):
+    """
+    Remove cached entries tagged with 'key' -- ie. all paths equal to or under a
+    '/<resource>/<device>' key (ex: "/vlans/swdelltest0001"; a deeper key invalidates
+    its whole device, see cache_tag()). Doesn't scan the keyspace (no KEYS).
+    The local tier of this process is invalidated synchronously (read-your-writes);
+    the other processes are notified through INVALIDATION_CHANNEL.
+    """
+    _invalidation_listener.invalidate(key)
     try:
         cache_db = redis_cli.get_connection()
     except Exception, e:
         logger.exception("Error in redis_cli connection (cache database)")
         return
+    tag = "cache-tag:%s" % cache_tag(key)
     try:
-        cache_db.delete(*cache_db.keys("cache:*:%s*" % key))
+        # SMEMBERS + DEL in one MULTI/EXEC: an entry tagged meanwhile lands in a new tag set
+        # (invalidated next time) instead of being dropped from the index while still cached
+        pipe = cache_db.pipeline(transaction=True)
+        pipe.smembers(tag)
+        pipe.delete(tag)
+        cache_rkeys = pipe.execute()[0]
+        pipe = cache_db.pipeline(transaction=False)
+        if cache_rkeys:
+            pipe.delete(*cache_rkeys)
+        pipe.publish(INVALIDATION_CHANNEL, key)
+        pipe.execute()
     except redis.exceptions.ResponseError:
         pass
+    except redis.exceptions.RedisError, e:
+        logger.exception("Error in redis_cli connection (cache database)")
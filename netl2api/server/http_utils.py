@@ -34,7 +34,7 @@ except ImportError:
     from json import dumps
 
 
-__all__ = ["reply_json", "context", "validate_input"]
+__all__ = ["reply_json", "stream_json", "iter_json", "context", "validate_input"]
 
 
 cfg    = get_netl2server_cfg()
@@ -52,6 +52,62 @@ def reply_json(f):
     return json_dumps
 
 
+def iter_json(obj, chunk_size=16384):
+    """
+    Incremental dumps(obj): yields the JSON document in ~'chunk_size' pieces (same output as dumps()).
+    Only the top-level dict/list is walked here -- each item is still serialized by dumps() (C speedups) --
+    so the peak memory is bounded by the largest item instead of the whole document.
+
+        :obj: Object to be serialized.
+            - type: dict, list or tuple (any other type is dumps()'ed at once).
+            - ex: {"00:11:22:33:44:55": {...}, ...}
+
+        :chunk_size: Minimum size of each yielded piece.
+            - type: int.
+            - ex: 16384
+    """
+    if type(obj) is dict:
+        items = ("%s: %s" % (dumps(k if isinstance(k, basestring) else dumps(k)), dumps(v)) \
+                    for k, v in obj.iteritems())
+        start, end = "{", "}"
+    elif type(obj) in (list, tuple):
+        items = (dumps(v) for v in obj)
+        start, end = "[", "]"
+    else:
+        yield dumps(obj)
+        return
+    buff = [start]
+    size = 1
+    sep  = ""
+    for item in items:
+        buff.append(sep)
+        buff.append(item)
+        size += len(item) + len(sep)
+        sep   = ", "
+        if size >= chunk_size:
+            yield "".join(buff)
+            buff = []
+            size = 0
+    buff.append(end)
+    yield "".join(buff)
+
+
+def stream_json(f):
+    """
+    Like @reply_json, but the response body is produced by iter_json() -- sent with
+    'Transfer-Encoding: chunked' by the PasteServerAdapter (see httpd.py). Use it on
+    endpoints that may return huge documents (MAC tables, interfaces of chassis switches, etc).
+    """
+    @wraps(f)
+    def json_stream(*args, **kwargs):
+        r = f(*args, **kwargs)
+        if r and type(r) in (dict, list, tuple, str, unicode):
+            response.content_type = "application/json; charset=UTF-8"
+            return iter_json(r)
+        return r
+    return json_stream
+
+
 def context(f):
     @wraps(f)
     def inject_ctx(*args, **kwargs):
@@ -26,14 +26,30 @@ import re
 import os
 import sys
 import pwd
+import math
+import socket
 from multiprocessing import Process
 from bottle import ServerAdapter, debug, run, route, get, put, delete, error, request, response, abort
-from netl2api.server.http_cache import cached, invalidate_cache
-from netl2api.server.http_utils import reply_json, validate_input, context
+
+try:
+    from simplejson import dumps
+except ImportError:
+    from json import dumps
+from netl2api.server.http_cache import cached, invalidate_cache, start_invalidation_listener
+from netl2api.server.http_utils import reply_json, stream_json, iter_json, validate_input, context
+from netl2api.server.fleet import FLEET_OPERATIONS, select_devices, fleet_run
 from netl2api.server.workers import switch_cfg_persistence
 from netl2api.server.workers.switch_cfg_persistence_utils import defer_save_switch_cfg
-from netl2api.lib.utils import get_switch_instance
-from netl2api.lib.config import get_netl2server_cfg, setup_netl2server_logger, get_devices_cfg
+from netl2api.lib.utils import switch_instance, close_switch_pools, get_device_circuit_breaker, DeviceNotFound
+from netl2api.lib.config import get_netl2server_cfg, setup_netl2server_logger, get_devices_cfg, get_cfg_opt, RedisClient
+from netl2api.l2api.transport.SystemSSH import enable_control_master, close_control_masters
+from netl2api.l2api.transport.SpawnHelper import start_spawn_helper, stop_spawn_helper
+from netl2api.l2api.transport.CircuitBreaker import configure_circuit_breakers
+from netl2api.l2api.transport.TransportMetrics import render_prometheus
+from netl2api.l2api.exceptions import TransportCircuitOpen
+from netl2api.l2api.autocache import configure_autocache_backend, configure_autocache_write_through, \
+                                     configure_autocache_stale_if_error, has_local_autocache
+from netl2api.l2api.inventory import configure_interface_inventory
 
 cfg          = get_netl2server_cfg()
 logger       = setup_netl2server_logger(cfg)
@@ -80,14 +96,14 @@ def device_info(device=None):
     #logger.info("Showing generic information for device %s -- context: %s" %\
     #                (device, request["context"]))
     swinfo = {}
-    swinst = get_switch_instance(device)
-    swinfo["hostname"] = swinst.show_hostname()
-    swinfo["version"]  = swinst.show_version()
-    swinfo["l2api"]    = { "device.mgmt-api":  "%s.%s" % (swinst.__class__.__module__,
-                                                          swinst.__class__.__name__),
-                           "device.mgmt-host": swinst.transport.host,
-                           "device.vendor":    swinst.__VENDOR__,
-                           "device.hwtype":    swinst.__HWTYPE__ }
+    with switch_instance(device) as swinst:
+        swinfo["hostname"] = swinst.show_hostname()
+        swinfo["version"]  = swinst.show_version()
+        swinfo["l2api"]    = { "device.mgmt-api":  "%s.%s" % (swinst.__class__.__module__,
+                                                              swinst.__class__.__name__),
+                               "device.mgmt-host": swinst.transport.host,
+                               "device.vendor":    swinst.__VENDOR__,
+                               "device.hwtype":    swinst.__HWTYPE__ }
     return swinfo
 
 
@@ -99,9 +115,9 @@ def device_info(device=None):
 def show_version(device=None):
     #logger.info("Showing version information from device '%s' -- context: %s" %\
     #                 (device, request["context"]))
-    swinst = get_switch_instance(device)
     defer_save_switch_cfg(device)
-    return swinst.show_version()
+    with switch_instance(device) as swinst:
+        return swinst.show_version()
 
 
 @get("/system/<device>")
@@ -112,8 +128,8 @@ def show_version(device=None):
 def show_system(device=None):
     #logger.info("Showing system information from device '%s' -- context: %s" %\
     #                 (device, request["context"]))
-    swinst = get_switch_instance(device)
-    return swinst.show_system()
+    with switch_instance(device) as swinst:
+        return swinst.show_system()
 
 
 RE_ROUTE_INTERFACE_ACTIONS = re.compile(r"^(.+)/((?:at|de)tach_vlan|change_description|(?:dis|en)able)$")
@@ -148,8 +164,8 @@ def interfaces_route_actions(device=None, remaining_path=None):
 def show_interfaces(device=None, interface_id=None):
     #logger.info("Showing interfaces informations from device '%s' -- context: %s" %\
     #                 (device, request["context"]))
-    swinst = get_switch_instance(device)
-    return swinst.show_interfaces(interface_id=interface_id)
+    with switch_instance(device) as swinst:
+        return swinst.show_interfaces(interface_id=interface_id)
 
 
 @reply_json
@@ -159,8 +175,8 @@ def interface_attach_vlan(device=None, interface_id=None):
                     (interface_id, device, request["context"]))
     vlan_id = request.forms.get("vlan_id")
     tagged  = request.forms.get("tagged", "").lower() == "true"
-    swinst  = get_switch_instance(device)
-    swinst.interface_attach_vlan(interface_id=interface_id, vlan_id=vlan_id, tagged=tagged)
+    with switch_instance(device) as swinst:
+        swinst.interface_attach_vlan(interface_id=interface_id, vlan_id=vlan_id, tagged=tagged)
     defer_save_switch_cfg(device)
     invalidate_cache("/vlans/%s" % device)
 
@@ -171,8 +187,8 @@ def interface_detach_vlan(device=None, interface_id=None):
                     (device, interface_id, request["context"]))
     vlan_id = request.forms.get("vlan_id")
     tagged  = request.forms.get("tagged", "").lower() == "true"
-    swinst  = get_switch_instance(device)
-    swinst.interface_detach_vlan(interface_id=interface_id, vlan_id=vlan_id, tagged=tagged)
+    with switch_instance(device) as swinst:
+        swinst.interface_detach_vlan(interface_id=interface_id, vlan_id=vlan_id, tagged=tagged)
     defer_save_switch_cfg(device)
     invalidate_cache("/vlans/%s" % device)
 
@@ -182,9 +198,9 @@ def change_interface_description(device=None, interface_id=None):
     logger.info("Changing interface '%s' description in device '%s' -- context: %s" %\
                     (interface_id, device, request["context"]))
     interface_description = request.forms.get("interface_description")
-    swinst  = get_switch_instance(device)
-    swinst.change_interface_description(interface_id=interface_id,
-                                        interface_description=interface_description)
+    with switch_instance(device) as swinst:
+        swinst.change_interface_description(interface_id=interface_id,
+                                            interface_description=interface_description)
     defer_save_switch_cfg(device)
     invalidate_cache("/interfaces/%s" % device)
 
@@ -193,8 +209,8 @@ def change_interface_description(device=None, interface_id=None):
 def enable_interface(device=None, interface_id=None):
     logger.info("Enabling interface '%s' in device '%s' -- context: %s" %\
                     (interface_id, device, request["context"]))
-    swinst  = get_switch_instance(device)
-    swinst.enable_interface(interface_id=interface_id)
+    with switch_instance(device) as swinst:
+        swinst.enable_interface(interface_id=interface_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/interfaces/%s" % device)
 
@@ -203,8 +219,8 @@ def enable_interface(device=None, interface_id=None):
 def disable_interface(device=None, interface_id=None):
     logger.info("Disabling interface '%s' in device '%s' -- context: %s" %\
                     (interface_id, device, request["context"]))
-    swinst  = get_switch_instance(device)
-    swinst.disable_interface(interface_id=interface_id)
+    with switch_instance(device) as swinst:
+        swinst.disable_interface(interface_id=interface_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/interfaces/%s" % device)
 
@@ -216,8 +232,8 @@ def create_vlan(device=None, vlan_id=None):
     logger.info("Creating new VLAN with id '%s' in device '%s' -- context: %s" %\
                      (vlan_id, device, request["context"]))
     vlan_description = request.forms.get("vlan_description")
-    swinst = get_switch_instance(device)
-    swinst.create_vlan(vlan_id=vlan_id, vlan_description=vlan_description)
+    with switch_instance(device) as swinst:
+        swinst.create_vlan(vlan_id=vlan_id, vlan_description=vlan_description)
     defer_save_switch_cfg(device)
     invalidate_cache("/vlans/%s" % device)
     response.status = 201
@@ -231,9 +247,9 @@ def change_vlan_description(device=None, vlan_id=None):
     logger.info("Changing VLAN '%s' description in device '%s' -- context: %s" %\
                     (vlan_id, device, request["context"]))
     vlan_description = request.forms.get("vlan_description")
-    swinst  = get_switch_instance(device)
-    swinst.change_vlan_description(vlan_id=vlan_id,
-                                   vlan_description=vlan_description)
+    with switch_instance(device) as swinst:
+        swinst.change_vlan_description(vlan_id=vlan_id,
+                                       vlan_description=vlan_description)
     defer_save_switch_cfg(device)
     invalidate_cache("/vlans/%s" % device)
 
@@ -244,8 +260,8 @@ def change_vlan_description(device=None, vlan_id=None):
 def destroy_vlan(device=None, vlan_id=None):
     logger.info("Removing VLAN '%s' from device '%s' -- context: %s" %\
                      (vlan_id, device, request["context"]))
-    swinst = get_switch_instance(device)
-    swinst.destroy_vlan(vlan_id=vlan_id)
+    with switch_instance(device) as swinst:
+        swinst.destroy_vlan(vlan_id=vlan_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/vlans/%s" % device)
     response.status = 204
@@ -259,8 +275,8 @@ def destroy_vlan(device=None, vlan_id=None):
 def show_vlans(device=None, vlan_id=None):
     #logger.info("Showing VLAN information from device '%s' -- context: %s" %\
     #                (device, request["context"]))
-    swinst = get_switch_instance(device)
-    return swinst.show_vlans(vlan_id=vlan_id)
+    with switch_instance(device) as swinst:
+        return swinst.show_vlans(vlan_id=vlan_id)
 
 
 @put("/vlans/<device>/<vlan_id>/enable")
@@ -269,8 +285,8 @@ def show_vlans(device=None, vlan_id=None):
 def enable_vlan(device=None, vlan_id=None):
     logger.info("Enabling VLAN '%s' in device '%s' -- context: %s" %\
                      (vlan_id, device, request["context"]))
-    swinst = get_switch_instance(device)
-    swinst.enable_vlan(vlan_id=vlan_id)
+    with switch_instance(device) as swinst:
+        swinst.enable_vlan(vlan_id=vlan_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/vlans/%s" % device)
 
@@ -281,8 +297,8 @@ def enable_vlan(device=None, vlan_id=None):
 def disable_vlan(device=None, vlan_id=None):
     logger.info("Disabling VLAN '%s' in device '%s' -- context: %s" %\
                      (vlan_id, device, request["context"]))
-    swinst = get_switch_instance(device)
-    swinst.disable_vlan(vlan_id=vlan_id)
+    with switch_instance(device) as swinst:
+        swinst.disable_vlan(vlan_id=vlan_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/vlans/%s" % device)
 
@@ -294,8 +310,8 @@ def create_lag(device=None, lag_id=None):
     logger.info("Creating new LAG with id '%s' in device '%s' -- context: %s" %\
                     (lag_id, device, request["context"]))
     lag_description = request.forms.get("lag_description")
-    swinst = get_switch_instance(device)
-    swinst.create_lag(lag_id=lag_id, lag_description=lag_description)
+    with switch_instance(device) as swinst:
+        swinst.create_lag(lag_id=lag_id, lag_description=lag_description)
     defer_save_switch_cfg(device)
     invalidate_cache("/lags/%s" % device)
     response.status = 201
@@ -309,9 +325,9 @@ def change_lag_description(device=None, lag_id=None):
     logger.info("Changing LAG '%s' description in device '%s' -- context: %s" %\
                     (lag_id, device, request["context"]))
     lag_description = request.forms.get("lag_description")
-    swinst  = get_switch_instance(device)
-    swinst.change_lag_description(lag_id=lag_id,
-                                   lag_description=lag_description)
+    with switch_instance(device) as swinst:
+        swinst.change_lag_description(lag_id=lag_id,
+                                       lag_description=lag_description)
     defer_save_switch_cfg(device)
     invalidate_cache("/lags/%s" % device)
 
@@ -322,13 +338,57 @@ def change_lag_description(device=None, lag_id=None):
 def destroy_lag(device=None, lag_id=None):
     logger.info("Removing LAG '%s' from device '%s' -- context: %s" %\
                      (lag_id, device, context))
-    swinst = get_switch_instance(device)
-    swinst.destroy_lag(lag_id=lag_id)
+    with switch_instance(device) as swinst:
+        swinst.destroy_lag(lag_id=lag_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/lags/%s" % device)
     response.status = 204
 
 
+@get(["/arp/<device>", "/arp/<device>/<interface_id:path>"])
+@context
+@log_request_ahead("Showing ARP information from device %s", ("device",))
+@stream_json
+@cached(ttl=180)
+def show_arp(device=None, interface_id=None):
+    with switch_instance(device) as swinst:
+        return swinst.show_arp(interface_id=interface_id)
+
+
+@get("/config/<device>")
+@context
+@log_request_ahead("Dumping running-config from device %s", ("device",))
+def dump_config(device=None):
+    """
+    Running-config (text/plain), streamed as it is read from the switch (not cached).
+    """
+    breaker = get_device_circuit_breaker(device)
+    if breaker is not None:
+        # fail fast before the (200) response starts
+        breaker.before_call(probe=False)
+    response.content_type = "text/plain; charset=UTF-8"
+    def stream():
+        with switch_instance(device) as swinst:
+            lines = swinst.stream_config()
+            try:
+                buff = []
+                size = 0
+                for line in lines:
+                    buff.append("%s\r\n" % line)
+                    size += len(line) + 2
+                    if size >= 16384:
+                        yield "".join(buff)
+                        buff = []
+                        size = 0
+                if buff:
+                    yield "".join(buff)
+            finally:
+                # client gone/error: stops reading from the switch (see L2Transport.execute_stream())
+                if hasattr(lines, "close"):
+                    lines.close()
+    return stream()
+
+
 @get(["/lags/<device>", "/lags/<device>/<lag_id>"])
 @context
 @log_request_ahead("Showing LAG information from device %s", ("device",))
@@ -337,8 +397,8 @@ def destroy_lag(device=None, lag_id=None):
 def show_lags(device=None, lag_id=None):
     #logger.info("Showing LAG information from device '%s' -- context: %s" %\
     #                 (device, request["context"]))
-    swinst = get_switch_instance(device)
-    return swinst.show_lags(lag_id=lag_id)
+    with switch_instance(device) as swinst:
+        return swinst.show_lags(lag_id=lag_id)
 
 
 @put("/lags/<device>/<lag_id>/enable")
@@ -347,8 +407,8 @@ def show_lags(device=None, lag_id=None):
 def enable_lag(device=None, lag_id=None):
     logger.info("Enabling LAG '%s' in device '%s' -- context: %s" %\
                      (lag_id, device, request["context"]))
-    swinst = get_switch_instance(device)
-    swinst.enable_lag(lag_id=lag_id)
+    with switch_instance(device) as swinst:
+        swinst.enable_lag(lag_id=lag_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/lags/%s" % device)
 
@@ -359,8 +419,8 @@ def enable_lag(device=None, lag_id=None):
 def disable_lag(device=None, lag_id=None):
     logger.info("Disabling LAG '%s' in device '%s' -- context: %s" %\
                      (lag_id, device, request["context"]))
-    swinst = get_switch_instance(device)
-    swinst.disable_lag(lag_id=lag_id)
+    with switch_instance(device) as swinst:
+        swinst.disable_lag(lag_id=lag_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/lags/%s" % device)
 
@@ -373,8 +433,8 @@ def lag_attach_interface(device=None, lag_id=None):
     logger.info("Attaching a new interface to LAG '%s' in device '%s' -- context: %s" %\
                      (lag_id, device, request["context"]))
     interface_id = request.forms.get("interface_id")
-    swinst       = get_switch_instance(device)
-    swinst.lag_attach_interface(lag_id=lag_id, interface_id=interface_id)
+    with switch_instance(device) as swinst:
+        swinst.lag_attach_interface(lag_id=lag_id, interface_id=interface_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/lags/%s" % device)
 
@@ -387,8 +447,8 @@ def lag_detach_interface(device=None, lag_id=None):
     logger.info("Detaching an interface from LAG '%s' in device '%s' -- context: %s" %\
                      (lag_id, device, request["context"]))
     interface_id = request.forms.get("interface_id")
-    swinst       = get_switch_instance(device)
-    swinst.lag_detach_interface(lag_id=lag_id, interface_id=interface_id)
+    with switch_instance(device) as swinst:
+        swinst.lag_detach_interface(lag_id=lag_id, interface_id=interface_id)
     defer_save_switch_cfg(device)
     invalidate_cache("/lags/%s" % device)
 
@@ -402,8 +462,8 @@ def lag_attach_vlan(device=None, lag_id=None):
                      (lag_id, device, request["context"]))
     vlan_id = request.forms.get("vlan_id")
     tagged  = request.forms.get("tagged", "").lower() == "true"
-    swinst  = get_switch_instance(device)
-    swinst.lag_attach_vlan(lag_id=lag_id, vlan_id=vlan_id, tagged=tagged)
+    with switch_instance(device) as swinst:
+        swinst.lag_attach_vlan(lag_id=lag_id, vlan_id=vlan_id, tagged=tagged)
     defer_save_switch_cfg(device)
     invalidate_cache("/vlans/%s" % device)
 
@@ -417,12 +477,94 @@ def lag_detach_vlan(device=None, lag_id=None):
                      (lag_id, device, request["context"]))
     vlan_id = request.forms.get("vlan_id")
     tagged  = request.forms.get("tagged", "").lower() == "true"
-    swinst  = get_switch_instance(device)
-    swinst.lag_detach_vlan(lag_id=lag_id, vlan_id=vlan_id, tagged=tagged)
+    with switch_instance(device) as swinst:
+        swinst.lag_detach_vlan(lag_id=lag_id, vlan_id=vlan_id, tagged=tagged)
     defer_save_switch_cfg(device)
     invalidate_cache("/vlans/%s" % device)
 
 
+@get("/fleet/<operation>")
+@context
+@log_request_ahead("Running fleet operation '%s'", ("operation",))
+@validate_input(src="query", device_timeout=lambda t: t is None or float(t) > 0,
+                             timeout=lambda t: t is None or float(t) > 0)
+def fleet_operation(operation=None):
+    """
+    Runs show_vlans/show_interfaces/show_uplinks/show_arp concurrently on a set of devices.
+    Query string: devices (comma-separated ids) and/or selector (REGEXP on device ids) --
+    all devices if both are omitted -- device_timeout (seconds, counted from the request),
+    timeout (seconds, whole request; capped by [fleet] timeout) and the operation parameter
+    (vlan_id or interface_id).
+    Streams one JSON document per line, as each device finishes, and a summary at the end.
+    """
+    if not FLEET_OPERATIONS.has_key(operation):
+        abort(404, "Not Found")
+    try:
+        devices = select_devices(devices=request.query.get("devices"), selector=request.query.get("selector"))
+    except DeviceNotFound, e:
+        abort(404, str(e))
+    except re.error, e:
+        abort(400, "Error: parameter 'selector' is an invalid REGEXP (%s)" % e)
+    method, param  = FLEET_OPERATIONS[operation]
+    kwargs         = {}
+    if param is not None and request.query.get(param):
+        kwargs[param] = request.query.get(param)
+    device_timeout = request.query.get("device_timeout")
+    device_timeout = float(device_timeout) if device_timeout else None
+    timeout        = request.query.get("timeout")
+    timeout        = float(timeout) if timeout else None
+    response.content_type = "application/x-ndjson; charset=UTF-8"
+    def stream():
+        failed = []
+        for device, r, e in fleet_run(devices=devices, operation=operation, kwargs=kwargs,
+                                       device_timeout=device_timeout, timeout=timeout):
+            if e is None:
+                yield '{"device": %s, "status": "ok", "result": ' % dumps(device)
+                for chunk in iter_json(r):
+                    yield chunk
+                yield "}\n"
+                continue
+            failed.append(device)
+            yield "%s\n" % dumps({"device":            device,
+                                   "status":            "error",
+                                   "app.error.type":    repr(e).split("(")[0],
+                                   "app.error.message": str(e)})
+        yield "%s\n" % dumps({"fleet.summary": { "operation": operation,
+                                                  "devices":   len(devices),
+                                                  "succeeded": len(devices) - len(failed),
+                                                  "failed":    failed }})
+    return stream()
+
+
+@get(["/health", "/health/<device>"])
+@context
+@reply_json
+def device_health(device=None):
+    """
+    Transport circuit breaker state (closed/open/half-open) of each device ([circuit_breaker] in netl2server.cfg).
+    In-process state: devices not used by this netl2server process yet are reported as closed.
+    """
+    devices = get_devices_cfg()
+    if device is not None and not devices.has_key(device):
+        abort(404, "Switch not known/configured => '%s'" % device)
+    health = {}
+    for dev in ([device] if device is not None else devices.keys()):
+        breaker     = get_device_circuit_breaker(dev)
+        health[dev] = { "device.mgmt-host": devices[dev].get("mgmt-host"),
+                        "circuit_breaker":  breaker.get_state() if breaker is not None else None }
+    return health
+
+
+@get("/metrics")
+def metrics():
+    """
+    Transport metrics (per-device command latency, bytes, reconnects, circuit breakers) of this
+    netl2server process, in the Prometheus text format.
+    """
+    response.content_type = "text/plain; version=0.0.4; charset=UTF-8"
+    return render_prometheus()
+
+
 #@get(["/networkpath/<from_device>", "/networkpath/<from_device>/<to_device>"])
 #@context
 #@log_request_ahead("Tracing network-path from device '%s' to '%s'", ("from_device", "to_device"))
@@ -470,9 +612,66 @@ def error500(err):
         err_info["server.message"] = "L2API Error"
     else:
         err_info["server.message"] = "Internal Server Error"
+    if isinstance(err.exception, TransportCircuitOpen):
+        # device known to be down (see /health/<device>): not a server error
+        response.status = 503
+        response.set_header("Retry-After", str(int(math.ceil(err.exception.retry_after or 1))))
+        err_info["server.status"] = response.status_line
     return err_info
 
 
+def chunked_wsgi_handler():
+    """
+    paste's WSGIHandler closes the connection after any response without a Content-Length
+    (eg. the generators returned by @stream_json, /config and /fleet). This one sends them
+    with 'Transfer-Encoding: chunked' to HTTP/1.1 clients instead (keep-alive preserved).
+    """
+    from paste import httpserver
+
+    class ChunkedWSGIHandler(httpserver.WSGIHandler):
+        wsgi_chunked = False
+
+        def wsgi_write_chunk(self, chunk):
+            if not self.wsgi_headers_sent and self.wsgi_curr_headers:
+                status, headers = self.wsgi_curr_headers
+                hnames = [k.lower() for k, v in headers]
+                if self.request_version == "HTTP/1.1" and self.command != "HEAD" and \
+                        "content-length" not in hnames and "transfer-encoding" not in hnames and \
+                        status[:3] not in ("204", "304") and not status.startswith("1"):
+                    self.wsgi_chunked      = True
+                    self.wsgi_curr_headers = (status, headers + [("Transfer-Encoding", "chunked")])
+            if not self.wsgi_chunked:
+                return httpserver.WSGIHandler.wsgi_write_chunk(self, chunk)
+            if not self.wsgi_headers_sent:
+                self.wsgi_headers_sent = True
+                status, headers = self.wsgi_curr_headers
+                code, message   = status.split(" ", 1)
+                self.send_response(int(code), message)
+                for k, v in headers:
+                    if k.lower() == "connection" and v.lower() == "close":
+                        self.close_connection = 1
+                    self.send_header(k, v)
+                self.end_headers()
+            if chunk:
+                self.wfile.write("%x\r\n%s\r\n" % (len(chunk), chunk))
+
+        def wsgi_execute(self, environ=None):
+            self.wsgi_chunked = False
+            try:
+                httpserver.WSGIHandler.wsgi_execute(self, environ)
+            except:
+                # body truncated (no last-chunk): the client must not reuse this connection
+                self.close_connection = 1
+                raise
+            if self.wsgi_chunked:
+                try:
+                    self.wfile.write("0\r\n\r\n")
+                except socket.error:
+                    self.close_connection = 1
+
+    return ChunkedWSGIHandler
+
+
 class PasteServerAdapter(ServerAdapter):
     def run(self, handler): # pragma: no cover
         from paste import httpserver
@@ -480,6 +679,7 @@ class PasteServerAdapter(ServerAdapter):
             from paste.translogger import TransLogger
             handler = TransLogger(handler)
         httpserver.serve(handler, host=self.host, port=str(self.port), protocol_version="HTTP/1.1",
+                        handler=chunked_wsgi_handler(),
                         daemon_threads=True, socket_timeout=600,
                         use_threadpool=cfg.get("httpd", "use_threadpool").lower() == "true",
                         threadpool_workers=cfg.getint("httpd", "threadpool_workers"),
@@ -510,8 +710,36 @@ def start():
     else:
         setproctitle("netl2api [netl2server:http-daemon]")
     logger.info("Starting netl2server...")
+    if get_cfg_opt(cfg, "ssh", "spawn_helper", False, bool) is True:
+        # forked while the daemon is still single-threaded
+        start_spawn_helper()
+    configure_autocache_backend(backend=get_cfg_opt(cfg, "autocache", "backend", "instance"),
+                                local_max_entries=get_cfg_opt(cfg, "autocache", "local_max_entries", 4096, int),
+                                local_ttl=get_cfg_opt(cfg, "autocache", "local_ttl", 5, float),
+                                redis_client=RedisClient())
+    configure_autocache_write_through(enabled=get_cfg_opt(cfg, "autocache", "write_through", False, bool),
+                                      reconcile_interval=get_cfg_opt(cfg, "autocache", "reconcile_interval", 60, float))
+    configure_autocache_stale_if_error(stale_if_error=get_cfg_opt(cfg, "autocache", "stale_if_error", 0, float))
+    if has_local_autocache():
+        # drops the local autocache entries of devices changed through other processes
+        start_invalidation_listener()
+    configure_interface_inventory(ttl=get_cfg_opt(cfg, "interface_inventory", "ttl", 3600, float),
+                                  min_refresh_interval=get_cfg_opt(cfg, "interface_inventory", "min_refresh_interval", 30, float))
     start_workers()
-    run(server=PasteServerAdapter, host=cfg.get("httpd", "host"), port=cfg.getint("httpd", "port"))
+    configure_circuit_breakers(enabled=get_cfg_opt(cfg, "circuit_breaker", "enabled", True, bool),
+                               failure_threshold=get_cfg_opt(cfg, "circuit_breaker", "failure_threshold", 3, int),
+                               open_timeout=get_cfg_opt(cfg, "circuit_breaker", "open_timeout", 5, float),
+                               max_open_timeout=get_cfg_opt(cfg, "circuit_breaker", "max_open_timeout", 300, float),
+                               probe_timeout=get_cfg_opt(cfg, "circuit_breaker", "probe_timeout", 120, float))
+    if get_cfg_opt(cfg, "ssh", "control_master", False, bool) is True:
+        enable_control_master(control_dir=get_cfg_opt(cfg, "ssh", "control_dir", None),
+                              idle_timeout=get_cfg_opt(cfg, "ssh", "control_idle_timeout", 300, float))
+    try:
+        run(server=PasteServerAdapter, host=cfg.get("httpd", "host"), port=cfg.getint("httpd", "port"))
+    finally:
+        close_switch_pools()
+        close_control_masters()
+        stop_spawn_helper()
 
 
 def main(action="foreground"):
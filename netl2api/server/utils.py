@@ -22,27 +22,8 @@
 __copyright__ = "Copyright 2012, Locaweb IDC"
 
 
-import redis
-from netl2api.lib.config import get_netl2server_cfg
+# RedisClient has moved to netl2api.lib.config (one shared, pooled client)
+from netl2api.lib.config import RedisClient
 
 
 __all__ = ["RedisClient"]
-
-
-cfg = get_netl2server_cfg()
-
-
-class RedisClient(object):
-    def __init__(self, db=7, timeout=3):
-        self.host = cfg.get("redis", "host")
-        self.port = cfg.getint("redis", "port")
-        self.timeout  = timeout
-        self.redis_db = db
-        self._redis   = redis.Redis(host=self.host, port=self.port, db=self.redis_db,
-                                      socket_timeout=self.timeout)
-
-    def get_connection(self):
-        if self._redis is None or not self._redis.ping():
-            self._redis = redis.Redis(host=self.host, port=self.port, db=self.redis_db,
-                                      socket_timeout=self.timeout)
-        return self._redis
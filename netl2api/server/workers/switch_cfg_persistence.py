@@ -25,7 +25,7 @@ __copyright__ = "Copyright 2012, Locaweb IDC"
 import signal
 from apscheduler.scheduler import Scheduler
 from netl2api.lib.utils import gen_context_uid
-from netl2api.lib.utils import get_switch_instance
+from netl2api.lib.utils import switch_instance
 from netl2api.server.workers.switch_cfg_persistence_utils import *
 from netl2api.lib.config import get_netl2server_cfg, setup_persistence_ctrl_logger
 
@@ -49,8 +49,8 @@ def worker():
         context = {"CTX-UUID": gen_context_uid()}
         try:
             logger.info("Starting persistence-job for device '%s' -- context: %s" % (device, context))
-            swinst = get_switch_instance(device)
-            swinst.save_config()
+            with switch_instance(device) as swinst:
+                swinst.save_config()
             finish_persistence_job(device)
         except NotImplementedError, e:
             logger.exception("Error on saving configuration on device '%s' -- context: %s" % (device, context))
@@ -38,37 +38,35 @@ redis_cli           = RedisClient()
 def defer_save_switch_cfg(device=None):
     try:
         sw_persist_ctrl_db = redis_cli.get_connection()
+        sw_persist_ctrl_db.incr("rwopts:%s:counter" % device, amount=1)
     except Exception, e:
         logger_netl2server.exception("Error in Redis connection (persistence control database)")
-        return
-    sw_persist_ctrl_db.incr("rwopts:%s:counter" % device, amount=1)
 
 
 def acquire_persistence_lock(device=None):
     try:
-        sw_persist_ctrl_db = redis_cli.get_connection()
+        sw_persist_ctrl_db      = redis_cli.get_connection()
+        persistence_daemon_lock = sw_persist_ctrl_db.lock("rwopts:%s:lock" % device, 300)
+        lock_acquired           = persistence_daemon_lock.acquire(blocking=False)
     except Exception, e:
         logger_persist_ctrl.exception("Error in Redis connection (persistence control database)")
         return
-    persistence_daemon_lock = sw_persist_ctrl_db.lock("rwopts:%s:lock" % device, 300)
-    if persistence_daemon_lock.acquire(blocking=False) is True:
+    if lock_acquired is True:
         return persistence_daemon_lock
 
 
 def list_pending_persistence_jobs():
     try:
         sw_persist_ctrl_db = redis_cli.get_connection()
+        return [sw.split(":")[1] for sw in sw_persist_ctrl_db.keys("rwopts:*:counter") \
+                    if int(sw_persist_ctrl_db.get(sw)) > 0]
     except Exception, e:
         logger_persist_ctrl.exception("Error in Redis connection (persistence control database)")
-        return
-    return [sw.split(":")[1] for sw in sw_persist_ctrl_db.keys("rwopts:*:counter") \
-                if int(sw_persist_ctrl_db.get(sw)) > 0]
 
 
 def finish_persistence_job(device=None):
     try:
         sw_persist_ctrl_db = redis_cli.get_connection()
+        sw_persist_ctrl_db.set("rwopts:%s:counter" % device, 0)
     except Exception, e:
         logger_persist_ctrl.exception("Error in Redis connection (persistence control database)")
-        return
-    sw_persist_ctrl_db.set("rwopts:%s:counter" % device, 0)
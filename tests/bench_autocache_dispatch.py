@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# L2APIAutoCache method-dispatch microbenchmark: wrappers compiled once per class
+# vs. the previous __getattribute__ hook (kept below). Uses the Flex10 cache_config;
+# no device/transport is involved.
+#
+# Usage: python tests/bench_autocache_dispatch.py [iterations]
+
+
+import sys
+import timeit
+from netl2api.l2api.hp import flex10
+from netl2api.l2api.autocache import L2APIAutoCache, InstanceCacheBackend
+
+
+class NullTransport(object):
+    def __init__(self, *args, **kwargs):
+        self.crlf = None
+        self.host = "bench"
+        self.port = 22
+
+
+def flex10_cache_config():
+    flex10.discover_master_switch = lambda host=None, timeout=60: host
+    return flex10.Flex10(host="bench", port=22, username="bench", passwd="bench", transport=NullTransport).cache_config
+
+
+class OldL2APIAutoCache(object):
+    """ previous implementation (dispatch on every attribute access) """
+
+    def __init__(self):
+        self._cache_backend = InstanceCacheBackend()
+        if not hasattr(self, "use_cache"):
+            self.use_cache = False
+
+    def __getattribute__(self, name):
+        attr = super(OldL2APIAutoCache, self).__getattribute__(name)
+        if not callable(attr):
+            return attr
+        if name in self.cache_config.keys():
+            def _cache_opt(*args, **kwargs):
+                return self._cache_opt(attr, *args, **kwargs)
+            return _cache_opt
+        else:
+            clear_keys = [k for k,v in self.cache_config.iteritems() \
+                                if name in v.get("clear_on")]
+            if len(clear_keys) == 0:
+                return attr
+            def _cache_clear_keys(*args, **kwargs):
+                return self._cache_clear_keys(clear_keys, attr, *args, **kwargs)
+            return _cache_clear_keys
+
+    _cache_opt     = L2APIAutoCache.__dict__["_cache_opt"]
+    _use_cache     = L2APIAutoCache.__dict__["_use_cache"]
+    _cache_arg_key = L2APIAutoCache.__dict__["_cache_arg_key"]
+    _cache_device  = L2APIAutoCache.__dict__["_cache_device"]
+
+    def _cache_clear_keys(self, clear_keys, f, *args, **kwargs):
+        r = f(*args, **kwargs)
+        self._cache_backend.clear(self._cache_device, clear_keys)
+        return r
+
+
+def bench_api(base, cache_config):
+    class BenchAPI(base):
+        def __init__(self):
+            self.use_cache    = True
+            self.cache_config = dict(cache_config)
+            self.transport    = NullTransport()
+            base.__init__(self)
+
+        def show_vlans(self, vlan_id=None):
+            return {"1": {}}
+
+        def create_vlan(self, vlan_id=None):
+            pass
+
+        def _helper(self):
+            return self.transport
+
+        def show_helper(self):
+            # private helper calls and attribute lookups, as in the vendor parsers
+            for i in xrange(10):
+                self._helper()
+    return BenchAPI()
+
+
+CASES = [("attribute (self.transport)", "api.transport"),
+         ("plain method call",          "api.show_helper()"),
+         ("cached method (hit)",        "api.show_vlans()"),
+         ("clear_on method",            "api.create_vlan(10)")]
+
+
+def bench(iterations=100000):
+    cache_config = flex10_cache_config()
+    print "cache_config: %s cached methods; iterations: %s" % (len(cache_config), iterations)
+    print "%-28s %12s %12s %8s" % ("", "before (us)", "after (us)", "speedup")
+    for label, stmt in CASES:
+        call    = eval("lambda api: %s" % stmt)
+        results = []
+        for base in (OldL2APIAutoCache, L2APIAutoCache):
+            api = bench_api(base, cache_config)
+            api.show_vlans()
+            t = min(timeit.Timer(lambda: call(api)).repeat(3, iterations))
+            results.append(t / iterations * 1000000)
+        print "%-28s %12.3f %12.3f %7.1fx" % (label, results[0], results[1], results[0] / results[1])
+
+
+if __name__ == "__main__":
+    bench(iterations=int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# HTTP cache invalidation benchmark: tag-indexed invalidate_cache() vs. the old KEYS scan.
+# Needs a redis-server (see [redis] in netl2server.cfg). Uses (and flushes!) the redis db 15.
+#
+# Usage: python tests/bench_cache_invalidation.py [entries_per_device]
+
+
+import sys
+import time
+from hashlib import sha1
+from netl2api.server import http_cache
+from netl2api.server.utils import RedisClient
+
+
+BENCH_DB = 15
+DEVICES  = 10
+
+
+def populate(cache_db, devices, entries_per_device):
+    pipe = cache_db.pipeline(transaction=False)
+    for device in xrange(devices):
+        for i in xrange(entries_per_device):
+            path = "/interfaces/sw%04d/port%d" % (device, i)
+            rkey = "cache:GET:%s:%s" % (path, sha1("").hexdigest())
+            pipe.setex(rkey, "x", 3600)
+        pipe.execute()
+        for i in xrange(entries_per_device):
+            path = "/interfaces/sw%04d/port%d" % (device, i)
+            rkey = "cache:GET:%s:%s" % (path, sha1("").hexdigest())
+            http_cache.tag_cache_entry(cache_db, rkey, path, 3600)
+
+
+def keys_scan_invalidate(cache_db, key):
+    # previous implementation
+    cache_db.delete(*cache_db.keys("cache:*:%s*" % key))
+
+
+def bench(entries_per_device=100):
+    http_cache.redis_cli = RedisClient(db=BENCH_DB)
+    cache_db = http_cache.redis_cli.get_connection()
+    print "entries/device: %s; devices: %s" % (entries_per_device, DEVICES)
+    for total_devices in (DEVICES, DEVICES*10, DEVICES*50):
+        cache_db.flushdb()
+        populate(cache_db, total_devices, entries_per_device)
+        dbsize = cache_db.dbsize()
+        tagged = cache_db.scard("cache-tag:/interfaces/sw0000")
+        t0 = time.time()
+        http_cache.invalidate_cache("/interfaces/sw0000")
+        t_tags = time.time() - t0
+        assert not cache_db.exists("cache:GET:/interfaces/sw0000/port0:%s" % sha1("").hexdigest())
+        t0 = time.time()
+        keys_scan_invalidate(cache_db, "/interfaces/sw0001")
+        t_keys = time.time() - t0
+        # keys examined: the device tag set members vs. the whole keyspace
+        print "redis keys: %8s  tag-index: %8.2f ms (%s keys)  KEYS scan: %8.2f ms (%s keys)" \
+                    % (dbsize, t_tags * 1000, tagged + 1, t_keys * 1000, dbsize)
+    cache_db.flushdb()
+
+
+if __name__ == "__main__":
+    bench(entries_per_device=int(sys.argv[1]) if len(sys.argv) > 1 else 100)
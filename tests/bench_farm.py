@@ -0,0 +1,365 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# End-to-end benchmark against a simulated switch farm (see switch_sim.py).
+#
+# Drives an L2API method (--op) on N simulated devices through each transport and through
+# the full netl2server HTTP stack (httpd + switch pool + driver + transport), with
+# --concurrency client threads, and reports throughput and p50/p99 latency.
+#
+#  - sysssh: SysSSH + the system ssh client against the farm ssh endpoint (--ssh);
+#            otherwise SystemSSH spawns the simulator on its pty instead of 'ssh' ("sysssh(pty)")
+#  - pyssh:  PySSH against the farm ssh endpoint (--ssh)
+#  - telnet: TelnetTransport against the farm telnet endpoint
+#  - http:   netl2server (subprocess) -- devices reached through SysSSH, like "sysssh"
+#
+# The ssh endpoint needs the 'ssh' (or 'paramiko') module.
+#
+# Usage: python tests/bench_farm.py [--devices 10] [--concurrency 10] [--requests 200] [--op show_vlans]
+#                                   [--latency 20] [--jitter 5] [--cpus 1] [--transports sysssh,telnet,http]
+#        python tests/bench_farm.py --help
+
+
+import os
+import sys
+import json
+import time
+import pwd
+import socket
+import httplib
+import logging
+import optparse
+import itertools
+import threading
+import subprocess
+from tempfile import mkdtemp
+from shutil import rmtree
+from netl2api.l2api.dell.force10 import Force10
+from netl2api.l2api.hp import flex10
+from netl2api.l2api.hp.flex10 import Flex10
+from netl2api.l2api.brocade.vdx67xx import VDX
+from netl2api.l2api.brocade.netiron import NetIron
+from netl2api.l2api.transport.SystemSSH import SystemSSH
+from netl2api.l2api.transport.SysSSHTransport import SysSSH
+from netl2api.l2api.transport.TelnetTransport import Telnet
+
+
+SWITCH_SIM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "switch_sim.py")
+ROOT_DIR   = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VENDORS = { "force10": Force10,
+            "flex10":  Flex10,
+            "vdx":     VDX,
+            "netiron": NetIron }
+
+# --op => netl2server URL
+HTTP_PATHS = { "show_version":    "/version/%s",
+               "show_system":     "/system/%s",
+               "show_interfaces": "/interfaces/%s",
+               "show_vlans":      "/vlans/%s",
+               "show_lags":       "/lags/%s",
+               "show_arp":        "/arp/%s",
+               "dump_config":     "/config/%s" }
+
+
+class SimSystemSSH(SystemSSH):
+    """
+        SystemSSH spawning the simulator (switch_sim.py pty) instead of 'ssh'.
+        Simulator options: SWITCH_SIM_ARGS environment variable (JSON list; "%(host)s" is the device).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(SimSystemSSH, self).__init__(*args, **kwargs)
+        sim_args = json.loads(os.environ.get("SWITCH_SIM_ARGS", "[]"))
+        self._ssh_cmd = [sys.executable, SWITCH_SIM, "pty", "--hostname", self.host, "--username", self.username,
+                         "--passwd", self.passwd] + [a % {"host": self.host} for a in sim_args]
+
+
+class SimSysSSH(SysSSH):
+    def _setup_connection(self):
+        ssh = SimSystemSSH(host=self.host, port=self.port, username=self.username, passwd=self.passwd)
+        ssh.open_session()
+        return ssh
+
+
+def _vendor_class(dialect, transport):
+    vendor = VENDORS[dialect]
+    def __init__(self, *args, **kwargs):
+        kwargs["transport"] = transport
+        vendor.__init__(self, *args, **kwargs)
+    return type("%s%s" % (transport.__name__, vendor.__name__), (vendor,), {"__init__": __init__})
+
+
+# mgmt-api classes (devices.cfg) used by the HTTP benchmark (eg. bench_farm.SimSysSSHForce10)
+for _dialect, _vendor in VENDORS.iteritems():
+    for _transport in (SysSSH, SimSysSSH):
+        globals()["%s%s" % (_transport.__name__, _vendor.__name__)] = _vendor_class(_dialect, _transport)
+
+
+# the simulator has no Virtual Connect SOAP endpoint: every simulated Flex10 is its own VC manager
+flex10.discover_master_switch = lambda host=None, timeout=60: host
+
+
+def percentile(samples, p):
+    return samples[min(int(len(samples) * p / 100.0), len(samples) - 1)]
+
+
+def run_load(call, devices, concurrency, requests):
+    """
+    call(worker, device) 'requests' times, from 'concurrency' threads.
+    Worker 'w' uses the devices[w::concurrency] (or devices[w % len(devices)], if concurrency > devices);
+    a warm-up call per (worker, device) -- login, session setup -- is not measured.
+    """
+    counter   = itertools.count()
+    latencies = []
+    errors    = []
+    barrier   = threading.Semaphore(0)
+    start     = threading.Event()
+    def worker(w):
+        own_devices = devices[w::concurrency] or [devices[w % len(devices)]]
+        try:
+            for device in own_devices:
+                call(w, device)
+        except Exception, e:
+            errors.append(e)
+        barrier.release()
+        start.wait()
+        for device in itertools.cycle(own_devices):
+            if counter.next() >= requests:
+                return
+            t0 = time.time()
+            try:
+                call(w, device)
+            except Exception, e:
+                errors.append(e)
+                continue
+            latencies.append(time.time() - t0)
+    threads = [threading.Thread(target=worker, args=(w,)) for w in xrange(concurrency)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        barrier.acquire()
+    t0 = time.time()
+    start.set()
+    for t in threads:
+        t.join()
+    return sorted(latencies), errors, time.time() - t0
+
+
+def report(name, latencies, errors, wall):
+    if latencies:
+        print "%-14s %7d %7d %8.2f %9.1f %9.1f %9.1f" % (name, len(latencies), len(errors), wall, len(latencies) / wall,
+                                                        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000)
+    else:
+        print "%-14s %7d %7d %8.2f %9s %9s %9s" % (name, 0, len(errors), wall, "-", "-", "-")
+    if errors:
+        print "  first error: %r" % errors[0]
+
+
+def bench_transport(transport, endpoints, opts):
+    """ L2API (--dialect) over 'transport'; one session per (worker, device) """
+    vendor    = VENDORS[opts.dialect]
+    devices   = sorted(endpoints.keys())
+    instances = {}
+    def call(w, device):
+        swinst = instances.get((w, device))
+        if swinst is None:
+            swinst = vendor(host=endpoints[device][0], port=endpoints[device][1], username="admin",
+                            passwd="admin", transport=transport)
+            swinst.use_cache = False
+            instances[(w, device)] = swinst
+        getattr(swinst, opts.op)()
+    try:
+        return run_load(call, devices, opts.concurrency, opts.requests)
+    finally:
+        for swinst in instances.values():
+            swinst.transport.close()
+
+
+def write_server_cfg(cfg_dir, devices, opts):
+    server_cfg = open(os.path.join(ROOT_DIR, "etc", "netl2api", "netl2server.cfg")).read()
+    cfg_lines  = []
+    section    = None
+    overrides  = { "logger":      {"level": opts.log_level},
+                   "httpd":       {"user": pwd.getpwuid(os.getuid())[0], "host": "127.0.0.1",
+                                   "port": str(opts.http_port), "threadpool_workers": str(max(opts.concurrency, 8)),
+                                   "logfile": os.path.join(cfg_dir, "netl2server.log")},
+                   "switch_pool": {"enabled": "true", "max_sessions": str(opts.pool_sessions)},
+                   "cache":       {"enabled": "false", "local_enabled": "false"} }
+    for line in server_cfg.splitlines():
+        if line.startswith("["):
+            section = line.strip("[] ")
+        elif section in overrides and ":" in line and not line.startswith("#"):
+            option = line.split(":", 1)[0].strip()
+            if overrides[section].has_key(option):
+                line = "%s: %s" % (option, overrides[section][option])
+        cfg_lines.append(line)
+    open(os.path.join(cfg_dir, "netl2server.cfg"), "w").write("\n".join(cfg_lines) + "\n")
+    devices_cfg = []
+    for device, (mgmt_api, host, port) in sorted(devices.iteritems()):
+        devices_cfg.extend(["[device.%s]" % device, "mgmt-api: %s" % mgmt_api, "mgmt-host: %s" % host,
+                            "mgmt-port: %s" % port, "mgmt-user: admin", "mgmt-pass: admin", ""])
+    devices_cfg_file = os.path.join(cfg_dir, "devices.cfg")
+    open(devices_cfg_file, "w").write("\n".join(devices_cfg))
+    os.chmod(devices_cfg_file, 0600)
+
+
+def wait_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return True
+        except socket.error:
+            time.sleep(0.2)
+    return False
+
+
+def bench_http(devices, opts, cfg_dir):
+    """ netl2server subprocess; 'devices': {device: (mgmt-api, host, port)} """
+    write_server_cfg(cfg_dir, devices, opts)
+    env = dict(os.environ)
+    env["NETL2API_CFG_BASE"] = cfg_dir
+    env["PYTHONPATH"]        = os.pathsep.join([ROOT_DIR, os.path.dirname(SWITCH_SIM), env.get("PYTHONPATH", "")])
+    server_out = open(os.path.join(cfg_dir, "netl2server.out"), "w")
+    server     = subprocess.Popen([sys.executable, "-c", "from netl2api.server import httpd; httpd.start()"], env=env,
+                                  stdout=server_out, stderr=subprocess.STDOUT)
+    try:
+        if not wait_port("127.0.0.1", opts.http_port):
+            raise RuntimeError("netl2server did not start: %s" % open(server_out.name).read()[-2000:])
+        connections = {}
+        def call(w, device):
+            conn = connections.get(w)
+            if conn is None:
+                conn = connections[w] = httplib.HTTPConnection("127.0.0.1", opts.http_port, timeout=300)
+            try:
+                conn.request("GET", HTTP_PATHS[opts.op] % device)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (socket.error, httplib.HTTPException):
+                connections.pop(w).close()
+                raise
+            if resp.status != 200:
+                raise RuntimeError("HTTP %s: %s" % (resp.status, body[:200]))
+        return run_load(call, sorted(devices.keys()), opts.concurrency, opts.requests)
+    finally:
+        server.terminate()
+        server.wait()
+        server_out.close()
+
+
+def start_farm(opts, ssh=False):
+    cmd = [sys.executable, SWITCH_SIM, "farm", "--devices", str(opts.devices), "--dialect", opts.dialect,
+           "--cpus", str(opts.cpus)] + sim_options(opts)
+    if ssh:
+        cmd.extend(["--ssh-port", "0"])
+    farm = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    endpoints = farm.stdout.readline()
+    if not endpoints:
+        farm.wait()
+        raise RuntimeError("switch_sim.py farm failed")
+    return farm, json.loads(endpoints)
+
+
+def sim_options(opts):
+    options = ["--latency", str(opts.latency), "--jitter", str(opts.jitter)]
+    for cmd_latency in opts.cmd_latency:
+        options.extend(["--latency", cmd_latency])
+    if opts.recordings:
+        options.extend(["--recordings", os.path.abspath(opts.recordings)])
+    return options
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--devices", type="int", default=10)
+    parser.add_option("--concurrency", type="int", default=10)
+    parser.add_option("--requests", type="int", default=200, help="measured requests per transport")
+    parser.add_option("--dialect", default="force10", choices=VENDORS.keys())
+    parser.add_option("--op", default="show_vlans", help="L2API method (no arguments)")
+    parser.add_option("--transports", default="sysssh,pyssh,telnet,http")
+    parser.add_option("--ssh", action="store_true", default=False, help="farm ssh endpoint (needs ssh/paramiko)")
+    parser.add_option("--latency", type="float", default=20, help="ms per command")
+    parser.add_option("--cmd-latency", action="append", default=[], help="'CMD_PREFIX=ms' (repeatable)")
+    parser.add_option("--jitter", type="float", default=5, help="+/- ms")
+    parser.add_option("--cpus", type="int", default=1, help="commands processed concurrently per device")
+    parser.add_option("--recordings", help="JSON file: {command: output} (see switch_sim.py)")
+    parser.add_option("--http-port", type="int", default=18080)
+    parser.add_option("--pool-sessions", type="int", default=2, help="netl2server [switch_pool] max_sessions")
+    parser.add_option("--log-level", default="warn", help="netl2server [logger] level")
+    opts, args = parser.parse_args(argv)
+    transports = [t.strip() for t in opts.transports.split(",") if t.strip()]
+    if opts.op not in HTTP_PATHS and "http" in transports:
+        parser.error("--op %s has no netl2server endpoint" % opts.op)
+    logging.disable(logging.INFO)
+    cfg_dir = mkdtemp(prefix="bench_farm.")
+    # pty sessions: one process per session; a lock file per device emulates its single CPU
+    os.environ["SWITCH_SIM_ARGS"] = json.dumps(["--dialect", opts.dialect, "--cpu-lock",
+                                                os.path.join(cfg_dir, "%(host)s.cpu")] + sim_options(opts))
+    farm, endpoints = start_farm(opts, ssh=opts.ssh)
+    host    = endpoints["host"]
+    devices = sorted(endpoints["telnet"].keys())
+    print "devices: %s (%s); op: %s; concurrency: %s; latency: %s+/-%s ms; cpus/device: %s" % \
+                (opts.devices, opts.dialect, opts.op, opts.concurrency, opts.latency, opts.jitter, opts.cpus)
+    print "%-14s %7s %7s %8s %9s %9s %9s" % ("transport", "ops", "errors", "wall(s)", "ops/s", "p50(ms)", "p99(ms)")
+    try:
+        for transport in transports:
+            if transport == "sysssh":
+                if endpoints["ssh"]:
+                    report("sysssh", *bench_transport(SysSSH, dict((d, (host, p)) for d, p in endpoints["ssh"].items()), opts))
+                else:
+                    report("sysssh(pty)", *bench_transport(SimSysSSH, dict((d, (d, 22)) for d in devices), opts))
+            elif transport == "pyssh":
+                try:
+                    from netl2api.l2api.transport.PySSHTransport import PySSH
+                except ImportError, e:
+                    print "%-14s skipped (%s)" % ("pyssh", e)
+                    continue
+                if not endpoints["ssh"]:
+                    print "%-14s skipped (no ssh endpoint: --ssh)" % "pyssh"
+                    continue
+                report("pyssh", *bench_transport(PySSH, dict((d, (host, p)) for d, p in endpoints["ssh"].items()), opts))
+            elif transport == "telnet":
+                report("telnet", *bench_transport(Telnet, dict((d, (host, p)) for d, p in endpoints["telnet"].items()), opts))
+            elif transport == "http":
+                if endpoints["ssh"]:
+                    http_devices = dict((d, ("bench_farm.SysSSH%s" % VENDORS[opts.dialect].__name__, host, p)) \
+                                            for d, p in endpoints["ssh"].items())
+                    name = "http"
+                else:
+                    http_devices = dict((d, ("bench_farm.SimSysSSH%s" % VENDORS[opts.dialect].__name__, d, 22)) \
+                                            for d in devices)
+                    name = "http(pty)"
+                report(name, *bench_http(http_devices, opts, cfg_dir))
+            else:
+                print "%-14s unknown transport" % transport
+    finally:
+        farm.stdin.close()
+        farm.wait()
+        rmtree(cfg_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# cisco_like_runcfg_parser() benchmark: keyword dispatch vs. the previous regex chain
+# (tests/test_runcfg_parser.py) over large "show running-config interface" outputs
+# of the switch simulator, or over captured running configs given as arguments.
+#
+# Usage: python tests/bench_runcfg_parser.py [runcfg_file ...]
+
+
+import sys
+import timeit
+import switch_sim
+from netl2api.l2api.utils import cisco_like_runcfg_parser
+from test_runcfg_parser import legacy_cisco_like_runcfg_parser
+
+
+# (label, dialect, ports, vlans, lags): stacked 48-port switches with hundreds of VLANs
+SIM_CONFIGS = [("force10 48p/100 vlans",    "force10", 48,  100,  4),
+               ("force10 6x48p/1000 vlans", "force10", 288, 1000, 16),
+               ("netiron 8x48p/1000 vlans", "netiron", 384, 1000, 0),
+               ("vdx 4x48p/1000 vlans",     "vdx",     192, 1000, 0)]
+
+
+def runcfgs(files=None):
+    for path in files or []:
+        with open(path) as runcfg_file:
+            yield path, runcfg_file.read()
+    if files:
+        return
+    for label, dialect, ports, vlans, lags in SIM_CONFIGS:
+        outputs = switch_sim.builtin_outputs(dialect=dialect, ports=ports, vlans=vlans, lags=lags, macs=0)
+        yield label, outputs.get("show running-config interface", outputs.get("show running-config"))
+
+
+def bench(files=None, repeat=5):
+    print "%-28s %8s %12s %12s %8s" % ("", "lines", "before (ms)", "after (ms)", "speedup")
+    for label, runcfg in runcfgs(files):
+        assert cisco_like_runcfg_parser(runcfg) == legacy_cisco_like_runcfg_parser(runcfg), label
+        number  = max(1, 20000 / len(runcfg.splitlines()))
+        results = []
+        for parser in (legacy_cisco_like_runcfg_parser, cisco_like_runcfg_parser):
+            t = min(timeit.Timer(lambda: parser(runcfg)).repeat(repeat, number))
+            results.append(t / number * 1000)
+        print "%-28s %8s %12.3f %12.3f %7.1fx" % (label[-28:], len(runcfg.splitlines()), results[0], results[1],
+                                                   results[0] / results[1])
+
+
+if __name__ == "__main__":
+    bench(files=sys.argv[1:])
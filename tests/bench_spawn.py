@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# ssh child spawn latency: SystemSSH.open_session() until the child replies, with
+#  - the old fd close loop (os.close() on every fd up to RLIMIT_NOFILE)
+#  - the current close_fds() (only the open fds)
+#  - the spawn-helper process (the benchmark process itself does not fork)
+# 'ballast_mb' grows the address space of the benchmark process (forking a big daemon is slower).
+#
+# Usage: python tests/bench_spawn.py [iterations] [ballast_mb]
+
+
+import os
+import sys
+import time
+import resource
+from netl2api.l2api.transport.SystemSSH import SystemSSH
+from netl2api.l2api.transport import SpawnHelper
+
+
+class FakeSystemSSH(SystemSSH):
+    def __init__(self, *args, **kwargs):
+        super(FakeSystemSSH, self).__init__(*args, **kwargs)
+        self._ssh_cmd = ["/bin/sh", "-c", "echo ready; exec cat"]
+
+    def _ssh_auth(self):
+        buff = ""
+        while "ready" not in buff:
+            buff += self.recv()
+
+
+class LegacyFakeSystemSSH(FakeSystemSSH):
+    @staticmethod
+    def _close_fds():
+        # previous implementation
+        max_fd = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        for fd in xrange(3, max_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def spawn_latency(ssh_class, iterations):
+    samples = []
+    for i in xrange(iterations):
+        ssh = ssh_class(host="fake-switch", username="bench", passwd="bench")
+        t0  = time.time()
+        ssh.open_session()
+        samples.append(time.time() - t0)
+        ssh.close()
+    samples.sort()
+    return samples
+
+
+def bench(iterations=20, ballast_mb=0):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    # the helper is forked first, like netl2server does at start-up
+    helper = SpawnHelper.start_spawn_helper()
+    SpawnHelper._spawn_helper = None
+    ballast = bytearray(ballast_mb * 1024 * 1024)
+    print "RLIMIT_NOFILE: %s; ballast: %s MB; %s spawns" \
+            % (resource.getrlimit(resource.RLIMIT_NOFILE)[0], ballast_mb, iterations)
+    results = [("old close loop", spawn_latency(LegacyFakeSystemSSH, iterations)),
+               ("close_fds()", spawn_latency(FakeSystemSSH, iterations))]
+    SpawnHelper._spawn_helper = helper
+    try:
+        results.append(("spawn-helper", spawn_latency(FakeSystemSSH, iterations)))
+    finally:
+        SpawnHelper.stop_spawn_helper()
+    for name, samples in results:
+        print "%-16s median: %8.2f ms  max: %8.2f ms" \
+                % (name, samples[len(samples) / 2] * 1000, samples[-1] * 1000)
+    del ballast
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    ballast_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    bench(iterations=iterations, ballast_mb=ballast_mb)
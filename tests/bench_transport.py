@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# Transport (SysSSH) latency microbenchmark.
+# Instead of a real switch, a fake CLI (python script) is spawned on a pty by SystemSSH.
+#
+# 'rtt_ms' simulates the network round trip (paid once per command, or once per execute_many() batch).
+#
+# Usage: python tests/bench_transport.py [iterations] [output_lines] [rtt_ms]
+
+
+import sys
+import time
+import logging
+import resource
+from netl2api.l2api.transport.SystemSSH import SystemSSH
+from netl2api.l2api.transport.SysSSHTransport import SysSSH
+
+
+FAKE_CLI = r"""
+import os
+import sys
+import time
+import termios
+# keep CRLF-terminated commands as a single line and echo them from the CLI itself
+# (like a switch CLI does); raw reads, so pipelined commands arrive together
+attrs = termios.tcgetattr(0)
+attrs[0] &= ~termios.ICRNL
+attrs[3] &= ~(termios.ECHO | termios.ICANON)
+attrs[6][termios.VMIN]  = 1
+attrs[6][termios.VTIME] = 0
+termios.tcsetattr(0, termios.TCSANOW, attrs)
+rtt     = float(sys.argv[1]) / 1000
+pending = [""]
+def read_lines():
+    data = os.read(0, 4096)
+    if not data:
+        return None
+    # simulated network round trip (once per received packet)
+    time.sleep(rtt)
+    lines      = (pending[0] + data).split("\n")
+    pending[0] = lines.pop()
+    return [l.strip() for l in lines]
+w = sys.stdout.write
+w("Password: ")
+sys.stdout.flush()
+while not read_lines():
+    pass
+w("\nfake-switch# ")
+sys.stdout.flush()
+while True:
+    lines = read_lines()
+    if lines is None:
+        break
+    for cmd in lines:
+        if cmd == "exit":
+            sys.exit(0)
+        w("%s\n" % cmd)
+        n = int(cmd.split()[-1]) if cmd.startswith("show lines") else 0
+        for i in xrange(n):
+            # switches stream the output (one write per line)
+            w("TenGigabitEthernet 0/%d is up, line protocol is up\n" % i)
+            sys.stdout.flush()
+        w("fake-switch# ")
+        sys.stdout.flush()
+"""
+
+
+class FakeSystemSSH(SystemSSH):
+    def __init__(self, rtt_ms=0, *args, **kwargs):
+        super(FakeSystemSSH, self).__init__(*args, **kwargs)
+        self._ssh_cmd = [sys.executable, "-c", FAKE_CLI, str(rtt_ms)]
+
+
+class FakeSysSSH(SysSSH):
+    rtt_ms = 0
+
+    def _setup_connection(self):
+        ssh = FakeSystemSSH(rtt_ms=self.rtt_ms, host=self.host, port=self.port, username=self.username, passwd=self.passwd)
+        ssh.open_session()
+        return ssh
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def bench(iterations=50, output_lines=30, rtt_ms=0, stream_lines=100000):
+    FakeSysSSH.rtt_ms = rtt_ms
+    transport = FakeSysSSH(host="fake-switch", username="bench", passwd="bench", prompt_mark="#",
+                           transaction_timeout=10)
+    transport._logger.setLevel(logging.WARNING)
+    t0 = time.time()
+    transport.connection
+    t_login = time.time() - t0
+    cmd     = "show lines %s" % output_lines
+    samples = []
+    try:
+        for i in xrange(iterations):
+            t0     = time.time()
+            cmdout = transport.execute(cmd)
+            samples.append(time.time() - t0)
+            assert len(cmdout.splitlines()) == output_lines, "unexpected output: %r" % cmdout
+        # Force10.show_system()-like batch: sequential execute() vs. pipelined execute_many()
+        # (alternated, median of 'iterations' rounds)
+        cmds       = ["show lines %s" % (output_lines + i) for i in xrange(6)]
+        sequential = []
+        pipelined  = []
+        for i in xrange(iterations):
+            t0 = time.time()
+            for c in cmds:
+                transport.execute(c)
+            sequential.append(time.time() - t0)
+            t0      = time.time()
+            cmdouts = transport.execute_many(cmds)
+            pipelined.append(time.time() - t0)
+            assert [len(o.splitlines()) for o in cmdouts] == [output_lines + i for i in xrange(6)], \
+                        "unexpected output: %r" % cmdouts
+        sequential.sort()
+        pipelined.sort()
+        t_sequential = sequential[len(sequential) / 2]
+        t_pipelined  = pipelined[len(pipelined) / 2]
+        # huge output (eg. 'show mac-address-table'): execute_stream() first (ru_maxrss never decreases)
+        cmd      = "show lines %s" % stream_lines
+        rss_base = max_rss_mb()
+        t0       = time.time()
+        count    = 0
+        for line in transport.execute_stream(cmd):
+            count += 1
+        t_stream   = time.time() - t0
+        rss_stream = max_rss_mb()
+        assert count == stream_lines, "unexpected output: %s lines" % count
+        t0      = time.time()
+        count   = len(transport.execute(cmd).splitlines())
+        t_execute   = time.time() - t0
+        rss_execute = max_rss_mb()
+        assert count == stream_lines, "unexpected output: %s lines" % count
+    finally:
+        transport.close()
+    samples.sort()
+    print "login:            %8.2f ms" % (t_login * 1000)
+    print "execute (%s lines, %s runs):" % (output_lines, iterations)
+    print "  min:            %8.2f ms" % (samples[0] * 1000)
+    print "  median:         %8.2f ms" % (samples[len(samples) / 2] * 1000)
+    print "  max:            %8.2f ms" % (samples[-1] * 1000)
+    print "  total:          %8.2f ms" % (sum(samples) * 1000)
+    print "6 commands (rtt: %s ms; median of %s runs):" % (rtt_ms, iterations)
+    print "  execute():      %8.2f ms" % (t_sequential * 1000)
+    print "  execute_many(): %8.2f ms" % (t_pipelined * 1000)
+    print "%s output lines (time; peak RSS growth):" % stream_lines
+    print "  execute_stream(): %8.2f ms; %6.1f MB" % (t_stream * 1000, rss_stream - rss_base)
+    print "  execute():        %8.2f ms; %6.1f MB" % (t_execute * 1000, rss_execute - rss_stream)
+
+
+if __name__ == "__main__":
+    iterations   = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    output_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    rtt_ms       = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+    bench(iterations=iterations, output_lines=output_lines, rtt_ms=rtt_ms)
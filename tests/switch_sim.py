@@ -0,0 +1,678 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# Simulated switch farm: CLI stand-ins for the Force10, Flex10, VDX and NetIron drivers.
+#
+# Each simulated device has a prompt, a configure mode (+ sub-modes matching the drivers'
+# interactions), 'terminal length 0', error marks and recorded command outputs (built-in ones,
+# generated for the read paths of the drivers, and/or a JSON file of {command: output}).
+# Every command costs 'latency' (+/- 'jitter') ms of device CPU; a device has 'cpus' slots,
+# so concurrent sessions on the same device queue up (device-CPU contention).
+#
+# Endpoints:
+#  - pty:    the CLI on stdin/stdout (spawned by SystemSSH instead of 'ssh', see bench_farm.py)
+#  - telnet: one TCP port per device (TelnetTransport)
+#  - ssh:    one TCP port per device (SysSSH/PySSH) -- needs the 'ssh' (or 'paramiko') module
+#
+# Usage: python tests/switch_sim.py pty --dialect force10 --hostname sw0001 [options]
+#        python tests/switch_sim.py farm --devices 10 --telnet-port 2300 [--ssh-port 2200] [options]
+#        python tests/switch_sim.py --help
+
+
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import random
+import socket
+import termios
+import optparse
+import threading
+import SocketServer
+
+
+__all__ = ["DIALECTS", "builtin_outputs", "SimulatedDevice", "SimulatedCLI", "SwitchFarm"]
+
+
+CRLF = "\r\n"
+
+
+# prompt: exec-mode prompt; config_cmds: commands entering the configure mode (config_mode);
+# submodes: (command REGEXP, sub-mode) -- sub-mode formatted with the REGEXP groups
+DIALECTS = {
+    "force10": { "prompt":       "%(hostname)s#",
+                 "mode_prompt":  "%(hostname)s(%(mode)s)#",
+                 "config_cmds":  ("configure", "configure terminal"),
+                 "config_mode":  "conf",
+                 "submodes":     [(r"^interface\s+vlan\s+(\d+)$",                   "conf-if-vl-%s"),
+                                  (r"^interface\s+port-channel\s+(\d+)$",           "conf-if-po-%s"),
+                                  (r"^interface\s+([a-zA-Z]{2})[a-zA-Z]*\s+(\d+/\d+)$", "conf-if-%s-%s")],
+                 "error":        "%% Error: Invalid input at \"^\" marker.",
+                 "confirms":     { "copy running-config startup-config": \
+                                        ("File with same name already exist." + CRLF + \
+                                         "Proceed to copy the file [confirm yes/no]: ", "!" + CRLF + \
+                                         "1234 bytes successfully copied") } },
+    "netiron": { "prompt":       "SSH@%(hostname)s#",
+                 "mode_prompt":  "SSH@%(hostname)s(%(mode)s)#",
+                 "config_cmds":  ("configure terminal", "conf t"),
+                 "config_mode":  "config",
+                 "submodes":     [(r"^vlan\s+(\d+)(?:\s.*)?$",                      "config-vlan-%s"),
+                                  (r"^lag\s+\S+.*?\sid\s+(\d+)$",                   "config-lag-%s"),
+                                  (r"^lag\s+\"?(\d+)\"?$",                          "config-lag-%s"),
+                                  (r"^interface\s+ethernet\s+(\d+/\d+)$",           "config-if-e10000-%s")],
+                 "error":        "Invalid input -> %(cmd)s",
+                 "confirms":     {} },
+    "vdx":     { "prompt":       "%(hostname)s#",
+                 "mode_prompt":  "%(hostname)s(%(mode)s)#",
+                 "config_cmds":  ("configure terminal", "configure"),
+                 "config_mode":  "config",
+                 "submodes":     [(r"^interface\s+vlan\s+(\d+)$",                   "config-Vlan-%s"),
+                                  (r"^interface\s+po\s+(\d+)$",                     "config-Port-channel-%s"),
+                                  (r"^interface\s+([a-zA-Z]{2})[a-zA-Z]*\s+(\d+/\d+/\d+)$", "conf-if-%s-%s")],
+                 "error":        "syntax error: unknown argument.",
+                 "confirms":     { "copy running-config startup-config": \
+                                        ("This operation will modify your startup configuration. " + \
+                                         "Do you want to continue? [y/n]:", "") } },
+    "flex10":  { "prompt":       "->",
+                 "mode_prompt":  "->",
+                 "config_cmds":  (),
+                 "config_mode":  None,
+                 "submodes":     [],
+                 "error":        "ERROR: Invalid command -- %(cmd)s",
+                 "confirms":     {} },
+}
+
+
+def builtin_outputs(dialect="force10", hostname="sw0001", ports=48, vlans=100, lags=4, macs=1000):
+    """
+    Recorded outputs ({command: output}) for the read paths of the 'dialect' driver, sized by
+    'ports', 'vlans', 'lags' and 'macs' (Force10: show_version/hostname/interfaces/vlans/lags/arp;
+    the other dialects: show_version, show_hostname and dump_config).
+    """
+    outputs = {}
+    if dialect == "force10":
+        outputs["show version"] = CRLF.join([
+            "Dell Force10 Real Time Operating System Software",
+            "Dell Force10 Operating System Version: 1.0",
+            "Dell Force10 Application Software Version: 8.3.12.1",
+            "Copyright (c) 1999-2012 by Dell Inc. All Rights Reserved.",
+            "Build Time: Thu Oct 25 02:20:59 PDT 2012",
+            "Build Path: /sites/sjc/work/build/buildSpaces/build05/E8-3-12/SW/SRC",
+            "%s uptime is 10 week(s), 3 day(s), 2 hour(s), 1 minute(s)" % hostname,
+            "",
+            "System image file is \"system://A\"",
+            "",
+            "System Type: S4810 ",
+            "Control Processor: Freescale QorIQ P2020 with 2147483648 bytes of memory.",
+            "",
+            "128M bytes of boot flash memory.",
+            "",
+            "  1 52-port GE/TE/FG (SE)",
+            "  48 Ten GigabitEthernet/IEEE 802.3 interface(s)"])
+        outputs["show running-config | grep hostname"] = "hostname %s" % hostname
+        status   = ["Port     Description  Status Speed     Duplex Vlan"]
+        brief    = ["Interface                  IP-Address      OK? Method Status                Protocol"]
+        runcfg   = []
+        lag_size = max(ports / 8 / max(lags, 1), 1) if lags else 0
+        for port in xrange(ports):
+            ifname = "TenGigabitEthernet 0/%d" % port
+            status.append("Te 0/%-4d server-%-5d Up     10000 Mbit Full   --" % (port, port))
+            ifcfg  = ["!", "interface %s" % ifname, " description server-%d" % port, " no ip address",
+                      " mtu 9252", " switchport"]
+            if port < lags * lag_size:
+                ifcfg  = ["!", "interface %s" % ifname, " description lag-member-%d" % port, " no ip address",
+                          " mtu 9252", " port-channel-protocol LACP", "  port-channel %d mode active" % (port / lag_size + 1)]
+            ifcfg.append(" no shutdown")
+            runcfg.extend(ifcfg)
+            outputs["show ip interface brief | grep Gig | grep \"0/%d\"" % port] = \
+                    "%-26s unassigned      NO  Manual up                    up" % ifname
+            brief.append(outputs["show ip interface brief | grep Gig | grep \"0/%d\"" % port])
+            outputs["show running-config interface te 0/%d" % port] = CRLF.join(ifcfg)
+        for lag in xrange(1, lags + 1):
+            runcfg.extend(["!", "interface Port-channel %d" % lag, " description uplink-%d" % lag,
+                           " no ip address", " mtu 9252", " switchport", " no shutdown"])
+            outputs["show ip interface brief port-channel %d" % lag] = \
+                    "Port-channel %-13d unassigned      NO  Manual up                    up" % lag
+            brief.append(outputs["show ip interface brief port-channel %d" % lag])
+        vlancfg = []
+        for vlan in xrange(2, vlans + 2):
+            cfg = ["!", "interface Vlan %d" % vlan, " description vlan-%d" % vlan, " no ip address",
+                   " tagged TenGigabitEthernet 0/%d-%d" % (vlan % ports, min(vlan % ports + 3, ports - 1))]
+            if lags:
+                cfg.append(" tagged Port-channel %d" % (vlan % lags + 1))
+            cfg.append(" no shutdown")
+            vlancfg.extend(cfg)
+            outputs["show running-config interface vlan %d" % vlan] = CRLF.join(cfg)
+            outputs["show ip interface brief vlan %d" % vlan] = \
+                    "Vlan %-21d unassigned      NO  Manual up                    up" % vlan
+            brief.append(outputs["show ip interface brief vlan %d" % vlan])
+        outputs["show ip interface brief"]            = CRLF.join(brief)
+        outputs["show interfaces status"]             = CRLF.join(status)
+        outputs["show running-config interface"]      = CRLF.join(runcfg + vlancfg)
+        outputs["show running-config interface vlan"] = CRLF.join(vlancfg)
+        mac_table = ["VlanId\tMac Address\tType\tInterface\tState"]
+        for i in xrange(macs):
+            mac_table.append("%d\t00:1e:c9:%02x:%02x:%02x\tDynamic\tTe 0/%d\tActive" % \
+                                (i % vlans + 2, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff, i % ports))
+        outputs["show mac-address-table"] = CRLF.join(mac_table)
+        outputs["show running"] = CRLF.join(["Current Configuration ...", "! Version 8.3.12.1", "!",
+                                             "hostname %s" % hostname] + runcfg + vlancfg + ["!", "end"])
+    elif dialect == "netiron":
+        outputs["show running-config | include hostname"] = "hostname %s" % hostname
+        outputs["show version"] = CRLF.join([
+            "System: NetIron CER (Serial #: K43012345, Part #: 40-1000372-03)",
+            "License: RT_SCALE, ADV_SVCS_PREM (LID: mnsHJKLmFHH)",
+            "(System Mode: MPLS)",
+            "  SW: Version 5.6.0T183 Copyright (c) 1996-2013 Brocade Communications Systems, Inc.",
+            "      Compiled on Oct 22 2013 at 18:52:08 labeled as ceb05600",
+            "System uptime is 10 days 2 hours 1 minutes 32 seconds"])
+        runcfg = ["!", "hostname %s" % hostname]
+        brief  = ["Port    Link    State   Dupl Speed Trunk Tag Pvid Pri MAC             Name"]
+        for port in xrange(ports):
+            runcfg.extend(["!", "interface ethernet 1/%d" % (port + 1), " port-name server-%d" % port, " enable"])
+            brief.append("1/%-5d Up      Forward Full 10G   None  Yes N/A  0   0024.38a1.b2%02x  server-%d" \
+                            % (port + 1, port % 256, port))
+        outputs["show interfaces brief"] = CRLF.join(brief)
+        for vlan in xrange(2, vlans + 2):
+            runcfg.extend(["!", "vlan %d name vlan-%d" % (vlan, vlan), " tagged ethe 1/%d" % (vlan % ports + 1)])
+        outputs["show running-config"] = CRLF.join(runcfg + ["!", "end"])
+    elif dialect == "vdx":
+        outputs["show system | include \"Unit Name\""] = "Unit Name                       : %s" % hostname
+        outputs["show version"] = CRLF.join([
+            "Network Operating System Software",
+            "Network Operating System Version: 4.0.1",
+            "Copyright (c) 1995-2014 Brocade Communications Systems, Inc.",
+            "Firmware name:      4.0.1",
+            "Build Time:         02:25:04 Jun  4, 2014",
+            "Install Time:       00:30:07 Nov  1, 2014",
+            "Kernel:             2.6.34.6",
+            "BootProm:           2.3.0",
+            "Control Processor: e500mc with 2048 MB of memory"])
+        outputs["show system"] = CRLF.join([
+            "Stack MAC                       : 00:05:33:E5:CC:52",
+            "-- UNIT 0 --",
+            "Unit Name                       : %s" % hostname,
+            "Switch Status                   : Online",
+            "Hardware Rev                    : 1.1",
+            "TengigabitEthernet Port(s)      : %d" % ports,
+            "Up Time                         : up 10 days  2:01",
+            "Current Time                    : 12:00:00 GMT",
+            "NOS Version                     : 4.0.1",
+            "Jumbo Capable                   : yes",
+            "Burned In MAC                   : 00:05:33:E5:CC:52",
+            "Management IP                   : 10.0.0.1",
+            "Management Port Status          : UP"])
+        runcfg = ["!", "switch-attributes host-name %s" % hostname]
+        brief  = ["Interface                  IP-Address      Status                Protocol"]
+        for port in xrange(ports):
+            runcfg.extend(["!", "interface TenGigabitEthernet 1/0/%d" % (port + 1),
+                           " description server-%d" % port, " no shutdown"])
+            brief.append("TenGigabitEthernet 1/0/%-3d unassigned      up                    up" % (port + 1))
+        outputs["show ip interface brief"] = CRLF.join(brief)
+        for vlan in xrange(2, vlans + 2):
+            runcfg.extend(["!", "interface Vlan %d" % vlan, " description vlan-%d" % vlan])
+        outputs["show running-config"] = CRLF.join(runcfg)
+    elif dialect == "flex10":
+        outputs["show version"] = CRLF.join([
+            "HP Virtual Connect Management CLI v4.10",
+            "Build: 4.10-25 (r306125) Dec 16 2013 10:43:26",
+            "(C) Copyright 2006-2013 Hewlett-Packard Development Company, L.P.",
+            "All Rights Reserved"])
+        config = ["Generating configuration...", "#Enclosure Setup:", "set enclosure Name=\"%s\"" % hostname]
+        for vlan in xrange(2, vlans + 2):
+            config.append("add network vlan-%d VLanID=%d" % (vlan, vlan))
+        for port in xrange(ports):
+            config.append("add server-port-map enc0:1:%d vlan-%d" % (port + 1, port % vlans + 2))
+        config.append("SUCCESS: configuration generated")
+        outputs["show config"] = CRLF.join(config)
+    else:
+        raise ValueError("Unknown dialect => '%s'" % dialect)
+    return outputs
+
+
+class FileLockSemaphore(object):
+    """
+    Device-CPU slot shared by several processes (one per pty session): flock() on 'path' (1 slot)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd  = None
+
+    def acquire(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def release(self):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class SimulatedDevice(object):
+    """
+        Shared state of a simulated switch (every session of the device shares its CPU slots).
+
+        :latency: Service time of every command (ms); 'cmd_latency' overrides it by command prefix.
+            - type: float.
+            - ex: 20
+
+        :cmd_latency: Per-command latency (ms), longest matching command prefix wins.
+            - type: dict.
+            - ex: {"show running": 300, "show mac-address-table": 500}
+
+        :jitter: Uniform jitter (+/- ms) added to the latency.
+            - type: float.
+            - ex: 5
+
+        :cpus: Commands processed concurrently by the device (extra sessions wait: CPU contention).
+            - type: int or a semaphore-like object (acquire()/release(); eg. FileLockSemaphore).
+            - ex: 1
+    """
+
+    def __init__(self, dialect="force10", hostname="sw0001", username="admin", passwd="admin",
+                 outputs=None, latency=0, cmd_latency=None, jitter=0, cpus=1):
+        if not DIALECTS.has_key(dialect):
+            raise ValueError("Unknown dialect => '%s'" % dialect)
+        self.dialect     = dialect
+        self.hostname    = hostname
+        self.username    = username
+        self.passwd      = passwd
+        self.outputs     = outputs if outputs is not None else builtin_outputs(dialect=dialect, hostname=hostname)
+        self.latency     = latency
+        self.cmd_latency = sorted((cmd_latency or {}).items(), key=lambda i: len(i[0]), reverse=True)
+        self.jitter      = jitter
+        self.cpu         = threading.Semaphore(cpus) if type(cpus) is int else cpus
+        self.commands    = 0
+
+    def service_time(self, cmd):
+        latency = self.latency
+        for prefix, cmd_latency in self.cmd_latency:
+            if cmd.startswith(prefix):
+                latency = cmd_latency
+                break
+        if self.jitter:
+            latency += random.uniform(-self.jitter, self.jitter)
+        return max(latency, 0) / 1000.0
+
+    def run(self, cmd):
+        """
+        Busy the device CPU for the service time of 'cmd'
+        """
+        service_time = self.service_time(cmd)
+        self.cpu.acquire()
+        try:
+            self.commands += 1
+            if service_time:
+                time.sleep(service_time)
+        finally:
+            self.cpu.release()
+
+
+class SimulatedCLI(object):
+    """
+        One CLI session of a SimulatedDevice, on top of read()/write() callables
+        (pty, telnet socket or ssh channel). read() returns "" on EOF.
+    """
+
+    def __init__(self, device=None, read=None, write=None):
+        self.device  = device
+        self.dialect = DIALECTS[device.dialect]
+        self.read    = read
+        self.write   = write
+        self.modes   = []
+        self._pending = ""
+        self._cr      = False
+        self._submodes = [(re.compile(cmd_re, re.IGNORECASE), mode) for cmd_re, mode in self.dialect["submodes"]]
+
+    def prompt(self):
+        if self.modes:
+            return self.dialect["mode_prompt"] % {"hostname": self.device.hostname, "mode": self.modes[-1]}
+        return self.dialect["prompt"] % {"hostname": self.device.hostname}
+
+    def readline(self):
+        while "\n" not in self._pending:
+            data = self.read()
+            if not data:
+                return None
+            # CRLF, CR-NUL (telnet) and LF line endings -- a CRLF may be split across reads
+            if self._cr and data[:1] in ("\n", "\x00"):
+                data = data[1:]
+            self._cr       = data.endswith("\r")
+            self._pending += data.replace("\r\n", "\n").replace("\r\x00", "\n").replace("\r", "\n")
+        line, self._pending = self._pending.split("\n", 1)
+        return line
+
+    def login(self, ask_username=False):
+        """
+        Username/password prompts (telnet-like 'ask_username' or ssh-like password only)
+        """
+        if ask_username:
+            self.write("Login: ")
+            username = self.readline()
+            if username is None:
+                return False
+        else:
+            username = self.device.username
+        self.write("Password: ")
+        passwd = self.readline()
+        if passwd is None:
+            return False
+        if (username.strip(), passwd.strip()) != (self.device.username, self.device.passwd):
+            self.write(CRLF + "Access denied" + CRLF)
+            return False
+        return True
+
+    def motd(self):
+        self.write(CRLF + "Simulated %s switch -- %s" % (self.device.dialect, self.device.hostname) + CRLF + \
+                   CRLF + self.prompt())
+
+    def run(self):
+        while True:
+            cmd = self.readline()
+            if cmd is None:
+                return
+            cmd = cmd.strip()
+            # command echo (the drivers split the output after it)
+            self.write(cmd + CRLF)
+            if cmd in ("exit", "logout", "quit") and not self.modes:
+                return
+            output = self.handle(cmd)
+            if output:
+                self.write_output(output)
+            self.write(self.prompt())
+
+    def write_output(self, output):
+        # streamed (like a switch), in ~8KB pieces
+        pos = 0
+        while pos < len(output):
+            self.write(output[pos:pos + 8192])
+            pos += 8192
+        self.write(CRLF)
+
+    def handle(self, cmd):
+        if not cmd:
+            return
+        self.device.run(cmd)
+        if self.modes:
+            return self._handle_config(cmd)
+        if cmd in self.dialect["config_cmds"]:
+            self.modes.append(self.dialect["config_mode"])
+            return
+        if cmd.startswith("terminal length"):
+            return
+        if self.dialect["confirms"].has_key(cmd):
+            question, done = self.dialect["confirms"][cmd]
+            self.write(question)
+            answer = self.readline()
+            self.write((answer or "").strip() + CRLF)
+            return done
+        if self.device.outputs.has_key(cmd):
+            return self.device.outputs[cmd]
+        return self.dialect["error"] % {"cmd": cmd}
+
+    def _handle_config(self, cmd):
+        if cmd == "end":
+            self.modes = []
+            return
+        if cmd == "exit":
+            self.modes.pop()
+            return
+        for cmd_re, mode in self._submodes:
+            m = cmd_re.search(cmd)
+            if m:
+                self.modes = self.modes[:1] + [mode % m.groups()]
+                return
+        # configuration commands are accepted silently
+
+
+def serve_pty(device):
+    """
+    CLI on stdin/stdout (pty allocated by SystemSSH): password prompt, then the CLI
+    """
+    attrs = termios.tcgetattr(0)
+    attrs[0] &= ~(termios.ICRNL | termios.INLCR | termios.IGNCR)
+    attrs[1] &= ~termios.OPOST
+    attrs[3] &= ~(termios.ECHO | termios.ICANON)
+    attrs[6][termios.VMIN]  = 1
+    attrs[6][termios.VTIME] = 0
+    termios.tcsetattr(0, termios.TCSANOW, attrs)
+    def write(data):
+        while data:
+            data = data[os.write(1, data):]
+    cli = SimulatedCLI(device=device, read=lambda: os.read(0, 4096), write=write)
+    if cli.login(ask_username=False):
+        cli.motd()
+        cli.run()
+
+
+class _TelnetHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        cli = SimulatedCLI(device=self.server.device, read=lambda: self.request.recv(4096),
+                           write=self.request.sendall)
+        try:
+            if cli.login(ask_username=True):
+                cli.motd()
+                cli.run()
+        except socket.error:
+            pass
+
+
+class _ThreadingTCPServer(SocketServer.ThreadingTCPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+    request_queue_size  = 128
+
+
+def _ssh_module():
+    try:
+        import ssh
+    except ImportError:
+        try:
+            import paramiko as ssh
+        except ImportError:
+            return None
+    return ssh
+
+
+def _ssh_server(device, host_key):
+    ssh = _ssh_module()
+
+    class SSHServer(ssh.ServerInterface):
+        def check_auth_password(self, username, password):
+            if (username, password) == (device.username, device.passwd):
+                return ssh.AUTH_SUCCESSFUL
+            return ssh.AUTH_FAILED
+
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_channel_request(self, kind, chanid):
+            if kind == "session":
+                return ssh.OPEN_SUCCEEDED
+            return ssh.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_pty_request(self, *args):
+            return True
+
+        def check_channel_shell_request(self, channel):
+            return True
+
+    class SSHHandler(SocketServer.BaseRequestHandler):
+        def handle(self):
+            transport = ssh.Transport(self.request)
+            transport.add_server_key(host_key)
+            try:
+                transport.start_server(server=SSHServer())
+                channel = transport.accept(30)
+                if channel is None:
+                    return
+                cli = SimulatedCLI(device=device, read=lambda: channel.recv(4096), write=channel.sendall)
+                # switches ask for the password on the keyboard-interactive/password auth only:
+                # SystemSSH waits for a prompt after it, so the session starts with the motd
+                cli.motd()
+                cli.run()
+                channel.close()
+            except (socket.error, EOFError, ssh.SSHException):
+                pass
+            finally:
+                transport.close()
+
+    return SSHHandler
+
+
+class SwitchFarm(object):
+    """
+        N simulated devices served by this process: a telnet and/or ssh TCP port per device.
+
+        :devices: Number of devices (hostnames: '<prefix>0001'...).
+            - type: int.
+            - ex: 10
+
+        :telnet_port: First telnet port (devices use consecutive ports; 0: ephemeral ports; None: no telnet).
+            - type: int.
+            - ex: 2300
+
+        :ssh_port: First ssh port (same as 'telnet_port'; needs the 'ssh' or 'paramiko' module).
+            - type: int.
+            - ex: 2200
+
+        The other parameters are passed to SimulatedDevice (and builtin_outputs()).
+    """
+
+    def __init__(self, devices=1, dialect="force10", prefix="simsw", host="127.0.0.1", telnet_port=0, ssh_port=None,
+                 username="admin", passwd="admin", recordings=None, latency=0, cmd_latency=None, jitter=0, cpus=1,
+                 ports=48, vlans=100, lags=4, macs=1000):
+        self.host    = host
+        self.devices = []
+        self.servers = []
+        self.telnet_ports = {}
+        self.ssh_ports    = {}
+        if ssh_port is not None and _ssh_module() is None:
+            raise RuntimeError("The ssh endpoint needs the 'ssh' (or 'paramiko') module")
+        host_key = _ssh_module().RSAKey.generate(2048) if ssh_port is not None else None
+        for i in xrange(devices):
+            hostname = "%s%04d" % (prefix, i + 1)
+            outputs  = builtin_outputs(dialect=dialect, hostname=hostname, ports=ports, vlans=vlans, lags=lags, macs=macs)
+            if recordings:
+                outputs.update(recordings)
+            device = SimulatedDevice(dialect=dialect, hostname=hostname, username=username, passwd=passwd,
+                                     outputs=outputs, latency=latency, cmd_latency=cmd_latency, jitter=jitter, cpus=cpus)
+            self.devices.append(device)
+            if telnet_port is not None:
+                server = _ThreadingTCPServer((host, telnet_port + i if telnet_port else 0), _TelnetHandler)
+                server.device = device
+                self.servers.append(server)
+                self.telnet_ports[hostname] = server.server_address[1]
+            if ssh_port is not None:
+                server = _ThreadingTCPServer((host, ssh_port + i if ssh_port else 0), _ssh_server(device, host_key))
+                self.servers.append(server)
+                self.ssh_ports[hostname] = server.server_address[1]
+
+    def start(self):
+        for server in self.servers:
+            t = threading.Thread(target=server.serve_forever)
+            t.daemon = True
+            t.start()
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+def parse_latency(option, opt_str, value, parser):
+    """ --latency 20 (every command) or --latency "show running=300" (command prefix) """
+    if "=" in value:
+        prefix, latency = value.rsplit("=", 1)
+        parser.values.cmd_latency[prefix.strip()] = float(latency)
+    else:
+        parser.values.latency = float(value)
+
+
+def option_parser():
+    parser = optparse.OptionParser(usage="%prog pty|farm [options]")
+    parser.add_option("--dialect", default="force10", choices=DIALECTS.keys())
+    parser.add_option("--hostname", default="simsw0001", help="pty: device hostname")
+    parser.add_option("--username", default="admin")
+    parser.add_option("--passwd", default="admin")
+    parser.add_option("--recordings", help="JSON file: {command: output} (added to the built-in outputs)")
+    parser.add_option("--latency", type="string", action="callback", callback=parse_latency,
+                      help="ms per command; 'CMD_PREFIX=ms' for per-command latency (repeatable)")
+    parser.add_option("--jitter", type="float", default=0, help="+/- ms")
+    parser.add_option("--cpus", type="int", default=1, help="farm: commands processed concurrently per device")
+    parser.add_option("--cpu-lock", help="pty: lock file shared by the sessions of a device (1 CPU slot)")
+    parser.add_option("--ports", type="int", default=48)
+    parser.add_option("--vlans", type="int", default=100)
+    parser.add_option("--lags", type="int", default=4)
+    parser.add_option("--macs", type="int", default=1000)
+    parser.add_option("--devices", type="int", default=1, help="farm: number of devices")
+    parser.add_option("--prefix", default="simsw", help="farm: hostname prefix")
+    parser.add_option("--host", default="127.0.0.1", help="farm: listen address")
+    parser.add_option("--telnet-port", type="int", default=0, help="farm: first telnet port (0: ephemeral)")
+    parser.add_option("--ssh-port", type="int", default=None, help="farm: first ssh port (0: ephemeral)")
+    parser.set_defaults(latency=0, cmd_latency={})
+    return parser
+
+
+def main(argv=None):
+    parser = option_parser()
+    opts, args = parser.parse_args(argv)
+    if len(args) != 1 or args[0] not in ("pty", "farm"):
+        parser.error("pty or farm expected")
+    recordings = json.load(open(opts.recordings)) if opts.recordings else None
+    if args[0] == "pty":
+        outputs = builtin_outputs(dialect=opts.dialect, hostname=opts.hostname, ports=opts.ports,
+                                  vlans=opts.vlans, lags=opts.lags, macs=opts.macs)
+        if recordings:
+            outputs.update(recordings)
+        device = SimulatedDevice(dialect=opts.dialect, hostname=opts.hostname, username=opts.username,
+                                 passwd=opts.passwd, outputs=outputs, latency=opts.latency,
+                                 cmd_latency=opts.cmd_latency, jitter=opts.jitter,
+                                 cpus=FileLockSemaphore(opts.cpu_lock) if opts.cpu_lock else opts.cpus)
+        serve_pty(device)
+        return
+    farm = SwitchFarm(devices=opts.devices, dialect=opts.dialect, prefix=opts.prefix, host=opts.host,
+                      telnet_port=opts.telnet_port, ssh_port=opts.ssh_port, username=opts.username,
+                      passwd=opts.passwd, recordings=recordings, latency=opts.latency, cmd_latency=opts.cmd_latency,
+                      jitter=opts.jitter, cpus=opts.cpus, ports=opts.ports, vlans=opts.vlans, lags=opts.lags,
+                      macs=opts.macs)
+    farm.start()
+    # endpoints (one JSON line) for the benchmark harness
+    sys.stdout.write("%s\n" % json.dumps({"host": farm.host, "telnet": farm.telnet_ports, "ssh": farm.ssh_ports}))
+    sys.stdout.flush()
+    try:
+        # until stdin is closed (harness exit) or ^C
+        while sys.stdin.read(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    farm.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# Autocache write-through test: the L2API _patch_vlans_*/_patch_lags_* patchers (VLANS_PATCH_ON,
+# LAGS_PATCH_ON) applied to the cached show_vlans()/show_lags() responses must give what the
+# device answers after the change. The device is an in-memory L2API (FakeSwitch).
+#
+# Usage: python tests/test_autocache_write_through.py
+
+
+from copy import deepcopy
+from netl2api.l2api import L2API, VLANS_PATCH_ON, LAGS_PATCH_ON
+from netl2api.l2api.autocache import configure_autocache_backend, configure_autocache_write_through
+
+
+class NullTransport(object):
+    def __init__(self, *args, **kwargs):
+        self.crlf = None
+        self.host = "sw0001"
+        self.port = 22
+
+
+class FakeSwitch(L2API):
+    """ show_vlans()/show_lags() and their mutators on in-memory state; counts the device reads """
+
+    def __init__(self, *args, **kwargs):
+        self.__VENDOR__ = "FAKE"
+        self.__HWTYPE__ = "stackable_switch"
+        super(FakeSwitch, self).__init__(*args, **kwargs)
+        self.cache_config["show_vlans"]["patch_on"] = dict(VLANS_PATCH_ON)
+        self.cache_config["show_lags"]["patch_on"]  = dict(LAGS_PATCH_ON)
+        self.reads = 0
+        self.vlans = {
+            10: {"description": "web", "enabled": True, "attached_interfaces": {"te 0/1": "tagged"},
+                 "attached_lags": {1: "tagged"}},
+            20: {"description": None, "enabled": False, "attached_interfaces": {}, "attached_lags": {}},
+        }
+        self.lags  = {
+            1: {"description": "uplink", "enabled": True, "attached_interfaces": ["te 0/10", "te 0/11"]},
+            2: {"description": None, "enabled": True, "attached_interfaces": []},
+        }
+
+    def show_vlans(self, vlan_id=None):
+        self.reads += 1
+        return deepcopy(self.vlans)
+
+    def show_lags(self, lag_id=None):
+        self.reads += 1
+        return deepcopy(self.lags)
+
+    def _cache_interface_key(self, interface_id):
+        # aliases ("TE0/1") normalized as the vendors do
+        return " ".join(interface_id.lower().replace("te", "te ").split())
+
+    def enable_vlan(self, vlan_id=None):
+        self.vlans[int(vlan_id)]["enabled"] = True
+
+    def disable_vlan(self, vlan_id=None):
+        self.vlans[int(vlan_id)]["enabled"] = False
+
+    def change_vlan_description(self, vlan_id=None, vlan_description=None):
+        self.vlans[int(vlan_id)]["description"] = vlan_description or None
+
+    def destroy_vlan(self, vlan_id=None):
+        if int(vlan_id) == 99:
+            raise KeyError("vendor error")
+        del(self.vlans[int(vlan_id)])
+
+    def interface_attach_vlan(self, interface_id=None, vlan_id=None, tagged=True):
+        self.vlans[int(vlan_id)]["attached_interfaces"][self._cache_interface_key(interface_id)] = \
+            "tagged" if tagged else "untagged"
+
+    def interface_detach_vlan(self, interface_id=None, vlan_id=None, tagged=True):
+        del(self.vlans[int(vlan_id)]["attached_interfaces"][self._cache_interface_key(interface_id)])
+
+    def lag_attach_vlan(self, lag_id=None, vlan_id=None, tagged=True):
+        self.vlans[int(vlan_id)]["attached_lags"][int(lag_id)] = "tagged" if tagged else "untagged"
+
+    def lag_detach_vlan(self, lag_id=None, vlan_id=None, tagged=True):
+        del(self.vlans[int(vlan_id)]["attached_lags"][int(lag_id)])
+
+    def enable_lag(self, lag_id=None):
+        self.lags[int(lag_id)]["enabled"] = True
+
+    def disable_lag(self, lag_id=None):
+        self.lags[int(lag_id)]["enabled"] = False
+
+    def change_lag_description(self, lag_id=None, lag_description=None):
+        self.lags[int(lag_id)]["description"] = lag_description or None
+
+    def destroy_lag(self, lag_id=None):
+        del(self.lags[int(lag_id)])
+
+    def lag_attach_interface(self, lag_id=None, interface_id=None):
+        attached = self.lags[int(lag_id)]["attached_interfaces"]
+        if self._cache_interface_key(interface_id) not in attached:
+            attached.append(self._cache_interface_key(interface_id))
+
+    def lag_detach_interface(self, lag_id=None, interface_id=None):
+        self.lags[int(lag_id)]["attached_interfaces"].remove(self._cache_interface_key(interface_id))
+
+
+def new_switch(write_through=True):
+    configure_autocache_backend("instance")
+    configure_autocache_write_through(enabled=write_through, reconcile_interval=3600)
+    return FakeSwitch(host="sw0001", username="netl2api", passwd="netl2api", transport=NullTransport)
+
+
+def assert_patched(switch, show, mutations):
+    """ each mutation is served patched (no device read) and equal to the device response """
+    getattr(switch, show)()
+    reads = switch.reads
+    for mutator, kwargs in mutations:
+        getattr(switch, mutator)(**kwargs)
+        cached = getattr(switch, show)()
+        assert switch.reads == reads, "%s(%s): %s() read from the device" % (mutator, kwargs, show)
+        device = getattr(switch, show)(use_cache=False)
+        reads  = switch.reads
+        assert cached == device, "%s(%s):\n  patched: %s\n  device:  %s" % (mutator, kwargs, cached, device)
+
+
+def test_patch_vlans():
+    assert_patched(new_switch(), "show_vlans", [
+        ("interface_attach_vlan",   {"interface_id": "te 0/2", "vlan_id": 10, "tagged": True}),
+        ("interface_attach_vlan",   {"interface_id": "TE0/3", "vlan_id": "20", "tagged": False}),
+        ("interface_detach_vlan",   {"interface_id": "Te0/1", "vlan_id": "10"}),
+        ("lag_attach_vlan",         {"lag_id": "2", "vlan_id": 20, "tagged": False}),
+        ("lag_detach_vlan",         {"lag_id": 1, "vlan_id": "10"}),
+        ("enable_vlan",             {"vlan_id": "20"}),
+        ("disable_vlan",            {"vlan_id": 10}),
+        ("change_vlan_description", {"vlan_id": 20, "vlan_description": "db"}),
+        ("change_vlan_description", {"vlan_id": 10, "vlan_description": ""}),
+        ("destroy_vlan",            {"vlan_id": "20"}),
+    ])
+
+
+def test_patch_lags():
+    assert_patched(new_switch(), "show_lags", [
+        ("lag_attach_interface",   {"lag_id": "2", "interface_id": "te 0/12"}),
+        # already a member: no duplicate
+        ("lag_attach_interface",   {"lag_id": 2, "interface_id": "TE0/12"}),
+        ("lag_detach_interface",   {"lag_id": "1", "interface_id": "Te0/10"}),
+        ("disable_lag",            {"lag_id": 1}),
+        ("enable_lag",             {"lag_id": "1"}),
+        ("change_lag_description", {"lag_id": 2, "lag_description": "server"}),
+        ("change_lag_description", {"lag_id": "1", "lag_description": None}),
+        ("destroy_lag",            {"lag_id": "2"}),
+    ])
+
+
+def test_patch_error_clears():
+    # vlan created behind the cached response: the patcher fails, the entry is read again
+    switch = new_switch()
+    switch.show_vlans()
+    switch.vlans[30] = {"description": None, "enabled": True, "attached_interfaces": {}, "attached_lags": {}}
+    reads = switch.reads
+    switch.interface_attach_vlan(interface_id="te 0/5", vlan_id=30)
+    assert switch.show_vlans() == switch.vlans
+    assert switch.reads == reads + 1
+
+
+def test_failed_mutator():
+    # the device refused the change: the cached response is kept as is
+    switch = new_switch()
+    before = switch.show_vlans()
+    reads  = switch.reads
+    try:
+        switch.destroy_vlan(vlan_id=99)
+    except KeyError:
+        pass
+    assert switch.show_vlans() == before
+    assert switch.reads == reads
+
+
+def test_write_through_disabled():
+    switch = new_switch(write_through=False)
+    switch.show_vlans()
+    reads = switch.reads
+    switch.enable_vlan(vlan_id=20)
+    assert switch.show_vlans()[20]["enabled"] is True
+    assert switch.reads == reads + 1
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print "%-36s ok" % name
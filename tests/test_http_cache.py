@@ -0,0 +1,278 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# HTTP cache test: single-flight cache fills (coalesced_cache_fill(): one switch call for
+# concurrent misses, in process and across processes), their error path, and the
+# stale-if-error fallback of cached(). redis is an in-memory fake (FakeRedis): no
+# redis-server nor device is involved. Reads etc/netl2api/netl2server.cfg.
+#
+# Usage: python tests/test_http_cache.py
+
+
+import os
+import time
+import threading
+from StringIO import StringIO
+
+os.environ.setdefault("NETL2API_CFG_BASE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "etc", "netl2api"))
+
+from bottle import request, response
+from netl2api.server import http_cache
+from netl2api.l2api.exceptions import TransportTimeout, SwitchCommandException
+
+try:
+    from cPickle import dumps, loads
+except ImportError:
+    from pickle import dumps, loads
+
+
+class FakeRedis(object):
+    """ The redis commands used by http_cache (values and expiration times, no persistence) """
+
+    def __init__(self):
+        self.data     = {}
+        self.expires  = {}
+        self.locks    = set()
+        self.commands = 0
+        self._lock    = threading.RLock()
+
+    def _alive(self, key):
+        if self.expires.has_key(key) and self.expires[key] <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.has_key(key)
+
+    def get(self, key):
+        with self._lock:
+            self.commands += 1
+            return self.data.get(key) if self._alive(key) else None
+
+    def ttl(self, key):
+        with self._lock:
+            self.commands += 1
+            if not self._alive(key) or not self.expires.has_key(key):
+                return None
+            return int(round(self.expires[key] - time.time()))
+
+    def setex(self, key, value, ttl):
+        with self._lock:
+            self.commands += 1
+            self.data[key]    = value
+            self.expires[key] = time.time() + ttl
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self.commands += 1
+            if not self._alive(key):
+                self.data[key] = set()
+            self.data[key].update(members)
+
+    def expire(self, key, ttl):
+        with self._lock:
+            self.commands += 1
+            if self._alive(key):
+                self.expires[key] = time.time() + ttl
+
+    def register_script(self, script):
+        assert script == http_cache.TAG_CACHE_ENTRY_LUA
+        def tag_cache_entry(keys=[], args=[]):
+            with self._lock:
+                self.sadd(keys[0], args[0])
+                if (self.ttl(keys[0]) or -1) < args[1]:
+                    self.expire(keys[0], args[1])
+        return tag_cache_entry
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def lock(self, name, timeout=None):
+        return FakeLock(self, name)
+
+
+class FakePipeline(object):
+    def __init__(self, cache_db):
+        self.cache_db = cache_db
+        self.queued   = []
+
+    def __getattr__(self, name):
+        command = getattr(self.cache_db, name)
+        return lambda *args: self.queued.append((command, args))
+
+    def execute(self):
+        with self.cache_db._lock:
+            return [command(*args) for command, args in self.queued]
+
+
+class FakeLock(object):
+    def __init__(self, cache_db, name):
+        self.cache_db = cache_db
+        self.name     = name
+
+    def acquire(self, blocking=True):
+        with self.cache_db._lock:
+            if self.name in self.cache_db.locks:
+                return False
+            self.cache_db.locks.add(self.name)
+            return True
+
+    def release(self):
+        with self.cache_db._lock:
+            self.cache_db.locks.discard(self.name)
+
+
+class FakeRedisClient(object):
+    def __init__(self, cache_db):
+        self.cache_db = cache_db
+
+    def get_connection(self):
+        return self.cache_db
+
+
+class SwitchCall(object):
+    """ 'call' argument of coalesced_cache_fill(): counts the switch operations """
+
+    def __init__(self, result=None, exc=None, delay=0.2):
+        self.result = result
+        self.exc    = exc
+        self.delay  = delay
+        self.calls  = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.exc is not None:
+            raise self.exc
+        return self.result
+
+
+def concurrently(n, f):
+    results = [None] * n
+    def run(i):
+        try:
+            results[i] = ("ok", f())
+        except Exception, e:
+            results[i] = ("error", e)
+    threads = [threading.Thread(target=run, args=(i,)) for i in xrange(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def setup():
+    http_cache.local_cache_enable = False
+    http_cache._flights.clear()
+    cache_db = FakeRedis()
+    http_cache.redis_cli = FakeRedisClient(cache_db)
+    return cache_db
+
+
+def test_single_flight():
+    cache_db = setup()
+    rkey     = "cache:GET:/vlans/sw0001:x"
+    call     = SwitchCall(result={10: {"description": "web"}})
+    results  = concurrently(8, lambda: http_cache.coalesced_cache_fill(cache_db, rkey, "/vlans/sw0001", 600, call, 0))
+    assert call.calls == 1, call.calls
+    assert [r[0] for r in results] == ["ok"] * 8, results
+    leaders = [r[1][1] for r in results]
+    assert leaders.count(True) == 1 and leaders.count(False) == 7, leaders
+    for status, (r, leader, stale_age) in results:
+        assert r == call.result and stale_age is None
+    # stored for ttl + stale_max, tagged for invalidate_cache()
+    assert loads(cache_db.get(rkey)) == call.result
+    assert 600 + http_cache.stale_max - 2 <= cache_db.ttl(rkey) <= 600 + http_cache.stale_max
+    assert rkey in cache_db.data["cache-tag:/vlans/sw0001"]
+    assert cache_db.ttl("cache-tag:/vlans/sw0001") == cache_db.ttl(rkey)
+    assert not http_cache._flights and not cache_db.locks
+    # a later miss (eg. after an invalidation) calls the switch again
+    del(cache_db.data[rkey])
+    http_cache.coalesced_cache_fill(cache_db, rkey, "/vlans/sw0001", 600, call, 0)
+    assert call.calls == 2
+
+
+def test_single_flight_error():
+    cache_db = setup()
+    rkey     = "cache:GET:/vlans/sw0001:x"
+    call     = SwitchCall(exc=TransportTimeout("switch timeout"))
+    results  = concurrently(8, lambda: http_cache.coalesced_cache_fill(cache_db, rkey, "/vlans/sw0001", 600, call, 0))
+    assert call.calls == 1, call.calls
+    # the leader exception is raised by every follower
+    for status, e in results:
+        assert status == "error" and isinstance(e, TransportTimeout), (status, e)
+    assert cache_db.get(rkey) is None
+    assert not http_cache._flights and not cache_db.locks
+    # the failed flight is gone: the next miss calls the switch
+    call.exc    = None
+    call.result = {}
+    assert http_cache.coalesced_cache_fill(cache_db, rkey, "/vlans/sw0001", 600, call, 0) == ({}, True, None)
+    assert call.calls == 2
+
+
+def test_cross_process_flight():
+    cache_db = setup()
+    rkey     = "cache:GET:/vlans/sw0001:x"
+    call     = SwitchCall(result="own call")
+    # another netl2server process holds the flight lock and fills the cache meanwhile
+    cache_db.locks.add("flight:%s" % rkey)
+    threading.Timer(0.3, cache_db.setex, (rkey, dumps("other process"), 600 + http_cache.stale_max)).start()
+    t0 = time.time()
+    assert http_cache.coalesced_cache_fill(cache_db, rkey, "/vlans/sw0001", 600, call, 0) == ("other process", False, None)
+    assert call.calls == 0
+    assert time.time() - t0 < 2
+
+
+def cached_request(f, path="/vlans/sw0001"):
+    request.bind({"REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": "", "CONTENT_LENGTH": "0",
+                  "wsgi.input": StringIO(""), "context": "test"})
+    response.bind()
+    return http_cache.cached(ttl=600)(lambda: f())()
+
+
+def test_stale_if_error():
+    cache_db  = setup()
+    stale_age = http_cache.stale_while_revalidate + 10
+    if http_cache.cache_enable is False or stale_age >= http_cache.stale_if_error:
+        return
+    rkey = "cache:GET:/vlans/sw0001:%s" % http_cache.sha1("").hexdigest()
+    # expired entry, past stale_while_revalidate and within stale_if_error
+    cache_db.setex(rkey, dumps("stale"), http_cache.stale_max - stale_age)
+    # device failure: the stale entry is served
+    assert cached_request(SwitchCall(exc=TransportTimeout("switch timeout"), delay=0)) == "stale"
+    assert response.headers.get("Warning", "").startswith("111")
+    # any other error is raised
+    for exc in (SwitchCommandException("% Error: Invalid input"), KeyError(10)):
+        try:
+            cached_request(SwitchCall(exc=exc, delay=0))
+        except exc.__class__:
+            pass
+        else:
+            raise AssertionError("stale entry served on %s" % exc.__class__.__name__)
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print "%-36s ok" % name
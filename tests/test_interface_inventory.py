@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# InterfaceInventory / lookup_interface() test: alias resolution, ambiguous aliases, malformed ids, TTL and
+# miss refreshes (rate limited, one listing for concurrent callers), and the vendor listings
+# of the switch simulator. No device is involved.
+#
+# Usage: python tests/test_interface_inventory.py
+
+
+import time
+import threading
+import switch_sim
+from netl2api.l2api import inventory
+from netl2api.l2api.inventory import InterfaceInventory, lookup_interface, configure_interface_inventory
+from netl2api.l2api.dell import force10utils
+from netl2api.l2api.brocade import netironutils, vdx67xxutils
+
+
+class FakeTransport(object):
+    def __init__(self, host="sw", port=22):
+        self.host = host
+        self.port = port
+
+
+class Listing(object):
+    """ list_interfaces() counting its calls """
+
+    def __init__(self, interfaces, delay=0):
+        self.interfaces = interfaces
+        self.delay      = delay
+        self.calls      = 0
+        self._lock      = threading.Lock()
+
+    def __call__(self, transport):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return list(self.interfaces)
+
+
+class SimTransport(FakeTransport):
+    def __init__(self, dialect):
+        super(SimTransport, self).__init__(host=dialect)
+        self.outputs = switch_sim.builtin_outputs(dialect=dialect, ports=8, vlans=4, lags=2, macs=0)
+
+    def execute(self, cmd):
+        return self.outputs[cmd]
+
+
+def test_aliases():
+    inv = InterfaceInventory([("te 0/1", ["TenGigabitEthernet 0/1", "TenGigabitEthernet0/1", "te0/1", "0/1"])])
+    for alias in ("te 0/1", "TE 0/1", "  te   0/1 ", "TenGigabitEthernet 0/1", "tengigabitethernet0/1", "Te0/1", "0/1"):
+        assert inv.get(alias) == "te 0/1", alias
+    for alias in ("te 0/2", "0/10", "", None, 1):
+        assert inv.get(alias) is None, alias
+    assert inv.interfaces == frozenset(["te 0/1"])
+
+
+def test_ambiguous_aliases():
+    # same stack/port on two interface types: "0/1" is dropped, the ids still resolve
+    inv = InterfaceInventory([("te 0/1", ["0/1", "te0/1"]), ("fo 0/1", ["0/1", "fo0/1"]), ("te 0/2", ["0/2"])])
+    assert inv.get("0/1") is None
+    assert inv.get("te 0/1") == "te 0/1" and inv.get("fo0/1") == "fo 0/1"
+    assert inv.get("0/2") == "te 0/2"
+    # an alias equal to another interface id never shadows it
+    inv = InterfaceInventory([("1/1", ["e 1/1"]), ("1/2", ["1/1"])])
+    assert inv.get("1/1") == "1/1"
+
+
+def test_ttl_refresh():
+    configure_interface_inventory(ttl=0.2, min_refresh_interval=3600)
+    listing   = Listing([("te 0/1", ["0/1"])])
+    transport = FakeTransport()
+    for i in xrange(10):
+        assert lookup_interface(transport, "0/1", listing) == "te 0/1"
+    assert listing.calls == 1
+    time.sleep(0.3)
+    assert lookup_interface(transport, "0/1", listing) == "te 0/1"
+    assert listing.calls == 2
+    # per device
+    assert lookup_interface(FakeTransport(port=23), "0/1", listing) == "te 0/1"
+    assert listing.calls == 3
+
+
+def test_miss_refresh():
+    configure_interface_inventory(ttl=3600, min_refresh_interval=0.2)
+    listing   = Listing([("te 0/1", [])])
+    transport = FakeTransport()
+    assert lookup_interface(transport, "te 0/2", listing) is None
+    assert listing.calls == 1
+    # new interface (eg. module inserted): found after min_refresh_interval
+    listing.interfaces.append(("te 0/2", []))
+    for i in xrange(10):
+        assert lookup_interface(transport, "te 0/2", listing) is None
+    assert listing.calls == 1
+    time.sleep(0.3)
+    assert lookup_interface(transport, "te 0/2", listing) == "te 0/2"
+    assert listing.calls == 2
+    # invalid ids don't list the device more than once per min_refresh_interval
+    time.sleep(0.3)
+    for i in xrange(10):
+        assert lookup_interface(transport, "te 0/99", listing) is None
+    assert listing.calls == 3
+
+
+def test_concurrent_refresh():
+    configure_interface_inventory(ttl=3600, min_refresh_interval=0)
+    listing   = Listing([("te 0/1", [])], delay=0.2)
+    transport = FakeTransport()
+    results   = []
+    def lookup():
+        results.append(lookup_interface(transport, "te 0/1", listing))
+    threads = [threading.Thread(target=lookup) for i in xrange(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["te 0/1"] * 8
+    assert listing.calls == 1, listing.calls
+    # concurrent misses: one listing
+    calls   = listing.calls
+    threads = [threading.Thread(target=lambda: lookup_interface(transport, "te 0/99", listing)) for i in xrange(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert listing.calls == calls + 1, listing.calls
+
+
+def test_vendor_listings():
+    configure_interface_inventory(ttl=3600, min_refresh_interval=3600)
+    for dialect, parse_interface_id, aliases in (
+            ("force10", force10utils.parse_interface_id,
+                 {"te 0/1": "te 0/1", "TenGigabitEthernet 0/1": "te 0/1", "Te0/7": "te 0/7", "0/3": "te 0/3"}),
+            ("netiron", netironutils.parse_interface_id,
+                 {"1/1": "1/1", "ethernet 1/2": "1/2", "ethe 1/8": "1/8", "e 1/3": "1/3"}),
+            ("vdx",     vdx67xxutils.parse_interface_id,
+                 {"te 1/0/1": "te 1/0/1", "TenGigabitEthernet 1/0/2": "te 1/0/2", "Te1/0/3": "te 1/0/3", "1/0/8": "te 1/0/8"})):
+        transport = SimTransport(dialect)
+        for alias, interface_id in aliases.iteritems():
+            assert parse_interface_id(transport, alias) == interface_id, (dialect, alias)
+        for invalid in ("te 0/99", "1/99", "te 1/0/99", "port-channel 1", "vlan 2"):
+            try:
+                parse_interface_id(transport, invalid)
+            except Exception, e:
+                assert "No such interface" in str(e) or "Invalid" in str(e), e
+            else:
+                raise AssertionError("%s: '%s' accepted" % (dialect, invalid))
+
+
+def test_malformed_ids():
+    # rejected by the format checks: the device is never listed
+    configure_interface_inventory(ttl=3600, min_refresh_interval=0)
+    class NoDevice(FakeTransport):
+        def execute(self, cmd):
+            raise AssertionError("device listed => '%s'" % cmd)
+    for parse_interface_id, malformed in (
+            (force10utils.parse_interface_id, ("te", "te 0/x", "te 12/1", "te 0/1/1", "te-0/1", "", None, 1)),
+            (netironutils.parse_interface_id, ("1", "x 1/1", "1/1/1", "ethernet 17/1", "", None)),
+            (vdx67xxutils.parse_interface_id, ("te 0/1", "te 240/0/1", "te 1/17/1", "te 1/0/x", "", None))):
+        for interface_id in malformed:
+            try:
+                parse_interface_id(NoDevice(), interface_id)
+            except AssertionError:
+                raise
+            except Exception, e:
+                assert "Invalid" in str(e), (interface_id, e)
+            else:
+                raise AssertionError("'%s' accepted" % interface_id)
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_") and callable(test):
+            inventory.clear_interface_inventories()
+            test()
+            print "%-36s ok" % name
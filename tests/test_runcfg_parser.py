@@ -0,0 +1,288 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# cisco_like_runcfg_parser() golden-output test: the keyword-dispatch parser must return
+# the same dict as the previous regex-chain implementation (kept below) for the running
+# configs of every dialect of the switch simulator, hand-written FTOS/NetIron/NOS/IOS
+# snippets and odd lines; GOLDEN_RUNCFG must parse to GOLDEN_PARSED.
+#
+# Usage: python tests/test_runcfg_parser.py
+
+
+import re
+import switch_sim
+from netl2api.l2api.utils import cisco_like_runcfg_parser, RE_CISCOLIKE_CFG_IF_NAME, \
+                                 RE_CISCOLIKE_CFG_IF_DESC, RE_CISCOLIKE_CFG_IP_ADDR, RE_CISCOLIKE_CFG_IF_MTU, \
+                                 RE_CISCOLIKE_CFG_IF_SPEED, RE_CISCOLIKE_CFG_IF_DUPLEX, \
+                                 RE_CISCOLIKE_CFG_IF_VLAN_TAGGED, RE_CISCOLIKE_CFG_IF_VLAN_UNTAGGED, \
+                                 RE_CISCOLIKE_CFG_IF_LAG, RE_CISCOLIKE_CFG_IF_LAG_PRIPORT, \
+                                 RE_CISCOLIKE_CFG_IF_LAG_PORTS, RE_CISCOLIKE_CFG_IF_ADM_STATE
+
+
+RE_CISCOLIKE_CFG_COMMENT = re.compile(r"^!")
+
+
+def legacy_cisco_like_runcfg_parser(rawruncfg=None):
+    """ previous implementation (every regex tried in sequence on each line) """
+    currnt_if_name = None
+    parsed_runcfg  = {}
+    if isinstance(rawruncfg, basestring):
+        rawruncfg = rawruncfg.splitlines()
+    for runcfg_ln in rawruncfg:
+        if RE_CISCOLIKE_CFG_COMMENT.search(runcfg_ln):
+            continue
+        m = RE_CISCOLIKE_CFG_IF_NAME.search(runcfg_ln)
+        if m:
+            #currnt_if_name = m.group(1).strip()
+            currnt_if_name = m.group(1) or m.group(2) or m.group(3)
+            currnt_if_name = currnt_if_name.strip()
+            parsed_runcfg[currnt_if_name] = {}
+            continue
+        m = RE_CISCOLIKE_CFG_IF_DESC.search(runcfg_ln)
+        if m:
+            parsed_runcfg[currnt_if_name]["description"] = m.group(1).strip()
+            continue
+        m = RE_CISCOLIKE_CFG_IP_ADDR.search(runcfg_ln)
+        if m:
+            if not parsed_runcfg[currnt_if_name].has_key("ip_addr"):
+                parsed_runcfg[currnt_if_name]["ip_addr"] = []
+            parsed_runcfg[currnt_if_name]["ip_addr"].append(m.group(1).strip())
+            continue
+        m = RE_CISCOLIKE_CFG_IF_MTU.search(runcfg_ln)
+        if m:
+            parsed_runcfg[currnt_if_name]["mtu"] = m.group(1).strip()
+            continue
+        m = RE_CISCOLIKE_CFG_IF_SPEED.search(runcfg_ln)
+        if m:
+            parsed_runcfg[currnt_if_name]["speed"] = m.group(1).strip()
+            continue
+        m = RE_CISCOLIKE_CFG_IF_DUPLEX.search(runcfg_ln)
+        if m:
+            parsed_runcfg[currnt_if_name]["duplex"] = m.group(1).strip()
+            continue
+        m = RE_CISCOLIKE_CFG_IF_VLAN_TAGGED.search(runcfg_ln)
+        if m:
+            if not parsed_runcfg[currnt_if_name].has_key("vlan_tagged_ifs"):
+                parsed_runcfg[currnt_if_name]["vlan_tagged_ifs"] = []
+            parsed_runcfg[currnt_if_name]["vlan_tagged_ifs"].append(m.group(1).strip())
+            continue
+        m = RE_CISCOLIKE_CFG_IF_VLAN_UNTAGGED.search(runcfg_ln)
+        if m:
+            if not parsed_runcfg[currnt_if_name].has_key("vlan_untagged_ifs"):
+                parsed_runcfg[currnt_if_name]["vlan_untagged_ifs"] = []
+            parsed_runcfg[currnt_if_name]["vlan_untagged_ifs"].append(m.group(1).strip())
+            continue
+        m = RE_CISCOLIKE_CFG_IF_LAG.search(runcfg_ln)
+        if m:
+            parsed_runcfg[currnt_if_name]["lag"] = m.group(1).strip()
+            continue
+        m = RE_CISCOLIKE_CFG_IF_LAG_PRIPORT.search(runcfg_ln)
+        if m:
+            parsed_runcfg[currnt_if_name]["lag_primary_port"] = m.group(1).strip()
+            continue
+        m = RE_CISCOLIKE_CFG_IF_LAG_PORTS.search(runcfg_ln)
+        if m:
+            parsed_runcfg[currnt_if_name]["lag_ports"] = m.group(1).strip()
+            continue
+        m = RE_CISCOLIKE_CFG_IF_ADM_STATE.search(runcfg_ln)
+        if m:
+            parsed_runcfg[currnt_if_name]["adm_state"] = m.group(1).strip()
+            continue
+    return parsed_runcfg
+
+
+GOLDEN_RUNCFG = "\r\n".join([
+    "Current Configuration ...",
+    "! Version 8.3.12.1",
+    "!",
+    "interface TenGigabitEthernet 0/1",
+    " description server-1 (eth0)",
+    " no ip address",
+    " mtu 9252",
+    " switchport",
+    " no shutdown",
+    "!",
+    "interface TenGigabitEthernet 0/2",
+    " description lag-member",
+    " no ip address",
+    " port-channel-protocol LACP",
+    "  port-channel 1 mode active",
+    " shutdown",
+    "!",
+    "interface Port-channel 1",
+    " no ip address",
+    " switchport",
+    " no shutdown",
+    "!",
+    "interface Vlan 10",
+    "  description  web servers ",
+    " ip address 10.0.10.1/24",
+    " ip address 10.0.11.1/24 secondary",
+    " tagged TenGigabitEthernet 0/1,3-5",
+    " tagged Port-channel 1",
+    " untagged TenGigabitEthernet 0/6",
+    " shutdown",
+    "!",
+    "vlan 20 name backup",
+    " tagged ethe 1/1 to 1/4 ethe 2/1",
+    " untagged ethe 1/5",
+    "!",
+    "lag \"uplink\" dynamic id 2",
+    " ports ethe 1/1 ethe 1/2",
+    " primary-port 1/1",
+    " deploy",
+    "!",
+    "interface ethernet 1/1",
+    " port-name uplink",
+    " speed-duplex 10G-full",
+    " enable",
+    "!",
+    "interface GigabitEthernet1/0/7",
+    " switchport trunk native vlan 30",
+    " switchport trunk allowed vlan 30-40,50",
+    " switchport access vlan 30",
+    " switchport mode trunk",
+    " speed 1000",
+    " duplex full",
+    " channel-group 5 mode active",
+    " disable",
+    "!",
+    "end"])
+
+GOLDEN_PARSED = {
+    "TenGigabitEthernet 0/1":    {"description": "server-1 (eth0)", "mtu": "9252", "adm_state": "no shutdown"},
+    "TenGigabitEthernet 0/2":    {"description": "lag-member", "lag": "1", "adm_state": "shutdown"},
+    "Port-channel 1":            {"adm_state": "no shutdown"},
+    "Vlan 10":                   {"description": "web servers", "ip_addr": ["10.0.10.1/24", "10.0.11.1/24 secondary"],
+                                  "vlan_tagged_ifs": ["TenGigabitEthernet 0/1,3-5", "Port-channel 1"],
+                                  "vlan_untagged_ifs": ["TenGigabitEthernet 0/6"], "adm_state": "shutdown"},
+    "20 name backup":            {"vlan_tagged_ifs": ["ethe 1/1 to 1/4 ethe 2/1"], "vlan_untagged_ifs": ["ethe 1/5"]},
+    "\"uplink\" dynamic id 2":   {"lag_ports": "ethe 1/1 ethe 1/2", "lag_primary_port": "1/1"},
+    "ethernet 1/1":              {"adm_state": "enable"},
+    "GigabitEthernet1/0/7":      {"vlan_untagged_ifs": ["30", "30"], "vlan_tagged_ifs": ["30-40,50"],
+                                  "speed": "1000", "duplex": "full", "lag": "5", "adm_state": "disable"},
+}
+
+# lines close to a keyword (indentation, separators, line ends)
+ODD_RUNCFG = [
+    "interface Vlan 1\r",
+    "\tdescription\ttab separated",
+    "   description three spaces",
+    "  mtu 1500",
+    " mtu\t1500",
+    "\tspeed 100",
+    "  speed 1000",
+    " speed10",
+    " tagged  Te 0/1",
+    "\ttagged Te 0/2",
+    "  untagged Te 0/3",
+    " switchport  trunk allowed vlan 5",
+    " switchport trunk\tallowed vlan 6",
+    " switchport access vlan 7 ",
+    " channel-group 1 mode on mode active",
+    " port-channel 2 mode active",
+    "   port-channel 3 mode active",
+    "  channel-group 4 mode active",
+    " ports",
+    "  ports ethe 1/1",
+    " primary-port",
+    " no  shutdown",
+    "no shutdown",
+    "\t\tshutdown",
+    " shutdown now",
+    " enable\r",
+    "description not indented",
+    "!interface Vlan 2",
+    " ! tagged Te 0/4",
+    "interface\tVlan 3",
+    " interface Vlan 4",
+    "interfaceVlan 5",
+    "interface",
+    "lag",
+    "vlan ",
+    "",
+    "   ",
+    "vlan 6",
+    " ip address",
+    " ip  address 10.0.0.1/8",
+    " ipaddress 10.0.0.2/8",
+    "interface Vlan 1",
+    " untagged Te 0/5",
+]
+
+
+def parse_outcome(parser, rawruncfg):
+    try:
+        return parser(rawruncfg)
+    except Exception, e:
+        # eg. " ip address\n" (no address): both raise the same exception
+        return e.__class__
+
+
+def check_equivalent(rawruncfg, label):
+    expected = parse_outcome(legacy_cisco_like_runcfg_parser, rawruncfg)
+    parsed   = parse_outcome(cisco_like_runcfg_parser, rawruncfg)
+    assert parsed == expected, "%s: %r != %r" % (label, parsed, expected)
+    # execute_stream() input (line ends kept)
+    lines = rawruncfg.splitlines(True) if isinstance(rawruncfg, basestring) else rawruncfg
+    assert parse_outcome(cisco_like_runcfg_parser, iter(lines)) == \
+                parse_outcome(legacy_cisco_like_runcfg_parser, iter(lines)), label
+
+
+def test_golden():
+    assert cisco_like_runcfg_parser(GOLDEN_RUNCFG) == GOLDEN_PARSED
+    check_equivalent(GOLDEN_RUNCFG, "golden")
+
+
+def test_odd_lines():
+    check_equivalent(ODD_RUNCFG, "odd lines")
+    check_equivalent("\n".join(ODD_RUNCFG), "odd lines (text)")
+    for i in xrange(len(ODD_RUNCFG)):
+        check_equivalent(["interface Vlan 1"] + ODD_RUNCFG[i:i+1], "odd line %r" % ODD_RUNCFG[i])
+        check_equivalent(["interface Vlan 1", ODD_RUNCFG[i] + "\n"], "odd line %r (LF)" % ODD_RUNCFG[i])
+
+
+def test_attribute_before_interface():
+    for runcfg in ([" mtu 1500"], [" description x", "interface Vlan 1"]):
+        for parser in (legacy_cisco_like_runcfg_parser, cisco_like_runcfg_parser):
+            try:
+                parser(runcfg)
+            except KeyError:
+                continue
+            raise AssertionError("%s: no KeyError" % parser.__name__)
+
+
+def test_simulator_configs():
+    for dialect in ("force10", "netiron", "vdx"):
+        outputs = switch_sim.builtin_outputs(dialect=dialect, ports=96, vlans=300, lags=8, macs=0)
+        for cmd, output in outputs.iteritems():
+            if cmd.startswith("show running"):
+                check_equivalent(output, "%s: %s" % (dialect, cmd))
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print "%-36s ok" % name
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+# @author: Eduardo S. Scarpellini
+# @author: Luiz Ozaki
+
+
+__copyright__ = "Copyright 2012, Locaweb IDC"
+
+
+# TransportPool test: checkout/checkin, wait_timeout, eviction of sessions after transport
+# errors (and of dead idle sessions), and sessions closed with the pool lock released.
+# Sessions are fake transports: no device is involved.
+#
+# Usage: python tests/test_transport_pool.py
+
+
+import time
+import socket
+import threading
+from netl2api.l2api.exceptions import *
+from netl2api.l2api.transport import L2Transport
+from netl2api.l2api.transport.TransportManager import TransportPool
+
+
+class FakeConnection(object):
+    closed = False
+
+
+class FakeTransport(object):
+    """ L2Transport stand-in: execute() returns 'cmd' or raises the exception queued in 'errors' """
+
+    device_failures = L2Transport.device_failures
+    pool            = None
+    instances       = []
+
+    def __init__(self, host="sw", port=22, username="netl2api", **kwargs):
+        self.host        = host
+        self.port        = port
+        self.username    = username
+        self.crlf        = False
+        self.errors      = []
+        self.closed      = False
+        self._connection = None
+        FakeTransport.instances.append(self)
+
+    def execute(self, cmd=None, interactions=None):
+        self._connection = FakeConnection()
+        if self.errors:
+            raise self.errors.pop(0)
+        return cmd
+
+    def execute_many(self, cmds=None):
+        return [self.execute(cmd) for cmd in cmds]
+
+    def execute_stream(self, cmd=None):
+        for line in self.execute(cmd).split():
+            yield line
+
+    def close(self):
+        # closing a session may block: never with the pool lock held
+        if self.pool is not None:
+            assert self.pool._cond.acquire(False) is True, "session closed with the pool lock held"
+            self.pool._cond.release()
+        self.closed = True
+
+
+def new_pool(**kwargs):
+    FakeTransport.instances = []
+    pool = FakeTransport.pool = TransportPool(transport=FakeTransport, **kwargs)
+    return pool
+
+
+def test_checkout_checkin():
+    pool = new_pool(max_connections=2, wait_timeout=1)
+    t1   = pool.checkout()
+    t2   = pool.checkout()
+    assert t1 is not t2
+    assert len(FakeTransport.instances) == 2
+    pool.checkin(t1)
+    # idle sessions are reused
+    assert pool.checkout() is t1
+    pool.checkin(t1)
+    pool.checkin(t2)
+    assert pool.execute("show version") == "show version"
+    assert pool.execute_many(["a", "b"]) == ["a", "b"]
+    assert list(pool.execute_stream("a b")) == ["a", "b"]
+    assert len(FakeTransport.instances) == 2
+
+
+def test_checkout_timeout():
+    pool = new_pool(max_connections=1, wait_timeout=0.2)
+    t1   = pool.checkout()
+    t0   = time.time()
+    try:
+        pool.checkout()
+    except NoTransportConnectionsAvailable:
+        assert 0.15 <= time.time() - t0 < 1, time.time() - t0
+    else:
+        raise AssertionError("checkout() didn't time out")
+    # a session checked in meanwhile is handed to the waiting caller
+    threading.Timer(0.1, pool.checkin, (t1,)).start()
+    assert pool.checkout() is t1
+
+
+def test_evict_on_transport_errors():
+    pool = new_pool(max_connections=1, wait_timeout=1)
+    for exc in (TransportTimeout("timeout"), socket.error(104, "reset"), SwitchAuthenticationException("denied")):
+        transport = pool.checkout()
+        transport.errors.append(exc)
+        pool.checkin(transport)
+        try:
+            pool.execute("show version")
+        except exc.__class__:
+            pass
+        else:
+            raise AssertionError("%s not raised" % exc.__class__.__name__)
+        assert transport.closed is True
+        assert transport not in pool._transports
+        # the slot is free: a new session is opened
+        assert pool.checkout() is not transport
+        pool.checkin(pool._transports[0])
+
+
+def test_keep_on_vendor_errors():
+    pool      = new_pool(max_connections=1, wait_timeout=1)
+    transport = pool.checkout()
+    transport.errors.append(SwitchCommandException("% Error: Invalid input"))
+    pool.checkin(transport)
+    try:
+        pool.execute("show vlan 4095")
+    except SwitchCommandException:
+        pass
+    assert transport.closed is False
+    assert pool.checkout() is transport
+
+
+def test_evict_dead_idle_sessions():
+    pool      = new_pool(max_connections=1, wait_timeout=1)
+    transport = pool.checkout()
+    transport.execute("show version")
+    transport._connection.closed = True
+    pool.checkin(transport)
+    assert pool.checkout() is not transport
+    assert transport.closed is True
+
+
+def test_close():
+    pool  = new_pool(max_connections=2, wait_timeout=1)
+    idle  = pool.checkout()
+    inuse = pool.checkout()
+    pool.checkin(idle)
+    pool.close()
+    assert idle.closed is True
+    assert inuse.closed is False
+    pool.checkin(inuse)
+    assert pool.checkout() is inuse
+
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print "%-36s ok" % name